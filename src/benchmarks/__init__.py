@@ -0,0 +1,7 @@
+"""
+Offline benchmarks for the void.
+Run from the src directory, e.g. `python -m benchmarks.bulkDelete`. Each benchmark prints its results as JSON.
+`python -m benchmarks` runs the whole suite and combines the results into one JSON document.
+
+Part of the void.
+"""
@@ -0,0 +1,131 @@
+"""
+Benchmarks the batched deletion engine against the old one `message.delete(delay=...)` call per message.
+A flood of messages is sent into a number of channels and deleted through a fake REST client that enforces a per channel rate limit.
+Reports the number of REST calls made and the sustained deletion rate per channel.
+
+Usage: python -m benchmarks.bulkDelete [--messages 1000] [--channels 2] [--arrival-rate 500] [--rate-limit 50]
+
+Part of the void.
+"""
+
+import time
+import json
+import asyncio
+import argparse
+from types import SimpleNamespace
+from collections import Counter, defaultdict
+from typing import Dict, List
+
+from utils.deletionEngine import DeletionEngine
+from benchmarks.fixtures import make_snowflake
+
+
+class FakeHTTP:
+    """Stands in for discord.http.HTTPClient and utils.rateLimits.RestClient. Every call costs 'latency' seconds and is paced to 'rate_limit' calls per second per channel."""
+
+    def __init__(self, latency: float, rate_limit: float):
+        self.latency = latency
+        self.interval = 1 / rate_limit
+        self.calls = Counter()
+        self.deleted = Counter()
+        self.finished_at: Dict[int, float] = {}
+        self._next_slot = defaultdict(float)
+
+    async def _call(self, channel_id: int):
+        now = time.perf_counter()
+        slot = max(now, self._next_slot[channel_id])
+        self._next_slot[channel_id] = slot + self.interval
+        await asyncio.sleep(slot - now + self.latency)
+
+    async def close(self):
+        pass
+
+    async def delete_message(self, channel_id: int, message_id: int, **kwargs):
+        self.calls['delete_message'] += 1
+        await self._call(channel_id)
+        self.deleted[channel_id] += 1
+        self.finished_at[channel_id] = time.perf_counter()
+
+    async def delete_messages(self, channel_id: int, message_ids: List[int], **kwargs):
+        self.calls['delete_messages'] += 1
+        await self._call(channel_id)
+        self.deleted[channel_id] += len(message_ids)
+        self.finished_at[channel_id] = time.perf_counter()
+
+
+async def flood(schedule, messages: int, channels: int, arrival_rate: float, delay: float) -> float:
+    """Sends 'messages' messages spread over 'channels' channels at 'arrival_rate' msgs/sec. Returns when the first one comes due."""
+    tick = 0.01
+    per_tick = max(1, int(arrival_rate * tick))
+    first_due = time.perf_counter() + delay
+    for i in range(messages):
+        schedule(1000 + i % channels, make_snowflake(i), delay)
+        if i % per_tick == per_tick - 1:
+            await asyncio.sleep(tick)
+    return first_due
+
+
+async def wait_for_deletions(http: FakeHTTP, messages: int):
+    while sum(http.deleted.values()) < messages:
+        await asyncio.sleep(0.01)
+
+
+def summarize(http: FakeHTTP, first_due: float, messages: int, channels: int) -> Dict:
+    per_channel_rates = [http.deleted[ch] / max(http.finished_at[ch] - first_due, 1e-9) for ch in http.deleted]
+    return {
+        "rest_calls": sum(http.calls.values()),
+        "rest_calls_by_route": dict(http.calls),
+        "messages_per_rest_call": messages / sum(http.calls.values()),
+        "msgs_per_sec_per_channel": sum(per_channel_rates) / channels,
+        "duration_s": max(http.finished_at.values()) - first_due,
+    }
+
+
+async def run_baseline(args) -> Dict:
+    http = FakeHTTP(args.latency, args.rate_limit)
+    loop = asyncio.get_event_loop()
+
+    def schedule(channel_id: int, message_id: int, delay: float):
+        # Mirrors discord.Message.delete(delay=...): One sleeping task and one REST call per message.
+        async def delete():
+            await asyncio.sleep(delay)
+            await http.delete_message(channel_id, message_id)
+        loop.create_task(delete())
+
+    first_due = await flood(schedule, args.messages, args.channels, args.arrival_rate, args.delay)
+    await wait_for_deletions(http, args.messages)
+    return summarize(http, first_due, args.messages, args.channels)
+
+
+async def run_batched(args) -> Dict:
+    http = FakeHTTP(args.latency, args.rate_limit)
+    engine = DeletionEngine(SimpleNamespace(loop=asyncio.get_event_loop()), rest=http)
+
+    first_due = await flood(engine.schedule, args.messages, args.channels, args.arrival_rate, args.delay)
+    await wait_for_deletions(http, args.messages)
+    return summarize(http, first_due, args.messages, args.channels)
+
+
+def run(args) -> Dict:
+    loop = asyncio.get_event_loop()
+    return {
+        "benchmark": "bulk_delete",
+        "params": vars(args),
+        "baseline": loop.run_until_complete(run_baseline(args)),
+        "batched": loop.run_until_complete(run_batched(args)),
+    }
+
+
+def get_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Batched deletion engine benchmark.")
+    parser.add_argument("--messages", type=int, default=1000)
+    parser.add_argument("--channels", type=int, default=2)
+    parser.add_argument("--arrival-rate", type=float, default=500, help="Messages per second across all channels.")
+    parser.add_argument("--delay", type=float, default=0.5, help="The channels delete_after setting.")
+    parser.add_argument("--latency", type=float, default=0.05, help="Simulated REST round trip time.")
+    parser.add_argument("--rate-limit", type=float, default=50, help="Simulated delete calls per second per channel.")
+    return parser
+
+
+if __name__ == '__main__':
+    print(json.dumps(run(get_parser().parse_args()), indent=2))
@@ -0,0 +1,86 @@
+"""
+An in-memory stand-in for the asyncpg pool, so that the cogs and the db module can be driven without a Postgres server.
+It only understands the void_channels queries that the db module makes. Other reads return no rows and writes are accepted and dropped.
+
+Part of the void.
+"""
+
+from typing import Dict, List, Optional, Iterable, Any
+
+import db
+
+
+class FakeConnection:
+
+    def __init__(self, pool: 'FakePool'):
+        self.pool = pool
+
+
+    async def fetch(self, query: str, *args) -> List[Dict[str, Any]]:
+        return self.pool.query(query, args)
+
+
+    async def fetchrow(self, query: str, *args) -> Optional[Dict[str, Any]]:
+        rows = self.pool.query(query, args)
+        return rows[0] if rows else None
+
+
+    async def fetchval(self, query: str, *args) -> Any:
+        row = await self.fetchrow(query, *args)
+        return next(iter(row.values())) if row else None
+
+
+    async def execute(self, query: str, *args) -> str:
+        self.pool.query(query, args)
+        return "OK"
+
+
+class _Acquire:
+
+    def __init__(self, pool: 'FakePool'):
+        self.pool = pool
+
+
+    async def __aenter__(self) -> FakeConnection:
+        self.pool.acquired += 1
+        return self.pool.connection
+
+
+    async def __aexit__(self, exc_type, exc, tb):
+        pass
+
+
+class FakePool:
+
+    def __init__(self, void_channels: Iterable[db.VoidChannel] = ()):
+        self.void_channels: Dict[int, Dict[str, Any]] = {}
+        for void_ch in void_channels:
+            self.add_void_channel(void_ch)
+        self.connection = FakeConnection(self)
+        self.acquired = 0
+        self.queries = 0
+
+
+    def add_void_channel(self, void_ch: db.VoidChannel):
+        self.void_channels[void_ch.channel_id] = vars(void_ch).copy()
+
+
+    def acquire(self) -> _Acquire:
+        return _Acquire(self)
+
+
+    async def close(self):
+        pass
+
+
+    def query(self, query: str, args: tuple) -> List[Dict[str, Any]]:
+        self.queries += 1
+        query = ' '.join(query.split())
+        if not query.startswith('SELECT') or 'FROM void_channels' not in query:
+            return []
+        if query.endswith('WHERE channel_id = $1'):
+            row = self.void_channels.get(args[0])
+            return [row] if row is not None else []
+        if query.endswith('WHERE server_id = $1'):
+            return [row for row in self.void_channels.values() if row['server_id'] == args[0]]
+        return list(self.void_channels.values())
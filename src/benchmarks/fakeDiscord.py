@@ -0,0 +1,582 @@
+"""
+A local stand-in for the Discord REST API and gateway, so that a VBot can be load tested end to end without touching Discord.
+Point a bot at it with the 'api_base' config key (see VBot.set_api_base). The bot then fetches the gateway URL from it too.
+
+The REST side implements the routes that the bot uses: users/@me, the gateway URLs, sending, editing and fetching messages,
+single and bulk deletes, and listing, creating and executing webhooks. Every request is counted per route, and is
+limited per route and major parameter (channel or webhook) plus a global limit, answering with the same X-RateLimit
+headers and 429 responses that Discord does.
+The gateway side does HELLO/IDENTIFY/READY, sends a GUILD_CREATE for every guild on the shard, answers heartbeats, and
+then dispatches whatever flood() generates. Deleted messages are dispatched as MESSAGE_DELETE events, like Discord does.
+
+Standalone usage, to run a real bot against it:
+    python -m benchmarks.fakeDiscord [--port 8080] [--guilds 20] [--channels 5] [--messages 10000] [--rate 500] [--delay 30]
+With the config of the bot set to {"api_base": "http://127.0.0.1:8080/api/v7", "token": "anything", ...}.
+The flood starts 'delay' seconds after the first shard connects, and a summary is printed once the messages are deleted.
+
+Part of the void.
+"""
+
+import json
+import math
+import time
+import random
+import asyncio
+import logging
+import argparse
+import itertools
+from collections import Counter
+from typing import Optional, Dict, List, Tuple, Any
+
+from aiohttp import web, WSMsgType
+
+from utils.histogram import LogHistogram
+from utils.deletionEngine import snowflake_timestamp
+from benchmarks.fixtures import BOT_USER_ID, make_snowflake, user_payload, guild_payload, message_payload
+
+log = logging.getLogger(__name__)
+
+API_PATH = "/api/v7"
+GATEWAY_PATH = "/gateway-ws"
+
+BASE_GUILD_ID = 500000000000000000
+BASE_AUTHOR_ID = 600000000000000000
+FOREIGN_WEBHOOK_ID = 800000000000000000  # Webhook messages in the flood come from this webhook, which is not the bot's.
+
+# Per route limits as (requests, per seconds), for each channel or webhook. Close to what Discord reports for a bot.
+ROUTE_LIMITS = {
+    'delete_message': (5, 1.0),
+    'delete_messages': (1, 1.0),
+    'send_message': (5, 5.0),
+    'get_messages': (5, 5.0),
+    'edit_message': (5, 5.0),
+    'edit_channel': (5, 5.0),
+    'get_webhooks': (5, 5.0),
+    'create_webhook': (5, 5.0),
+    'execute_webhook': (5, 2.0),
+}
+GLOBAL_LIMIT = 50  # Requests per second across all routes.
+BULK_DELETE_MAX_AGE = 14 * 24 * 60 * 60
+
+HEARTBEAT_INTERVAL = 41250  # ms
+
+
+def _json(data: Any, status: int = 200, headers: Optional[Dict[str, str]] = None) -> web.Response:
+    """discord.py only decodes bodies whose content type is exactly application/json, so aiohttp's json_response (which adds a charset) won't do."""
+    return web.Response(body=json.dumps(data).encode(), status=status, headers={**(headers or {}), 'Content-Type': 'application/json'})
+
+
+class RateLimit:
+    """A fixed window rate limit, which is how Discord's buckets behave from the outside."""
+
+    __slots__ = ('limit', 'per', 'remaining', 'reset_at')
+
+    def __init__(self, limit: int, per: float):
+        self.limit = limit
+        self.per = per
+        self.remaining = limit
+        self.reset_at = 0.0
+
+    def hit(self, now: float) -> float:
+        """Takes a request from the window. Returns 0 if it is allowed, otherwise how long until the window resets."""
+        if now >= self.reset_at:
+            self.remaining = self.limit
+            self.reset_at = now + self.per
+        if self.remaining <= 0:
+            return self.reset_at - now
+        self.remaining -= 1
+        return 0.0
+
+    def headers(self, now: float, bucket: str) -> Dict[str, str]:
+        reset_after = max(self.reset_at - now, 0)
+        return {
+            'X-RateLimit-Limit': str(self.limit),
+            'X-RateLimit-Remaining': str(self.remaining),
+            'X-RateLimit-Reset': f"{time.time() + reset_after:.3f}",
+            'X-RateLimit-Reset-After': f"{reset_after:.3f}",
+            'X-RateLimit-Bucket': bucket,
+        }
+
+
+class GatewaySession:
+    """One connected shard."""
+
+    def __init__(self, ws: web.WebSocketResponse, shard_id: int, shard_count: int):
+        self.ws = ws
+        self.shard_id = shard_id
+        self.shard_count = shard_count
+        self.session_id = f"{random.getrandbits(64):016x}"
+        self.sequence = 0
+
+    async def send(self, op: int, data: Any, event: Optional[str] = None):
+        payload = {'op': op, 'd': data, 's': None, 't': event}
+        if op == 0:
+            self.sequence += 1
+            payload['s'] = self.sequence
+        await self.ws.send_str(json.dumps(payload))
+
+
+class FakeDiscord:
+
+    def __init__(self, guilds: int = 20, channels_per_guild: int = 5, latency: float = 0.0,
+                 route_limits: Optional[Dict[str, Tuple[int, float]]] = None, global_limit: int = GLOBAL_LIMIT):
+        self.latency = latency
+        self.route_limits = {**ROUTE_LIMITS, **(route_limits or {})}
+        self.global_limit = RateLimit(global_limit, 1.0)
+        self.limits: Dict[Tuple[str, int], RateLimit] = {}
+
+        # Spread the guild IDs over the timestamp bits, so that they spread over the shards like real ones.
+        self.guilds: Dict[int, List[int]] = {BASE_GUILD_ID + (g << 22): [BASE_GUILD_ID + (g << 22) + c + 1 for c in range(channels_per_guild)]
+                                             for g in range(guilds)}
+        self.channel_guilds: Dict[int, int] = {ch_id: guild_id for guild_id, ch_ids in self.guilds.items() for ch_id in ch_ids}
+
+        self.messages: Dict[int, Tuple[int, float]] = {}  # Live messages. message_id -> (channel_id, time.time() when it was sent)
+        self.authors: Dict[int, int] = {}  # message_id -> author_id, for the messages that were not sent by BASE_AUTHOR_ID
+        self.edits = Counter()  # message_id -> times edited
+        self.deleted: Dict[int, Tuple[float, float]] = {}  # message_id -> (sent at, deleted at)
+        self.webhooks: Dict[int, Dict[str, Any]] = {}  # webhook_id -> webhook payload
+        self.member_roles: Dict[Tuple[int, int], List[int]] = {}  # (guild_id, user_id) -> role IDs. Other users are not members.
+        self.slowmode: Dict[int, int] = {}  # channel_id -> slowmode delay in seconds, for the channels that have one
+        self.last_posts: Dict[Tuple[int, int], float] = {}  # (channel_id, author_id) -> time.time() of the last flood message
+        self.slowmode_rejected = 0  # Flood messages that slowmode kept from being sent.
+        self.duplicate_ids_rejected = 0  # Bulk deletes that Discord would reject for listing a message twice.
+        self.uploads: List[Tuple[str, bytes]] = []  # (filename, contents) of the files that the bot sent
+        self.sessions: Dict[int, GatewaySession] = {}  # shard_id -> the connected shard
+        self.connected = asyncio.Event()
+
+        self.calls = Counter()  # route -> requests
+        self.ratelimited = Counter()  # route -> 429s
+        self.global_ratelimited = 0
+        self.dropped_events = 0  # Events for shards that were not connected.
+        self.sent = 0
+        self._sequence = itertools.count()
+
+        self.app = web.Application()
+        self.app.add_routes([
+            web.get(GATEWAY_PATH, self.gateway),
+            web.get(f"{API_PATH}/gateway", self._route('get_gateway', self.get_gateway)),
+            web.get(f"{API_PATH}/gateway/bot", self._route('get_gateway_bot', self.get_gateway_bot)),
+            web.get(f"{API_PATH}/users/@me", self._route('get_user', self.get_user)),
+            web.get(f"{API_PATH}/guilds/{{guild_id}}/members/{{member_id}}", self._route('get_member', self.get_member, 'guild_id')),
+            web.patch(f"{API_PATH}/channels/{{channel_id}}", self._route('edit_channel', self.edit_channel)),
+            web.post(f"{API_PATH}/channels/{{channel_id}}/messages", self._route('send_message', self.send_message)),
+            web.get(f"{API_PATH}/channels/{{channel_id}}/messages", self._route('get_messages', self.get_messages)),
+            web.patch(f"{API_PATH}/channels/{{channel_id}}/messages/{{message_id}}", self._route('edit_message', self.edit_message)),
+            web.delete(f"{API_PATH}/channels/{{channel_id}}/messages/{{message_id}}", self._route('delete_message', self.delete_message)),
+            web.post(f"{API_PATH}/channels/{{channel_id}}/messages/bulk-delete", self._route('delete_messages', self.delete_messages)),
+            web.get(f"{API_PATH}/channels/{{channel_id}}/webhooks", self._route('get_webhooks', self.get_webhooks)),
+            web.post(f"{API_PATH}/channels/{{channel_id}}/webhooks", self._route('create_webhook', self.create_webhook)),
+            web.post(f"{API_PATH}/webhooks/{{webhook_id}}/{{token}}", self._route('execute_webhook', self.execute_webhook, 'webhook_id', auth=False)),
+        ])
+        self.runner: Optional[web.AppRunner] = None
+        self.url: Optional[str] = None
+
+
+    @property
+    def api_base(self) -> str:
+        return f"{self.url}{API_PATH}"
+
+
+    async def start(self, host: str = "127.0.0.1", port: int = 0):
+        """Starts serving. With port 0 a free port is picked. The URL is in self.url afterwards."""
+        self.runner = web.AppRunner(self.app, access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, host, port)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        self.url = f"http://{host}:{port}"
+
+
+    async def stop(self):
+        for session in list(self.sessions.values()):
+            await session.ws.close()
+        if self.runner is not None:
+            await self.runner.cleanup()
+
+
+    # region REST
+
+    def _route(self, route_name: str, handler, major: str = 'channel_id', auth: bool = True):
+        """Wraps a handler with the request counting, latency and rate limits."""
+        async def route(request: web.Request) -> web.Response:
+            self.calls[route_name] += 1
+            if auth and not request.headers.get('Authorization', '').startswith('Bot '):
+                return _json({'message': '401: Unauthorized', 'code': 0}, status=401)
+            if self.latency:
+                await asyncio.sleep(self.latency)
+
+            now = time.monotonic()
+            retry_after = self.global_limit.hit(now) if auth else 0.0
+            if retry_after:
+                self.global_ratelimited += 1
+                return self._too_many_requests(retry_after, {'X-RateLimit-Global': 'true'}, is_global=True)
+
+            headers = {}
+            if route_name in self.route_limits and major in request.match_info:
+                key = (route_name, int(request.match_info[major]))
+                limit = self.limits.get(key)
+                if limit is None:
+                    limit = self.limits[key] = RateLimit(*self.route_limits[route_name])
+                retry_after = limit.hit(now)
+                headers = limit.headers(now, f"{route_name}:{key[1]}")
+                if retry_after:
+                    self.ratelimited[route_name] += 1
+                    return self._too_many_requests(retry_after, headers)
+
+            response = await handler(request)
+            response.headers.update(headers)
+            return response
+        return route
+
+
+    @staticmethod
+    def _too_many_requests(retry_after: float, headers: Dict[str, str], is_global: bool = False) -> web.Response:
+        headers = {**headers, 'Retry-After': str(math.ceil(retry_after)), 'Via': '1.1 google'}  # discord.py treats a 429 without Via as a Cloudflare ban.
+        body = {'message': 'You are being rate limited.', 'retry_after': int(retry_after * 1000), 'global': is_global}
+        return _json(body, status=429, headers=headers)
+
+
+    @staticmethod
+    def _error(status: int, code: int, message: str) -> web.Response:
+        return _json({'message': message, 'code': code}, status=status)
+
+
+    async def get_gateway(self, request: web.Request) -> web.Response:
+        return _json({'url': f"{self.url.replace('http', 'ws', 1)}{GATEWAY_PATH}"})
+
+
+    async def get_gateway_bot(self, request: web.Request) -> web.Response:
+        shards = max(1, math.ceil(len(self.guilds) / 1000))
+        return _json({
+            'url': f"{self.url.replace('http', 'ws', 1)}{GATEWAY_PATH}",
+            'shards': shards,
+            'session_start_limit': {'total': 1000, 'remaining': 1000, 'reset_after': 0, 'max_concurrency': 1},
+        })
+
+
+    async def get_user(self, request: web.Request) -> web.Response:
+        return _json(user_payload(BOT_USER_ID, bot=True))
+
+
+    async def get_member(self, request: web.Request) -> web.Response:
+        guild_id, user_id = int(request.match_info['guild_id']), int(request.match_info['member_id'])
+        roles = self.member_roles.get((guild_id, user_id))
+        if roles is None:
+            return self._error(404, 10007, "Unknown Member")
+        return _json({'user': user_payload(user_id), 'roles': [str(role_id) for role_id in roles], 'joined_at': "2020-01-01T00:00:00+00:00",
+                      'deaf': False, 'mute': False})
+
+
+    async def send_message(self, request: web.Request) -> web.Response:
+        channel_id = int(request.match_info['channel_id'])
+        if channel_id not in self.channel_guilds:
+            return self._error(404, 10003, "Unknown Channel")
+        body = {}
+        if request.content_type == 'application/json':
+            body = await request.json()
+        elif request.content_type.startswith('multipart/'):  # Messages with attachments.
+            reader = await request.multipart()
+            async for part in reader:
+                if part.name == 'payload_json':
+                    body = await part.json()
+                else:
+                    self.uploads.append((part.filename, await part.read()))
+        payload = await self.create_message(channel_id, BOT_USER_ID, content=body.get('content') or "")
+        return _json(payload)
+
+
+    async def get_messages(self, request: web.Request) -> web.Response:
+        channel_id = int(request.match_info['channel_id'])
+        if channel_id not in self.channel_guilds:
+            return self._error(404, 10003, "Unknown Channel")
+        limit = min(int(request.query.get('limit', 50)), 100)
+        before = int(request.query.get('before', 1 << 63))
+        after = int(request.query.get('after', 0))
+        message_ids = sorted((m_id for m_id, (ch_id, _) in self.messages.items() if ch_id == channel_id and after < m_id < before),
+                             reverse='after' not in request.query)[:limit]
+        guild_id = self.channel_guilds[channel_id]
+        messages = [message_payload(guild_id, channel_id, m_id, self.authors.get(m_id, BASE_AUTHOR_ID)) for m_id in message_ids]
+        for message in messages:
+            message.pop('member', None)  # Like Discord, the history has no member objects.
+        return _json(messages)
+
+
+    async def edit_message(self, request: web.Request) -> web.Response:
+        channel_id = int(request.match_info['channel_id'])
+        message_id = int(request.match_info['message_id'])
+        message = self.messages.get(message_id)
+        if message is None or message[0] != channel_id:
+            return self._error(404, 10008, "Unknown Message")
+        self.edits[message_id] += 1
+        return _json(message_payload(self.channel_guilds[channel_id], channel_id, message_id, self.authors.get(message_id, BASE_AUTHOR_ID)))
+
+
+    async def delete_message(self, request: web.Request) -> web.Response:
+        channel_id = int(request.match_info['channel_id'])
+        message_id = int(request.match_info['message_id'])
+        message = self.messages.get(message_id)
+        if message is None or message[0] != channel_id:
+            return self._error(404, 10008, "Unknown Message")
+        self._delete(message_id)
+        await self.dispatch(self.channel_guilds[channel_id], 'MESSAGE_DELETE',
+                            {'id': str(message_id), 'channel_id': str(channel_id), 'guild_id': str(self.channel_guilds[channel_id])})
+        return web.Response(status=204)
+
+
+    async def delete_messages(self, request: web.Request) -> web.Response:
+        channel_id = int(request.match_info['channel_id'])
+        if channel_id not in self.channel_guilds:
+            return self._error(404, 10003, "Unknown Channel")
+        message_ids = [int(m_id) for m_id in (await request.json()).get('messages', [])]
+        if len(set(message_ids)) != len(message_ids):
+            self.duplicate_ids_rejected += 1
+            return self._error(400, 50035, "Invalid Form Body: Duplicate messages in the bulk delete.")
+        if not 2 <= len(message_ids) <= 100:
+            return self._error(400, 50016, "Provided too few or too many messages to delete. Must provide at least 2 and fewer than 100 messages to delete.")
+        now = time.time()
+        if any(now - snowflake_timestamp(m_id) >= BULK_DELETE_MAX_AGE for m_id in message_ids):
+            return self._error(400, 50034, "You can only bulk delete messages that are under 14 days old.")
+
+        # Like Discord, messages that are already gone are skipped rather than failing the whole request.
+        deleted = [m_id for m_id in message_ids if self.messages.get(m_id, (None,))[0] == channel_id]
+        for message_id in deleted:
+            self._delete(message_id)
+        await self.dispatch(self.channel_guilds[channel_id], 'MESSAGE_DELETE_BULK',
+                            {'ids': [str(m_id) for m_id in deleted], 'channel_id': str(channel_id), 'guild_id': str(self.channel_guilds[channel_id])})
+        return web.Response(status=204)
+
+
+    async def get_webhooks(self, request: web.Request) -> web.Response:
+        channel_id = int(request.match_info['channel_id'])
+        return _json([webhook for webhook in self.webhooks.values() if webhook['channel_id'] == str(channel_id)])
+
+
+    async def create_webhook(self, request: web.Request) -> web.Response:
+        channel_id = int(request.match_info['channel_id'])
+        if channel_id not in self.channel_guilds:
+            return self._error(404, 10003, "Unknown Channel")
+        body = await request.json()
+        webhook_id = make_snowflake(next(self._sequence))
+        webhook = {
+            'id': str(webhook_id),
+            'type': 1,
+            'guild_id': str(self.channel_guilds[channel_id]),
+            'channel_id': str(channel_id),
+            'user': user_payload(BOT_USER_ID, bot=True),
+            'name': body.get('name', "webhook"),
+            'avatar': None,
+            'token': f"token{webhook_id}",
+        }
+        self.webhooks[webhook_id] = webhook
+        await self.dispatch(self.channel_guilds[channel_id], 'WEBHOOKS_UPDATE',
+                            {'guild_id': webhook['guild_id'], 'channel_id': webhook['channel_id']})
+        return _json(webhook)
+
+
+    async def execute_webhook(self, request: web.Request) -> web.Response:
+        webhook = self.webhooks.get(int(request.match_info['webhook_id']))
+        if webhook is None or webhook['token'] != request.match_info['token']:
+            return self._error(404, 10015, "Unknown Webhook")
+        body = await request.json() if request.content_type == 'application/json' else {}
+        payload = await self.create_message(int(webhook['channel_id']), int(webhook['id']), content=body.get('content') or "",
+                                            webhook_id=int(webhook['id']))
+        return _json(payload) if request.query.get('wait') == 'true' else web.Response(status=204)
+
+    # endregion
+
+    # region Channels
+
+    def channel_payload(self, channel_id: int) -> Dict[str, Any]:
+        guild_id = self.channel_guilds[channel_id]
+        position = self.guilds[guild_id].index(channel_id)
+        return {'id': str(channel_id), 'guild_id': str(guild_id), 'type': 0, 'name': f"channel-{position}", 'position': position,
+                'permission_overwrites': [], 'rate_limit_per_user': self.slowmode.get(channel_id, 0)}
+
+
+    async def edit_channel(self, request: web.Request) -> web.Response:
+        channel_id = int(request.match_info['channel_id'])
+        if channel_id not in self.channel_guilds:
+            return self._error(404, 10003, "Unknown Channel")
+        data = await request.json()
+        if 'rate_limit_per_user' in data:
+            self.slowmode[channel_id] = data['rate_limit_per_user']
+        payload = self.channel_payload(channel_id)
+        await self.dispatch(self.channel_guilds[channel_id], 'CHANNEL_UPDATE', payload)
+        return _json(payload)
+
+    # endregion
+
+    # region Messages
+
+    async def create_message(self, channel_id: int, author_id: int, content: str = "AAAAAAAAAAAAAAAAA",
+                             webhook_id: Optional[int] = None) -> Dict[str, Any]:
+        """Creates a message and dispatches it to the shard of its guild."""
+        message_id = make_snowflake(next(self._sequence))
+        self.messages[message_id] = (channel_id, time.time())
+        if author_id != BASE_AUTHOR_ID:
+            self.authors[message_id] = author_id
+        self.sent += 1
+        guild_id = self.channel_guilds[channel_id]
+        payload = message_payload(guild_id, channel_id, message_id, author_id, content=content, webhook_id=webhook_id)
+        await self.dispatch(guild_id, 'MESSAGE_CREATE', payload)
+        return payload
+
+
+    def add_history(self, channel_id: int, count: int, age: float = 0.0, author_id: int = BASE_AUTHOR_ID) -> List[int]:
+        """Adds messages that were sent 'age' seconds ago to the history of a channel, without dispatching them. Returns their IDs."""
+        sent_at = time.time() - age
+        message_ids = [make_snowflake(next(self._sequence), sent_at) for _ in range(count)]
+        for message_id in message_ids:
+            self.messages[message_id] = (channel_id, sent_at)
+            if author_id != BASE_AUTHOR_ID:
+                self.authors[message_id] = author_id
+        return message_ids
+
+
+    def _delete(self, message_id: int):
+        self.authors.pop(message_id, None)
+        _, sent_at = self.messages.pop(message_id)
+        self.deleted[message_id] = (sent_at, time.time())
+
+
+    async def flood(self, messages: int, rate: float, webhook_fraction: float = 0.0, authors: int = 100):
+        """
+        Sends 'messages' messages at 'rate' msgs/sec, each into a random channel.
+        'webhook_fraction' of them come from a webhook that is not the bot's.
+        Messages by authors that are still in the slowmode of the channel are not sent, like Discord would reject them.
+        """
+        channel_ids = list(self.channel_guilds)
+        tick = 0.01
+        per_tick = max(1, int(rate * tick))
+        next_tick = time.perf_counter()
+        for i in range(messages):
+            webhook_id = FOREIGN_WEBHOOK_ID if random.random() < webhook_fraction else None
+            channel_id = random.choice(channel_ids)
+            author_id = BASE_AUTHOR_ID + i % authors
+            now = time.time()
+            if webhook_id is None and now - self.last_posts.get((channel_id, author_id), 0.0) < self.slowmode.get(channel_id, 0):
+                self.slowmode_rejected += 1
+            else:
+                self.last_posts[channel_id, author_id] = now
+                await self.create_message(channel_id, author_id, webhook_id=webhook_id)
+            if i % per_tick == per_tick - 1:
+                next_tick += tick
+                await asyncio.sleep(max(next_tick - time.perf_counter(), 0))
+
+    # endregion
+
+    # region Gateway
+
+    def shard_for(self, guild_id: int) -> int:
+        shard_count = next(iter(self.sessions.values())).shard_count if self.sessions else 1
+        return (guild_id >> 22) % shard_count
+
+
+    async def dispatch(self, guild_id: int, event: str, data: Dict[str, Any]):
+        session = self.sessions.get(self.shard_for(guild_id))
+        if session is None or session.ws.closed:
+            self.dropped_events += 1
+            return
+        await session.send(0, data, event)
+
+
+    async def gateway(self, request: web.Request) -> web.WebSocketResponse:
+        ws = web.WebSocketResponse()
+        await ws.prepare(request)
+        await ws.send_str(json.dumps({'op': 10, 'd': {'heartbeat_interval': HEARTBEAT_INTERVAL}, 's': None, 't': None}))
+
+        session: Optional[GatewaySession] = None
+        try:
+            async for msg in ws:
+                if msg.type != WSMsgType.TEXT:
+                    continue
+                payload = json.loads(msg.data)
+                op = payload.get('op')
+                if op == 1:  # Heartbeat
+                    await ws.send_str(json.dumps({'op': 11, 'd': None, 's': None, 't': None}))
+                elif op == 2:  # Identify
+                    shard_id, shard_count = payload['d'].get('shard', [0, 1])
+                    session = self.sessions[shard_id] = GatewaySession(ws, shard_id, shard_count)
+                    await self.identify(session)
+                elif op == 6 and session is not None:  # Resume. Nothing is replayed.
+                    await session.send(0, {}, 'RESUMED')
+                # Presence updates and member requests are ignored.
+        finally:
+            if session is not None and self.sessions.get(session.shard_id) is session:
+                del self.sessions[session.shard_id]
+        return ws
+
+
+    async def identify(self, session: GatewaySession):
+        guild_ids = [guild_id for guild_id in self.guilds if (guild_id >> 22) % session.shard_count == session.shard_id]
+        await session.send(0, {
+            'v': 6,
+            'user': user_payload(BOT_USER_ID, bot=True),
+            'guilds': [{'id': str(guild_id), 'unavailable': True} for guild_id in guild_ids],
+            'session_id': session.session_id,
+            'private_channels': [],
+            'relationships': [],
+            'shard': [session.shard_id, session.shard_count],
+            'application': {'id': str(BOT_USER_ID), 'flags': 0},
+        }, 'READY')
+        for guild_id in guild_ids:
+            await session.send(0, guild_payload(guild_id, self.guilds[guild_id]), 'GUILD_CREATE')
+        self.connected.set()
+
+    # endregion
+
+    def report(self, delete_after: float) -> Dict[str, Any]:
+        """Deletion lag is how long after it came due each message was deleted, by the clock of this server."""
+        lag = LogHistogram()
+        for sent_at, deleted_at in self.deleted.values():
+            lag.record((deleted_at - sent_at - delete_after) * 1000)
+        deletes = self.calls['delete_message'] + self.calls['delete_messages']
+        return {
+            "messages_sent": self.sent,
+            "messages_deleted": len(self.deleted),
+            "messages_remaining": len(self.messages),
+            "deletion_lag_ms": {key: value for key, value in lag.summary().items() if key != 'calls'},
+            "rest_calls": sum(self.calls.values()),
+            "rest_calls_by_route": dict(self.calls),
+            "ratelimited_by_route": dict(self.ratelimited),
+            "global_ratelimited": self.global_ratelimited,
+            "messages_per_delete_call": len(self.deleted) / deletes if deletes else None,
+            "dropped_events": self.dropped_events,
+            "slowmode_rejected": self.slowmode_rejected,
+            "duplicate_ids_rejected": self.duplicate_ids_rejected,
+        }
+
+
+async def serve(args):
+    server = FakeDiscord(args.guilds, args.channels, args.latency)
+    await server.start(args.host, args.port)
+    print(f"Serving the fake Discord API at {server.api_base}", flush=True)
+    await server.connected.wait()
+    await asyncio.sleep(args.delay)
+    await server.flood(args.messages, args.rate, args.webhook_fraction)
+    while server.messages:
+        await asyncio.sleep(1)
+    print(json.dumps(server.report(args.delete_after), indent=2), flush=True)
+    await asyncio.Event().wait()  # Keep serving until interrupted.
+
+
+def get_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="A local stand-in for the Discord API and gateway.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--guilds", type=int, default=20)
+    parser.add_argument("--channels", type=int, default=5, help="Channels per guild.")
+    parser.add_argument("--messages", type=int, default=10000)
+    parser.add_argument("--rate", type=float, default=500, help="Messages per second.")
+    parser.add_argument("--webhook-fraction", type=float, default=0.0, help="Fraction of the messages that are sent by a foreign webhook.")
+    parser.add_argument("--latency", type=float, default=0.0, help="Added latency of every REST call, in seconds.")
+    parser.add_argument("--delay", type=float, default=30, help="Seconds to wait after the first shard connects before flooding.")
+    parser.add_argument("--delete-after", type=float, default=5, help="The delete_after of the void channels, for the lag report.")
+    return parser
+
+
+if __name__ == '__main__':
+    try:
+        asyncio.get_event_loop().run_until_complete(serve(get_parser().parse_args()))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,108 @@
+"""
+Synthetic gateway payloads and discord.py objects shared by the benchmarks.
+
+Part of the void.
+"""
+
+import time
+import asyncio
+from typing import Optional, Dict, List
+
+import discord
+from discord.state import ConnectionState
+
+from bot import VBot
+from utils.deletionEngine import DISCORD_EPOCH
+from benchmarks.fakeDb import FakePool
+
+BOT_USER_ID = 700000000000000000
+
+
+def make_snowflake(sequence: int, timestamp: Optional[float] = None) -> int:
+    timestamp = time.time() if timestamp is None else timestamp
+    return ((int(timestamp * 1000) - DISCORD_EPOCH) << 22) + (sequence & 0x3FFFFF)
+
+
+def user_payload(user_id: int, bot: bool = False) -> Dict:
+    return {'id': str(user_id), 'username': f"user{user_id % 10000}", 'discriminator': '0001', 'avatar': None, 'bot': bot}
+
+
+def guild_payload(guild_id: int, channel_ids: List[int], member_ids: List[int] = (), presences: bool = False) -> Dict:
+    return {
+        'id': str(guild_id),
+        'name': f"guild {guild_id}",
+        'owner_id': str(BOT_USER_ID),
+        'region': 'us-west',
+        'verification_level': 0,
+        'default_message_notifications': 0,
+        'explicit_content_filter': 0,
+        'features': [],
+        'member_count': len(member_ids) + 1,
+        'roles': [{'id': str(guild_id), 'name': '@everyone', 'permissions': '104324673', 'position': 0,
+                   'color': 0, 'hoist': False, 'managed': False, 'mentionable': False}],
+        'emojis': [],
+        'channels': [{'id': str(ch_id), 'type': 0, 'name': f"channel-{i}", 'position': i, 'permission_overwrites': []}
+                     for i, ch_id in enumerate(channel_ids)],
+        'members': [{'user': user_payload(BOT_USER_ID, bot=True), 'roles': [], 'joined_at': '2020-01-01T00:00:00+00:00',
+                     'deaf': False, 'mute': False}] +
+                   [{'user': user_payload(m_id), 'roles': [], 'joined_at': '2020-01-01T00:00:00+00:00', 'deaf': False, 'mute': False}
+                    for m_id in member_ids],
+        'voice_states': [],
+        'presences': [{'user': {'id': str(m_id)}, 'status': 'online', 'activities': [], 'client_status': {'desktop': 'online'}}
+                      for m_id in member_ids] if presences else [],
+    }
+
+
+def message_payload(guild_id: int, channel_id: int, message_id: int, author_id: int, content: str = "AAAAAAAAAAAAAAAAA",
+                    webhook_id: Optional[int] = None) -> Dict:
+    payload = {
+        'id': str(message_id),
+        'channel_id': str(channel_id),
+        'guild_id': str(guild_id),
+        'author': user_payload(author_id),
+        'member': {'roles': [], 'joined_at': '2020-01-01T00:00:00+00:00', 'deaf': False, 'mute': False},
+        'content': content,
+        'timestamp': '2020-01-01T00:00:00+00:00',
+        'edited_timestamp': None,
+        'tts': False,
+        'mention_everyone': False,
+        'mentions': [],
+        'mention_roles': [],
+        'attachments': [],
+        'embeds': [],
+        'pinned': False,
+        'type': 0,
+    }
+    if webhook_id is not None:
+        payload['webhook_id'] = str(webhook_id)
+        del payload['member']
+    return payload
+
+
+def make_state(loop: Optional[asyncio.AbstractEventLoop] = None, **options) -> ConnectionState:
+    """A ConnectionState with no HTTP client or gateway, which is enough to build guilds and messages from payloads."""
+    state = ConnectionState(dispatch=lambda *args, **kwargs: None, handlers={}, hooks={}, syncer=None, http=None,
+                            loop=loop or asyncio.get_event_loop(), **options)
+    state.user = discord.ClientUser(state=state, data=user_payload(BOT_USER_ID, bot=True))
+    return state
+
+
+def make_guild(state: ConnectionState, guild_id: int, channel_ids: List[int], member_ids: List[int] = ()) -> discord.Guild:
+    guild = discord.Guild(data=guild_payload(guild_id, channel_ids, member_ids), state=state)
+    state._add_guild(guild)
+    return guild
+
+
+def make_message(state: ConnectionState, channel: discord.TextChannel, message_id: int, author_id: int, **kwargs) -> discord.Message:
+    data = message_payload(channel.guild.id, channel.id, message_id, author_id, **kwargs)
+    return discord.Message(state=state, channel=channel, data=data)
+
+
+def make_bot(loop: Optional[asyncio.AbstractEventLoop] = None, config: Optional[Dict] = None, pool: Optional[FakePool] = None, **options) -> VBot:
+    """A VBot that is never connected, backed by an in-memory FakePool. Cogs are not loaded."""
+    bot = VBot(command_prefix=["v;", "V;"], loop=loop or asyncio.get_event_loop(), case_insensitive=True, **options)
+    bot._connection.user = discord.ClientUser(state=bot._connection, data=user_payload(BOT_USER_ID, bot=True))
+    bot.config = config if config is not None else {}
+    bot.db_pool = pool if pool is not None else FakePool()
+    bot.owner_id = BOT_USER_ID  # Otherwise is_owner checks (e.g. in help) fetch the application info over HTTP.
+    return bot
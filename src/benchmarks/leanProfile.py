@@ -0,0 +1,106 @@
+"""
+Measures RSS and startup (guild ingest) time of the lean VBot profile against the defaults, on a synthetic fleet of guilds.
+Each mode runs in a fresh process. READY is followed by a GUILD_CREATE for every guild and then a flood of MESSAGE_CREATEs,
+all fed straight into a discord.py ConnectionState.
+
+Modes:
+    legacy:  What the bot did before intents (discord.py 1.3): every member and presence sent and cached, 1000 message cache.
+             Guild chunking can't be reproduced offline, so its result is emulated by including the members in GUILD_CREATE.
+    default: VBot with the discord.py >= 1.5 defaults. Members and presences are not sent, 1000 message cache.
+    lean:    VBot.lean_options().
+
+Usage: python -m benchmarks.leanProfile [--guilds 10000] [--channels 5] [--members 25] [--messages 20000]
+
+Part of the void.
+"""
+
+import gc
+import sys
+import json
+import time
+import asyncio
+import argparse
+import subprocess
+from typing import Dict
+
+import psutil
+import discord
+
+from bot import VBot
+from benchmarks.fixtures import make_state, guild_payload, message_payload, make_snowflake
+
+MODES = ('legacy', 'default', 'lean')
+
+
+def get_options(mode: str) -> Dict:
+    if mode == 'legacy':
+        return {'intents': discord.Intents.all(), 'member_cache_flags': discord.MemberCacheFlags.all(), 'chunk_guilds_at_startup': False}
+    if mode == 'lean':
+        return VBot.lean_options()
+    return {}
+
+
+def run_child(args) -> Dict:
+    loop = asyncio.get_event_loop()
+    gc.collect()
+    process = psutil.Process()
+    start_rss = process.memory_info().rss
+
+    state = make_state(loop, **get_options(args.mode))
+    full_members = args.mode == 'legacy'
+
+    start = time.perf_counter()
+    for g in range(args.guilds):
+        guild_id = 100000000000000000 + g * 1000
+        channel_ids = [guild_id + c + 1 for c in range(args.channels)]
+        member_ids = [guild_id + 500 + m for m in range(args.members)] if full_members else []
+        state.parse_guild_create(guild_payload(guild_id, channel_ids, member_ids, presences=full_members))
+    ingest_time = time.perf_counter() - start
+
+    for i in range(args.messages):
+        guild_id = 100000000000000000 + (i % args.guilds) * 1000
+        state.parse_message_create(message_payload(guild_id, guild_id + 1, make_snowflake(i), guild_id + 500))
+
+    gc.collect()
+    return {
+        'mode': args.mode,
+        'guild_ingest_s': ingest_time,
+        'rss_mb': process.memory_info().rss / 1024 / 1024,
+        'rss_growth_mb': (process.memory_info().rss - start_rss) / 1024 / 1024,
+        'cached_members': sum(len(guild._members) for guild in state.guilds),
+        'cached_messages': len(state._messages) if state._messages is not None else 0,
+    }
+
+
+def run(args) -> Dict:
+    results = {}
+    for mode in MODES:
+        cmd = [sys.executable, '-m', 'benchmarks.leanProfile', '--child', '--mode', mode, '--guilds', str(args.guilds),
+               '--channels', str(args.channels), '--members', str(args.members), '--messages', str(args.messages)]
+        output = subprocess.run(cmd, check=True, stdout=subprocess.PIPE).stdout
+        results[mode] = json.loads(output)
+
+    return {
+        "benchmark": "lean_profile",
+        "params": {key: value for key, value in vars(args).items() if key not in ('child', 'mode')},
+        "results": results,
+    }
+
+
+def get_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="RSS and startup time of the lean profile.")
+    parser.add_argument("--guilds", type=int, default=10000)
+    parser.add_argument("--channels", type=int, default=5, help="Text channels per guild.")
+    parser.add_argument("--members", type=int, default=25, help="Members per guild (legacy mode only).")
+    parser.add_argument("--messages", type=int, default=20000)
+    parser.add_argument("--mode", choices=MODES, default='lean')
+    parser.add_argument("--child", action='store_true', help=argparse.SUPPRESS)
+    return parser
+
+
+if __name__ == '__main__':
+    _args = get_parser().parse_args()
+    if _args.child:
+        print(json.dumps(run_child(_args)))
+    else:
+        print(json.dumps(run(_args), indent=2))
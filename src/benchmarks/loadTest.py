@@ -0,0 +1,132 @@
+"""
+End to end load test of message deletion against the fake Discord in benchmarks.fakeDiscord.
+A VBot with the cogs loaded connects to the fake over HTTP and websockets like it would to Discord, with every channel set up
+as a void channel in an in-memory FakePool. The fake then floods MESSAGE_CREATE events, and the run ends when every message
+has been deleted (or --timeout passes). Reports the end to end deletion lag as seen by the fake server, how many REST calls
+the bot made per route, and how many of those were rate limited. With --mode sweep the channels are in the sweep mode,
+to compare the API calls per deleted message with the default per message mode.
+Fails if a bulk delete listed the same message twice, which Discord rejects.
+
+Usage: python -m benchmarks.loadTest [--guilds 20] [--channels 5] [--messages 5000] [--rate 500] [--delete-after 1]
+                                     [--shards 1] [--latency 0.02] [--webhook-fraction 0] [--raw-fast-path] [--lean] [--timeout 120]
+                                     [--record traffic.jsonl] [--mode message|sweep] [--sweep-interval 5]
+
+Part of the void.
+"""
+
+import json
+import time
+import asyncio
+import argparse
+from typing import Dict
+
+import db
+from bot import VBot
+from utils.recorder import GatewayRecorder
+from benchmarks.fakeDb import FakePool
+from benchmarks.fakeDiscord import FakeDiscord
+from benchmarks.fixtures import make_bot
+
+
+async def wait_until_deleted(server: FakeDiscord, timeout: float) -> bool:
+    deadline = time.perf_counter() + timeout
+    while server.messages:
+        if time.perf_counter() > deadline:
+            return False
+        await asyncio.sleep(0.05)
+    return True
+
+
+async def run_async(args) -> Dict:
+    server = FakeDiscord(args.guilds, args.channels, args.latency)
+    await server.start()
+    VBot.set_api_base(server.api_base)
+
+    pool = FakePool([db.VoidChannel(server_id=guild_id, channel_id=channel_id, enabled=True, delete_after=args.delete_after, mode=args.mode)
+                     for channel_id, guild_id in server.channel_guilds.items()])
+    bot = make_bot(config={'raw_fast_path': args.raw_fast_path, 'sweep_interval': args.sweep_interval}, pool=pool, **(VBot.lean_options() if args.lean else {}))
+    bot.set_shards(args.shards)
+    if args.record is not None:
+        bot.recorder = GatewayRecorder(args.record)
+
+    async def identify_now(shard_id: int, *, initial: bool = False):
+        pass  # The fake has no identify rate limit, so don't wait 5 seconds between shards.
+    bot.before_identify_hook = identify_now
+
+    bot.load_cogs()
+    bot_task = asyncio.get_event_loop().create_task(bot.start("fake-token"))
+    try:
+        ready = asyncio.get_event_loop().create_task(bot.wait_until_ready())
+        await asyncio.wait({ready, bot_task}, timeout=60, return_when=asyncio.FIRST_COMPLETED)
+        if bot_task.done():
+            bot_task.result()  # Raises whatever stopped the bot from connecting.
+        if not ready.done():
+            raise TimeoutError("The bot did not become ready.")
+        void_cog = bot.get_cog('Void')
+        await asyncio.sleep(0.1)
+        while void_cog.sweeper.running:  # Let the startup catch-up sweep finish, so that its calls are not counted.
+            await asyncio.sleep(0.1)
+        server.calls.clear()
+        void_cog.periodic_sweeper.history_calls.clear()
+
+        start = time.perf_counter()
+        await server.flood(args.messages, args.rate, args.webhook_fraction)
+        flood_duration = time.perf_counter() - start
+        complete = await wait_until_deleted(server, args.timeout)
+        duration = time.perf_counter() - start
+
+        results = {
+            "complete": complete,
+            "flood_s": flood_duration,
+            "duration_s": duration,
+            "deleted_per_sec": len(server.deleted) / duration,
+            "server": server.report(args.delete_after),
+            "bot": {
+                "deleted": sum(deleter.deleted for deleter in void_cog.deleters.values()),
+                "rest_calls": sum(deleter.rest_calls for deleter in void_cog.deleters.values()),
+                "ratelimited": void_cog.rest.ratelimited,
+                "api_calls_per_deleted": {mode: api_calls / deleted for mode, (deleted, api_calls) in void_cog.mode_stats().items() if deleted},
+            },
+        }
+        if server.duplicate_ids_rejected:
+            raise AssertionError(f"{server.duplicate_ids_rejected} bulk deletes listed a message more than once.")
+    finally:
+        for cog_name in list(bot.cogs):
+            bot.remove_cog(cog_name)
+        await bot.close()
+        if bot.recorder is not None:
+            bot.recorder.close()
+        await asyncio.gather(bot_task, return_exceptions=True)
+        await server.stop()
+    return results
+
+
+def run(args) -> Dict:
+    return {
+        "benchmark": "load_test",
+        "params": vars(args),
+        "results": asyncio.get_event_loop().run_until_complete(run_async(args)),
+    }
+
+
+def get_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="End to end deletion load test against a fake Discord.")
+    parser.add_argument("--guilds", type=int, default=20)
+    parser.add_argument("--channels", type=int, default=5, help="Channels per guild. Every channel is a void channel.")
+    parser.add_argument("--messages", type=int, default=5000)
+    parser.add_argument("--rate", type=float, default=500, help="Messages per second.")
+    parser.add_argument("--delete-after", type=float, default=1.0)
+    parser.add_argument("--shards", type=int, default=1)
+    parser.add_argument("--latency", type=float, default=0.02, help="Added latency of every REST call, in seconds.")
+    parser.add_argument("--webhook-fraction", type=float, default=0.0, help="Fraction of the messages that are sent by a foreign webhook.")
+    parser.add_argument("--raw-fast-path", action='store_true')
+    parser.add_argument("--lean", action='store_true', help="Use VBot.lean_options().")
+    parser.add_argument("--record", default=None, help="Record the gateway traffic of the run to this file, for benchmarks.replay.")
+    parser.add_argument("--mode", choices=db.VOID_MODES, default=db.MODE_MESSAGE, help="The deletion mode of the void channels.")
+    parser.add_argument("--sweep-interval", type=float, default=5.0, help="Seconds between sweeps in the sweep mode.")
+    parser.add_argument("--timeout", type=float, default=120, help="Give up if the messages are not all deleted this long after the flood started.")
+    return parser
+
+
+if __name__ == '__main__':
+    print(json.dumps(run(get_parser().parse_args()), indent=2))
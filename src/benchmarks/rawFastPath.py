@@ -0,0 +1,99 @@
+"""
+Measures MESSAGE_CREATE throughput with and without the raw fast path of the Void cog.
+The payloads are fed to the MESSAGE_CREATE gateway parser of a VBot with the Void cog loaded, and each run ends once every
+void channel message has been scheduled for deletion. The full path builds a discord.Message and dispatches 'on_message'
+to the bot and the cogs, the fast path schedules the deletion straight from the payload.
+
+Usage: python -m benchmarks.rawFastPath [--messages 50000] [--void-fraction 1.0] [--lean]
+
+Part of the void.
+"""
+
+import gc
+import json
+import time
+import asyncio
+import argparse
+from typing import Dict, List
+
+import db
+from bot import VBot
+from cogs.void import Void
+from benchmarks.fakeDb import FakePool
+from benchmarks.fixtures import make_bot, make_guild, message_payload, make_snowflake
+
+GUILD_ID = 100000000000000000
+VOID_CHANNEL_ID = GUILD_ID + 1
+OTHER_CHANNEL_ID = GUILD_ID + 2
+
+
+def make_payloads(messages: int, void_fraction: float, offset: int) -> List[Dict]:
+    void_every = max(1, round(1 / void_fraction)) if void_fraction > 0 else 0
+    payloads = []
+    for i in range(messages):
+        channel_id = VOID_CHANNEL_ID if void_every and i % void_every == 0 else OTHER_CHANNEL_ID
+        payloads.append(message_payload(GUILD_ID, channel_id, make_snowflake(offset + i), GUILD_ID + 500 + i % 50))
+    return payloads
+
+
+def scheduled(void_cog: Void) -> int:
+    return sum(deleter.scheduled for deleter in void_cog.deleters.values())
+
+
+def measure(loop: asyncio.AbstractEventLoop, bot: VBot, void_cog: Void, payloads: List[Dict]) -> Dict:
+    parse = bot._connection.parsers['MESSAGE_CREATE']
+    expected = scheduled(void_cog) + sum(1 for payload in payloads if int(payload['channel_id']) == VOID_CHANNEL_ID)
+
+    async def drain():
+        while scheduled(void_cog) < expected:
+            await asyncio.sleep(0)
+
+    gc.collect()
+    start = time.perf_counter()
+    for payload in payloads:
+        parse(payload)
+    loop.run_until_complete(drain())
+    duration = time.perf_counter() - start
+
+    return {
+        "events": len(payloads),
+        "duration_s": duration,
+        "events_per_sec": len(payloads) / duration,
+        "us_per_event": duration / len(payloads) * 1e6,
+    }
+
+
+def run(args) -> Dict:
+    loop = asyncio.get_event_loop()
+    pool = FakePool([db.VoidChannel(server_id=GUILD_ID, channel_id=VOID_CHANNEL_ID, enabled=True, delete_after=3600)])
+    bot = make_bot(loop, pool=pool, **(VBot.lean_options() if args.lean else {}))
+    make_guild(bot._connection, GUILD_ID, [VOID_CHANNEL_ID, OTHER_CHANNEL_ID])
+
+    void_cog = Void(bot)
+    bot.add_cog(void_cog)
+    loop.run_until_complete(asyncio.sleep(0.01))  # Let the void channel cache load.
+
+    full = measure(loop, bot, void_cog, make_payloads(args.messages, args.void_fraction, 0))
+    void_cog.install_fast_path()
+    fast = measure(loop, bot, void_cog, make_payloads(args.messages, args.void_fraction, args.messages))
+    void_cog.uninstall_fast_path()
+
+    return {
+        "benchmark": "raw_fast_path",
+        "params": vars(args),
+        "full_parse": full,
+        "fast_path": fast,
+        "speedup": fast["events_per_sec"] / full["events_per_sec"],
+    }
+
+
+def get_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="MESSAGE_CREATE throughput with and without the raw fast path.")
+    parser.add_argument("--messages", type=int, default=50000)
+    parser.add_argument("--void-fraction", type=float, default=1.0, help="Fraction of the messages that are sent in a void channel.")
+    parser.add_argument("--lean", action='store_true', help="Use VBot.lean_options().")
+    return parser
+
+
+if __name__ == '__main__':
+    print(json.dumps(run(get_parser().parse_args()), indent=2))
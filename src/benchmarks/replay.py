@@ -0,0 +1,196 @@
+"""
+Replays a gateway traffic recording (see utils.recorder) through the cogs of an unconnected VBot, sped up by --speed.
+Every recorded guild and channel gets a synthetic stand-in, and channels that had messages in enabled void channels become
+void channels with their recorded delete_after. Time is compressed by the speed, delete_after included, so that 10x replays
+ten minutes of traffic and deletions in one minute. MESSAGE_CREATE events are fed to the gateway parser, so the raw fast path
+is exercised too when enabled. The other recorded events are only counted. Deletions go to the stub REST client of
+benchmarks.bulkDelete, which paces calls per channel. Its latency and rate limit are given in recorded time and are scaled too,
+as is the coalescing window of the deletion engine.
+
+Reports how far the replay fell behind the recording, the deletion lag and REST calls, the peak scheduler and backlog sizes,
+and the event loop lag. Lag is reported both in replay time and scaled back to recorded time.
+
+Usage: python -m benchmarks.replay traffic.jsonl [--speed 10] [--latency 0.05] [--rate-limit 5] [--raw-fast-path] [--lean]
+
+Part of the void.
+"""
+
+import json
+import time
+import random
+import asyncio
+import argparse
+from collections import Counter
+from typing import Dict, List, Tuple, Any
+
+import db
+from bot import VBot
+from utils.metrics import metrics, LoopLagMonitor
+from utils.histogram import LogHistogram, LatencyStats
+from utils.recorder import FORMAT, VERSION
+from benchmarks.fakeDb import FakePool
+from benchmarks.bulkDelete import FakeHTTP
+from benchmarks.fakeDiscord import BASE_GUILD_ID, BASE_AUTHOR_ID, FOREIGN_WEBHOOK_ID
+from benchmarks.fixtures import make_bot, make_guild, message_payload, make_snowflake
+
+
+def load(path: str) -> List[Dict[str, Any]]:
+    with open(path) as recording:
+        header = json.loads(recording.readline())
+        if header.get('format') != FORMAT or header.get('version') != VERSION:
+            raise ValueError(f"{path} is not a version {VERSION} gateway recording.")
+        return [json.loads(line) for line in recording if line.strip()]
+
+
+def build_world(records: List[Dict[str, Any]], speed: float) -> Tuple[Dict[int, int], Dict[int, List[int]], List[db.VoidChannel]]:
+    """
+    Maps the recorded guild and channel hashes to synthetic IDs.
+    Returns channel hash -> channel ID, guild ID -> channel IDs, and the void channels.
+    """
+    guild_ids: Dict[int, int] = {}
+    channel_ids: Dict[int, int] = {}
+    guild_channels: Dict[int, List[int]] = {}
+    void_channels: Dict[int, db.VoidChannel] = {}
+    for record in records:
+        if 'g' not in record or 'c' not in record:
+            continue
+        guild_id = guild_ids.get(record['g'])
+        if guild_id is None:
+            guild_id = guild_ids[record['g']] = BASE_GUILD_ID + (len(guild_ids) << 22)
+            guild_channels[guild_id] = []
+        if record['c'] not in channel_ids:
+            channel_id = channel_ids[record['c']] = guild_id + len(guild_channels[guild_id]) + 1
+            guild_channels[guild_id].append(channel_id)
+        if 'd' in record:
+            channel_id = channel_ids[record['c']]
+            void_channels[channel_id] = db.VoidChannel(server_id=guild_id, channel_id=channel_id, enabled=True, delete_after=record['d'] / speed)
+    return channel_ids, guild_channels, list(void_channels.values())
+
+
+async def sample_peaks(void_cog, peaks: Counter):
+    while True:
+        peaks['scheduled'] = max(peaks['scheduled'], sum(deleter.scheduled for deleter in void_cog.deleters.values()))
+        peaks['backlog'] = max(peaks['backlog'], sum(deleter.backlog for deleter in void_cog.deleters.values()))
+        await asyncio.sleep(0.05)
+
+
+async def wait_until_drained(void_cog, timeout: float) -> bool:
+    deadline = time.perf_counter() + timeout
+    while any(deleter.scheduled or deleter.backlog for deleter in void_cog.deleters.values()):
+        if time.perf_counter() > deadline:
+            return False
+        await asyncio.sleep(0.05)
+    return True
+
+
+def scaled(histogram: LogHistogram, scale: float) -> Dict[str, float]:
+    return {key: value * scale for key, value in histogram.summary().items() if key != 'calls'}
+
+
+async def run_async(args) -> Dict:
+    records = load(args.recording)
+    if args.limit is not None:
+        records = records[:args.limit]
+    channel_ids, guild_channels, void_channels = build_world(records, args.speed)
+    guilds = {channel_id: guild_id for guild_id, ch_ids in guild_channels.items() for channel_id in ch_ids}
+
+    loop = asyncio.get_event_loop()
+    bot = make_bot(loop, config={'raw_fast_path': args.raw_fast_path}, pool=FakePool(void_channels),
+                   **(VBot.lean_options() if args.lean else {}))
+    for guild_id, ch_ids in guild_channels.items():
+        make_guild(bot._connection, guild_id, ch_ids)
+    bot.load_cogs()
+    void_cog = bot.get_cog('Void')
+    while not void_cog.initialized:
+        await asyncio.sleep(0.01)
+    void_cog.rest = http = FakeHTTP(args.latency / args.speed, args.rate_limit * args.speed)
+    deleter = void_cog.get_deleter(BASE_GUILD_ID)  # The bot is not sharded, so this is the deleter of every guild.
+    deleter.coalesce_window /= args.speed
+
+    metrics.deletion_lag.clear()
+    voided = metrics.messages_voided
+    metrics.loop_lag = LatencyStats()
+    lag_monitor = LoopLagMonitor(loop, interval=0.05)
+    lag_monitor.start()
+    peaks = Counter()
+    sampler = loop.create_task(sample_peaks(void_cog, peaks))
+
+    parse_message_create = bot._connection.parsers['MESSAGE_CREATE']
+    behind = LogHistogram()  # How late each event was fed, in ms of replay time.
+    events = Counter()
+    skipped = Counter()
+    start = time.perf_counter()
+    for i, record in enumerate(records):
+        delay = start + record['t'] / args.speed - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        else:
+            behind.record(-delay * 1000)
+            if i % 100 == 0:
+                await asyncio.sleep(0)  # Let the deletions run even when the replay can't keep up.
+
+        if record['e'] != 'MESSAGE_CREATE' or record.get('c') not in channel_ids:
+            skipped[record['e']] += 1
+            continue
+        events[record['e']] += 1
+        channel_id = channel_ids[record['c']]
+        parse_message_create(message_payload(guilds[channel_id], channel_id, make_snowflake(i), BASE_AUTHOR_ID + random.randrange(1000),
+                                             webhook_id=FOREIGN_WEBHOOK_ID if record.get('w') else None))
+    replay_duration = time.perf_counter() - start
+
+    max_delete_after = max((void_ch.delete_after for void_ch in void_channels), default=0)
+    drained = await wait_until_drained(void_cog, max_delete_after + args.timeout)
+    duration = time.perf_counter() - start
+
+    sampler.cancel()
+    lag_monitor.stop()
+    for cog_name in list(bot.cogs):
+        bot.remove_cog(cog_name)
+
+    recorded_duration = records[-1]['t'] if records else 0
+    return {
+        "recorded_duration_s": recorded_duration,
+        "replay_duration_s": replay_duration,
+        "duration_s": duration,
+        "drained": drained,
+        "guilds": len(guild_channels),
+        "channels": len(channel_ids),
+        "void_channels": len(void_channels),
+        "replayed": dict(events),
+        "skipped": dict(skipped),
+        "events_behind": behind.count,
+        "behind_ms": scaled(behind, 1),
+        "messages_voided": metrics.messages_voided - voided,
+        "messages_deleted": sum(http.deleted.values()),
+        "rest_calls_by_route": dict(http.calls),
+        "deletion_lag_ms": scaled(metrics.deletion_lag, 1000),
+        "deletion_lag_recorded_time_ms": scaled(metrics.deletion_lag, 1000 * args.speed),
+        "peak_scheduled": peaks['scheduled'],
+        "peak_backlog": peaks['backlog'],
+        "loop_lag_ms": scaled(metrics.loop_lag.histogram(), 1000),
+    }
+
+
+def run(args) -> Dict:
+    return {
+        "benchmark": "replay",
+        "params": vars(args),
+        "results": asyncio.get_event_loop().run_until_complete(run_async(args)),
+    }
+
+
+def get_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Replays a gateway traffic recording through the cogs.")
+    parser.add_argument("recording", help="A file written by utils.recorder.GatewayRecorder (the record_file config key).")
+    parser.add_argument("--speed", type=float, default=10, help="How many times faster than recorded to replay, e.g. 1, 10 or 100.")
+    parser.add_argument("--limit", type=int, default=None, help="Only replay the first this many events.")
+    parser.add_argument("--latency", type=float, default=0.05, help="Simulated REST round trip time.")
+    parser.add_argument("--rate-limit", type=float, default=5, help="Simulated delete calls per second per channel.")
+    parser.add_argument("--raw-fast-path", action='store_true')
+    parser.add_argument("--lean", action='store_true', help="Use VBot.lean_options().")
+    parser.add_argument("--timeout", type=float, default=60, help="How long to wait for the deletions to drain after the last one comes due.")
+    return parser
+
+
+if __name__ == '__main__':
+    print(json.dumps(run(get_parser().parse_args()), indent=2))
@@ -0,0 +1,78 @@
+"""
+Measures the memory held per pending deletion.
+Compares `discord.Message.delete(delay=...)`, which keeps a sleeping task and its Message alive per message,
+against the DeletionScheduler, which keeps a (due_time, channel_id, message_id) tuple per message.
+
+Usage: python -m benchmarks.schedulerMemory [--messages 20000] [--delete-after 3600]
+
+Part of the void.
+"""
+
+import gc
+import json
+import asyncio
+import argparse
+import tracemalloc
+from types import SimpleNamespace
+from typing import Dict, Callable
+
+import discord
+
+from utils.deletionEngine import DeletionEngine
+from benchmarks.fixtures import make_state, make_guild, make_message, make_snowflake
+
+
+def measure(loop: asyncio.AbstractEventLoop, messages: int, schedule: Callable[[discord.Message], None]) -> Dict:
+    state = make_state(loop)
+    guild = make_guild(state, 1, [10])
+    channel = guild.get_channel(10)
+
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+
+    for i in range(messages):
+        schedule(make_message(state, channel, make_snowflake(i), 5000 + i % 50))
+    loop.run_until_complete(asyncio.sleep(0.1))  # Let any delete tasks start sleeping.
+
+    gc.collect()
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return {
+        "pending": messages,
+        "bytes_total": after - before,
+        "bytes_per_pending_deletion": (after - before) / messages,
+    }
+
+
+def run(args) -> Dict:
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+
+    baseline = measure(loop, args.messages, lambda message: loop.create_task(message.delete(delay=args.delete_after)))
+    for task in asyncio.all_tasks(loop):
+        task.cancel()
+
+    engine = DeletionEngine(SimpleNamespace(loop=loop, http=None))
+    scheduler = measure(loop, args.messages, lambda message: engine.schedule(message.channel.id, message.id, args.delete_after))
+    engine.stop()
+    loop.run_until_complete(asyncio.sleep(0))
+    loop.close()
+
+    return {
+        "benchmark": "scheduler_memory",
+        "params": vars(args),
+        "baseline": baseline,
+        "scheduler": scheduler,
+    }
+
+
+def get_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Memory held per pending deletion.")
+    parser.add_argument("--messages", type=int, default=20000)
+    parser.add_argument("--delete-after", type=float, default=3600)
+    return parser
+
+
+if __name__ == '__main__':
+    print(json.dumps(run(get_parser().parse_args()), indent=2))
@@ -4,14 +4,24 @@
 import sys
 import logging
 import traceback
-from typing import Optional, Dict, Tuple, List, Union
+from typing import TYPE_CHECKING, Optional, Dict, Tuple, List, Union, Any
 
 import discord
 from discord.ext import commands, tasks
+from discord.http import Route
 import asyncpg
 
 import db
 from utils.misc import log_error_msg
+from utils.metrics import LoopLagMonitor
+from utils.webhookCache import WebhookCache
+from utils.tracing import tracer
+
+if TYPE_CHECKING:
+    from cluster import ClusterClient
+    from utils.metrics import MetricsServer
+    from utils.recorder import GatewayRecorder
+    from utils.watchdog import StallWatchdog
 
 log = logging.getLogger(__name__)
 
@@ -22,16 +32,96 @@ extensions = (
 )
 
 
-class VBot(commands.Bot):
+class VBot(commands.AutoShardedBot):
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.db_pool: Optional[asyncpg.pool.Pool] = None
         self.config: Optional[Dict] = None
-        self.webhook_cache: Dict[int, discord.Webhook] = {}
+        self.webhook_cache = WebhookCache(self)  # The proxy webhooks. Loaded by the Void cog.
+        self.cluster: Optional['ClusterClient'] = None  # Only set when running as a worker in cluster mode.
+        self.metrics_server: Optional['MetricsServer'] = None  # Only set when metrics_port is configured.
+        self.recorder: Optional['GatewayRecorder'] = None  # Only set when record_file is configured.
+        self.lag_monitor = LoopLagMonitor(self.loop)  # Feeds metrics.loop_lag. Runs while the bot does.
+        self.watchdog: Optional['StallWatchdog'] = None  # Only set when stall_threshold is configured.
         self.update_playing.start()
 
 
+    async def start(self, *args, **kwargs):
+        # Started here rather than in __init__ so that the time before the loop is running does not count as lag.
+        self.lag_monitor.start()
+        if self.watchdog is not None:
+            self.watchdog.start()
+        await super().start(*args, **kwargs)
+
+
+    async def close(self):
+        if self.watchdog is not None:
+            self.watchdog.stop()
+        self.lag_monitor.stop()
+        void_cog = self.get_cog('Void')
+        if void_cog is not None:
+            await void_cog.store.stop()  # Writes out the buffered pending deletions while the DB pool is still usable.
+        await tracer.stop()  # Exports the buffered spans, including those of the last pending deletions flush.
+        await super().close()
+
+
+    @staticmethod
+    def lean_options() -> Dict[str, Any]:
+        """
+        Client options for a minimal memory profile.
+        Only the gateway events that the cogs use are received, the message cache is disabled,
+        guilds are not chunked at startup, and no members are cached other than our own (which discord.py always keeps, so guild.me works).
+        """
+        intents = discord.Intents.none()
+        intents.guilds = True           # Channels, roles and our own member. Needed for permissions_in and the void channel lookups.
+        intents.guild_messages = True   # The messages to void and the commands.
+        intents.guild_reactions = True  # The reaction based menus.
+        intents.dm_messages = True      # Commands in DMs.
+        intents.webhooks = True         # Keeping the proxy webhook cache up to date.
+        return {
+            'intents': intents,
+            'max_messages': None,
+            'chunk_guilds_at_startup': False,
+            'member_cache_flags': discord.MemberCacheFlags.none(),
+        }
+
+
+    @staticmethod
+    def set_api_base(api_base: str):
+        """
+        Points discord.py, the RestClient and webhooks at another Discord API, such as the stand-in server in benchmarks.fakeDiscord.
+        The gateway URL is fetched from that API too. This applies to every client in the process.
+        """
+        Route.BASE = api_base.rstrip('/')
+        discord.webhook.WebhookAdapter.BASE = Route.BASE
+
+
+    def dispatch(self, event_name: str, *args, **kwargs):
+        if self.recorder is not None and event_name == 'socket_response':
+            self.recorder.record(args[0])
+        super().dispatch(event_name, *args, **kwargs)
+
+
+    def set_shards(self, shard_count: Optional[int] = None, shard_ids: Optional[List[int]] = None):
+        """
+        Sets the shards that this process will run. Must be called before the bot is started.
+        If shard_count is None, the recommended shard count is fetched from Discord and all shards are run.
+        """
+        if shard_ids is not None and shard_count is None:
+            raise ValueError("shard_count must be set when shard_ids are given.")
+        self.shard_count = shard_count
+        self.shard_ids = shard_ids
+
+
+    def shard_guild_counts(self) -> Dict[int, int]:
+        """Gets the number of guilds on each shard."""
+        counts = {shard_id: 0 for shard_id in self.shards.keys()}
+        for guild in self.guilds:
+            counts[guild.shard_id] = counts.get(guild.shard_id, 0) + 1
+        return counts
+
+
     def load_cogs(self):
         for extension in extensions:
             try:
@@ -0,0 +1,229 @@
+"""
+Multi-process cluster mode for the void.
+A supervisor process sets up the database once, then starts N worker processes that each run a contiguous range of shards.
+Crashed workers are restarted. Each worker reports its stats to the supervisor over a local Unix socket and gets the
+aggregated cluster wide stats back, so that any worker can show them.
+
+Part of the void.
+"""
+
+import os
+import json
+import time
+import signal
+import asyncio
+import logging
+import multiprocessing
+from typing import TYPE_CHECKING, Optional, Dict, List, Callable, Any
+
+import aiohttp
+import psutil
+from discord.http import Route
+
+import db
+
+if TYPE_CHECKING:
+    from bot import VBot
+
+log = logging.getLogger(__name__)
+
+DEFAULT_IPC_PATH = "/tmp/void-cluster.sock"
+
+
+def shard_ranges(shard_count: int, workers: int) -> List[List[int]]:
+    """Splits the shards into 'workers' contiguous ranges that are as even as possible."""
+    per_worker, extra = divmod(shard_count, workers)
+    ranges = []
+    start = 0
+    for i in range(workers):
+        end = start + per_worker + (1 if i < extra else 0)
+        ranges.append(list(range(start, end)))
+        start = end
+    return ranges
+
+
+def collect_worker_stats(bot: 'VBot', worker_id: int) -> Dict[str, Any]:
+    """Gets the stats of this worker process that are reported to the supervisor."""
+    void_cog = bot.get_cog('Void')
+    guild_counts = bot.shard_guild_counts()
+    shards = {}
+    for shard_id, latency in bot.latencies:
+        deleter = void_cog.deleters.get(shard_id) if void_cog is not None else None
+        shards[str(shard_id)] = {
+            'latency': latency,
+            'guilds': guild_counts.get(shard_id, 0),
+            'deleted': deleter.deleted if deleter is not None else 0,
+            'backlog': deleter.backlog if deleter is not None else 0,
+            'scheduled': deleter.scheduled if deleter is not None else 0,
+        }
+
+    return {
+        'worker_id': worker_id,
+        'pid': os.getpid(),
+        'memory_mb': psutil.Process().memory_info().rss / 1024 / 1024,
+        'guilds': len(bot.guilds),
+        'shards': shards,
+    }
+
+
+def aggregate_stats(workers: Dict[int, Dict[str, Any]]) -> Dict[str, Any]:
+    totals = {'workers': len(workers), 'guilds': 0, 'shards': 0, 'memory_mb': 0.0, 'deleted': 0, 'backlog': 0, 'scheduled': 0}
+    for stats in workers.values():
+        totals['guilds'] += stats['guilds']
+        totals['memory_mb'] += stats['memory_mb']
+        totals['shards'] += len(stats['shards'])
+        for shard in stats['shards'].values():
+            totals['deleted'] += shard['deleted']
+            totals['backlog'] += shard['backlog']
+            totals['scheduled'] += shard['scheduled']
+    return {'totals': totals, 'workers': {str(worker_id): stats for worker_id, stats in workers.items()}}
+
+
+async def get_recommended_shard_count(token: str) -> int:
+    headers = {'Authorization': f"Bot {token}"}
+    async with aiohttp.ClientSession() as session:
+        async with session.get(Route.BASE + '/gateway/bot', headers=headers) as response:
+            response.raise_for_status()
+            data = await response.json()
+            return data['shards']
+
+
+class ClusterSupervisor:
+
+    def __init__(self, config: Dict, worker_target: Callable, workers: int, ipc_path: str = DEFAULT_IPC_PATH,
+                 restart_delay: float = 5.0):
+        """
+        'worker_target' is called in each worker process with (config, shard_count, shard_ids, worker_id, ipc_path).
+        """
+        self.config = config
+        self.worker_target = worker_target
+        self.worker_count = workers
+        self.ipc_path = ipc_path
+        self.restart_delay = restart_delay
+        self.shard_count: Optional[int] = config.get('shard_count')
+        self.processes: Dict[int, multiprocessing.Process] = {}
+        self.worker_stats: Dict[int, Dict[str, Any]] = {}
+        self.restarts = 0
+        self._mp = multiprocessing.get_context('spawn')  # Workers must not inherit the supervisors event loop.
+        self._stopping = False
+
+
+    def run(self):
+        loop = asyncio.get_event_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, self.stop)
+        loop.run_until_complete(self.start())
+
+
+    def stop(self):
+        log.warning("Stopping the cluster.")
+        self._stopping = True
+        for process in self.processes.values():
+            process.terminate()
+
+
+    async def start(self):
+        # Set up the DB once, here, instead of in every worker.
+        db_pool = await db.create_db_pool(self.config['db_uri'], min_size=1, max_size=1)
+        await db.create_tables(db_pool)
+        await db.migrate_to_latest(db_pool)
+        await db_pool.close()
+
+        if self.shard_count is None:
+            self.shard_count = await get_recommended_shard_count(self.config['token'])
+        ranges = shard_ranges(self.shard_count, self.worker_count)
+        log.info(f"Starting {self.worker_count} workers for {self.shard_count} shards: {ranges}")
+
+        if os.path.exists(self.ipc_path):
+            os.remove(self.ipc_path)
+        server = await asyncio.start_unix_server(self.handle_worker, path=self.ipc_path)
+
+        for worker_id, shard_ids in enumerate(ranges):
+            self.start_worker(worker_id, shard_ids)
+
+        try:
+            await self.monitor(ranges)
+        finally:
+            server.close()
+            for process in self.processes.values():
+                process.join(timeout=10)
+
+
+    def start_worker(self, worker_id: int, shard_ids: List[int]):
+        process = self._mp.Process(target=self.worker_target, name=f"void-worker-{worker_id}",
+                                   args=(self.config, self.shard_count, shard_ids, worker_id, self.ipc_path))
+        process.start()
+        self.processes[worker_id] = process
+        log.info(f"Started worker {worker_id} (PID {process.pid}) with shards {shard_ids}")
+
+
+    async def monitor(self, ranges: List[List[int]]):
+        """Restarts any workers that die until the cluster is stopped."""
+        while not self._stopping:
+            await asyncio.sleep(self.restart_delay)
+            for worker_id, process in list(self.processes.items()):
+                if not process.is_alive() and not self._stopping:
+                    log.error(f"Worker {worker_id} (PID {process.pid}) exited with code {process.exitcode}. Restarting it.")
+                    self.worker_stats.pop(worker_id, None)
+                    self.restarts += 1
+                    self.start_worker(worker_id, ranges[worker_id])
+
+
+    async def handle_worker(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        """Each line from a worker is its latest stats. Each reply is the aggregated cluster stats."""
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                stats = json.loads(line)
+                self.worker_stats[stats['worker_id']] = stats
+
+                cluster_stats = aggregate_stats(self.worker_stats)
+                cluster_stats['totals']['restarts'] = self.restarts
+                writer.write(json.dumps(cluster_stats).encode() + b"\n")
+                await writer.drain()
+        except (ConnectionError, json.JSONDecodeError) as e:
+            log.warning(f"Lost connection to a worker: {e}")
+        finally:
+            writer.close()
+
+
+class ClusterClient:
+    """Runs in a worker. Reports the workers stats to the supervisor and keeps the latest cluster wide stats."""
+
+    def __init__(self, bot: 'VBot', worker_id: int, ipc_path: str = DEFAULT_IPC_PATH, interval: float = 15.0):
+        self.bot = bot
+        self.worker_id = worker_id
+        self.ipc_path = ipc_path
+        self.interval = interval
+        self.stats: Optional[Dict[str, Any]] = None
+        self.updated_at: Optional[float] = None
+        self._task = bot.loop.create_task(self._run())
+
+
+    def stop(self):
+        self._task.cancel()
+
+
+    async def _run(self):
+        await self.bot.wait_until_ready()
+        while True:
+            try:
+                reader, writer = await asyncio.open_unix_connection(self.ipc_path)
+                try:
+                    while True:
+                        stats = collect_worker_stats(self.bot, self.worker_id)
+                        writer.write(json.dumps(stats).encode() + b"\n")
+                        await writer.drain()
+                        line = await reader.readline()
+                        if not line:
+                            break
+                        self.stats = json.loads(line)
+                        self.updated_at = time.time()
+                        await asyncio.sleep(self.interval)
+                finally:
+                    writer.close()
+            except (ConnectionError, FileNotFoundError, json.JSONDecodeError) as e:
+                log.warning(f"Could not reach the cluster supervisor: {e}")
+            await asyncio.sleep(self.interval)
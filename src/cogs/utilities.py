@@ -6,13 +6,17 @@ Commands include:
     stats
     verify_perm
     purge
+    profile
 
 Part of the void.
 """
 
 
+import io
 import os
+import math
 import time
+import asyncio
 import logging
 from typing import TYPE_CHECKING, Optional, Dict, List, Union, Tuple, NamedTuple
 
@@ -21,6 +25,8 @@ import discord
 from discord.ext import commands
 
 from utils.paginator import FieldPages
+from utils.profiler import SamplingProfiler
+from utils.metrics import metrics, format_lag_histogram
 import db
 
 if TYPE_CHECKING:
@@ -28,6 +34,9 @@ if TYPE_CHECKING:
 
 log = logging.getLogger(__name__)
 
+FIELD_LIMIT = 1024  # The most characters Discord allows in an embed field value.
+SLOWEST_SHARDS = 5  # How many shards are listed individually once there are too many to list them all.
+
 
 class Utilities(commands.Cog):
     def __init__(self, bot: 'VBot'):
@@ -112,6 +121,12 @@ class Utilities(commands.Cog):
                                   description="Round trip messaging time: **{:.2f} ms**. \nAPI latency: **{:.2f} ms**.\nDatabase latency: **{:.2f} ms**".
                                   format((time.perf_counter() - start) * 1000, self.bot.latency * 1000,
                                          (db_end - db_start) * 1000), color=0x000000)
+
+        guild_counts = self.bot.shard_guild_counts()
+        shard_lines = {shard_id: f"Shard {shard_id}{' (This server)' if shard_id == ctx.guild.shard_id else ''}: **{latency * 1000:.2f} ms**, {guild_counts.get(shard_id, 0)} guilds"
+                       for shard_id, latency in self.bot.latencies}
+        new_embed.add_field(name="Shard Latencies", value=self.format_shard_lines(shard_lines, ctx.guild.shard_id), inline=False)
+        self.add_loop_lag_field(new_embed)
         await msg.edit(embed=new_embed)
 
 
@@ -120,37 +135,95 @@ class Utilities(commands.Cog):
                       description='Shows various stats such as CPU, memory usage, disk space usage, and more.')
     async def stats_command(self, ctx: commands.Context):
 
-        def folder_size(path='.'):
-            total = 0
-            for entry in os.scandir(path):
-                if entry.is_file():
-                    total += entry.stat().st_size
-                elif entry.is_dir():
-                    total += folder_size(entry.path)
-            return total
-
-        pid = os.getpid()
-        py = psutil.Process(pid)
-        memory_use = py.memory_info()[0] / 1024 / 1024
-        disk_usage = psutil.disk_usage("/")
+        def system_stats():
+            # The psutil and disk calls are blocking system calls, so they are made off the event loop.
+            pid = os.getpid()
+            py = psutil.Process(pid)
+            memory_use = py.memory_info()[0] / 1024 / 1024
+            disk_usage = psutil.disk_usage("/")
+
+            try:
+                # noinspection PyUnresolvedReferences
+                load_average = os.getloadavg()
+            except AttributeError:  # Get load avg is not available on windows
+                load_average = [-1, -1, -1]
+            return psutil.cpu_percent(), load_average, memory_use, disk_usage
+
+        cpu_percent, load_average, memory_use, disk_usage = await self.bot.loop.run_in_executor(None, system_stats)
         disk_space_free = disk_usage.free / 1024 / 1024
         disk_space_used = disk_usage.used / 1024 / 1024
         disk_space_percent_used = disk_usage.percent
 
-        try:
-            # noinspection PyUnresolvedReferences
-            load_average = os.getloadavg()
-        except AttributeError:  # Get load avg is not available on windows
-            load_average = [-1, -1, -1]
-
         embed = discord.Embed(title="CPU and memory usage:",
                               description="CPU: **{}%** \nLoad average: **{:.2f}, {:.2f}, {:.2f}**\nMemory: **{:.2f} MB**"
                                           "\nDisk space: **{:.2f} MB Free**, **{:.2f} MB Used**, **{}% Used**\n# of guilds: **{}**".
-                              format(psutil.cpu_percent(), load_average[0], load_average[1], load_average[2],
+                              format(cpu_percent, load_average[0], load_average[1], load_average[2],
                                      memory_use, disk_space_free, disk_space_used, disk_space_percent_used, len(self.bot.guilds)), color=0x000000)
 
+        embed.add_field(name="Shards", value=self.format_shard_lines(self.get_shard_stats()), inline=False)
+
+        if self.bot.cluster is not None and self.bot.cluster.stats is not None:
+            totals = self.bot.cluster.stats['totals']
+            embed.add_field(name="Cluster",
+                            value=f"Workers: **{totals['workers']}** ({totals['restarts']} restarts), Shards: **{totals['shards']}**, "
+                                  f"Guilds: **{totals['guilds']}**\nMemory: **{totals['memory_mb']:.2f} MB**\n"
+                                  f"Deleted: **{totals['deleted']}**, Backlog: **{totals['backlog']}**, Scheduled: **{totals['scheduled']}**\n"
+                                  f"Updated {time.time() - self.bot.cluster.updated_at:.0f} seconds ago.",
+                            inline=False)
+        self.add_loop_lag_field(embed)
         await ctx.send(embed=embed)
 
+
+    def add_loop_lag_field(self, embed: discord.Embed):
+        """Adds the event loop lag percentiles of the last hour and a histogram of them."""
+        histogram = metrics.loop_lag.histogram('1h')
+        if histogram.count == 0:
+            return
+        summary = histogram.summary()
+        value = f"p50: **{summary['p50'] * 1000:.2f} ms**, p99: **{summary['p99'] * 1000:.2f} ms**, max: **{summary['max'] * 1000:.2f} ms**"
+        if self.bot.watchdog is not None:
+            value += f"\nStalls over {self.bot.watchdog.threshold:.2f}s: **{self.bot.watchdog.stalls}**"
+        value += f"\n```{format_lag_histogram(histogram)}```"
+        embed.add_field(name="Event Loop Lag (last hour)", value=value, inline=False)
+
+
+    def get_shard_stats(self) -> Dict[int, str]:
+        """Formats the latency, guild count and deletion stats of each shard."""
+        void_cog = self.bot.get_cog('Void')
+        guild_counts = self.bot.shard_guild_counts()
+        stats = {}
+        for shard_id, latency in self.bot.latencies:
+            msg = f"Shard {shard_id}: **{latency * 1000:.2f} ms**, **{guild_counts.get(shard_id, 0)}** guilds"
+            deleter = void_cog.deleters.get(shard_id) if void_cog is not None else None
+            if deleter is not None:
+                msg += f", **{deleter.deleted}** deleted, **{deleter.backlog}** backlog, **{deleter.scheduled}** scheduled"
+            stats[shard_id] = msg
+        return stats
+
+
+    def format_shard_lines(self, shard_lines: Dict[int, str], current_shard: Optional[int] = None) -> str:
+        """
+        Joins the lines of all the shards when they fit in an embed field.
+        Otherwise the latencies are summarized, and only the slowest shards and 'current_shard' are listed.
+        """
+        value = "\n".join(shard_lines.values())
+        if len(value) <= FIELD_LIMIT:
+            return value or "None"
+
+        # Shards that are not connected report a latency of inf or nan. Count them as the slowest.
+        latencies = {shard_id: latency if math.isfinite(latency) else math.inf for shard_id, latency in self.bot.latencies}
+        connected = [latency * 1000 for latency in latencies.values() if math.isfinite(latency)]
+        lines = [f"**{len(latencies)}** shards, **{len(latencies) - len(connected)}** not connected."]
+        if connected:
+            lines.append(f"Latency min/avg/max: **{min(connected):.2f}** / **{sum(connected) / len(connected):.2f}** / **{max(connected):.2f} ms**")
+        listed = sorted(latencies, key=latencies.get, reverse=True)[:SLOWEST_SHARDS]
+        if current_shard is not None and current_shard not in listed:
+            listed.append(current_shard)
+        lines.append("Slowest shards:")
+        lines.extend(shard_lines[shard_id] for shard_id in listed if shard_id in shard_lines)
+        value = "\n".join(lines)
+        return value if len(value) <= FIELD_LIMIT else value[:FIELD_LIMIT - 1] + "\N{HORIZONTAL ELLIPSIS}"
+
     # region Permissions Verification Command
     @commands.command(name="permissions",
                       aliases=["verify_permissions", "perm", "permissions_check", "perm_check", "verify_perm"],
@@ -237,11 +310,17 @@ class Utilities(commands.Cog):
     # region DB Performance Statistics Command
     @commands.cooldown(rate=1, per=10, type=commands.BucketType.default)
     @commands.command(aliases=["db_stats", "db_performance"],
-                      brief="Shows various time stats for the database.",)
-    async def db_perf(self, ctx: commands.Context):
+                      brief="Shows various time stats for the database.",
+                      usage="[1m|1h|lifetime]")
+    async def db_perf(self, ctx: commands.Context, window: str = "lifetime"):
+
+        window = window.lower()
+        if window not in db.DBPerformance.WINDOWS:
+            await ctx.send(f"⚠ The window must be one of: {', '.join(db.DBPerformance.WINDOWS)}")
+            return
 
         embed_entries = []
-        stats = db.db_perf.stats()
+        stats = db.db_perf.stats(window)
 
         for key, value in stats.items():
             # Don't bother showing stats for one offs
@@ -260,10 +339,43 @@ class Utilities(commands.Cog):
                     embed_entries.append((header, msg))
 
         page = FieldPages(ctx, entries=embed_entries, per_page=15)
-        page.embed.title = f"DB Statistics:"
+        page.embed.title = f"DB Statistics ({window}, ms):"
         await page.paginate()
     # endregion
 
+    # region Profiler Command
+    @commands.is_owner()
+    @commands.max_concurrency(1, per=commands.BucketType.default, wait=False)
+    @commands.cooldown(rate=1, per=30, type=commands.BucketType.default)
+    @commands.command(name="profile",
+                      brief="Profiles the event loop for a number of seconds.",
+                      description="Samples the stack of the event loop for a number of seconds (up to 300) and uploads the collapsed stacks "
+                                  "(for flamegraph.pl or speedscope) along with a summary of the top functions.",
+                      usage="[seconds] [top]")
+    async def profile(self, ctx: commands.Context, seconds: int = 30, top: int = 25):
+
+        seconds = min(max(seconds, 1), 300)
+        profiler = SamplingProfiler()
+        try:
+            profiler.start()
+        except RuntimeError as e:
+            await ctx.send(f"⚠ {e}")
+            return
+
+        await ctx.send(f"Profiling the event loop for {seconds} seconds...")
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            profiler.stop()
+
+        summary = profiler.summary(min(max(top, 1), 100))
+        stamp = time.strftime("%Y%m%d-%H%M%S")
+        files = [discord.File(io.BytesIO(profiler.collapsed().encode()), filename=f"profile-{stamp}.collapsed"),
+                 discord.File(io.BytesIO(summary.encode()), filename=f"profile-{stamp}-top.txt")]
+        header = "\n".join(summary.splitlines()[:2])
+        await ctx.send(content=f"```{header}```", files=files)
+    # endregion
+
     @commands.Cog.listener()
     async def on_command_error(self, ctx, error):
 
@@ -3,8 +3,12 @@ Cog implementing the void
 Part of the void.
 """
 
+import re
+import time
+import asyncio
 import logging
-from typing import TYPE_CHECKING, Optional, Dict, List, Union, Tuple, NamedTuple, Type, Any
+from dataclasses import replace
+from typing import TYPE_CHECKING, Optional, Dict, List, Union, Set, Tuple, NamedTuple, Type, Any, Callable
 
 import discord
 from discord.ext import commands
@@ -14,6 +18,16 @@ import db
 
 from utils.uiElements import BoolPage
 from utils.misc import get_webhook
+from utils.deletionEngine import DeletionEngine, snowflake_timestamp, timestamp_snowflake
+from utils.exemptions import ExemptionMatcher, MemberRoles, TTLSet, compile_pattern
+from utils.purgeEngine import Purge, parse_filters, describe_filters
+from utils.rateLimits import RestClient
+from utils.pendingStore import PendingDeletionStore
+from utils.sweeper import CatchUpSweeper
+from utils.periodicSweeper import PeriodicSweeper
+from utils.backpressure import SlowmodeGovernor
+from utils.metrics import metrics
+from utils.tracing import tracer
 
 if TYPE_CHECKING:
     from bot import VBot
@@ -25,13 +39,204 @@ class Void(commands.Cog):
 
     def __init__(self, bot: 'VBot'):
         self.bot = bot
-    #     self.void = {}
-    #     self.initialized = False
-    #
-    # await def init_void_cache(self):
-    #     voids = await db.get_all_void_ch(self.bot.db_pool)
-    #
-    #     for void in voids:
+        self.void_channels: Dict[int, db.VoidChannel] = {}  # Authoritative channel_id -> VoidChannel map once initialized.
+        self._changed_before_init: Set[int] = set()  # Channels that commands changed while init_void_cache was still loading.
+        self.exemptions: Dict[int, ExemptionMatcher] = {}  # channel_id -> compiled exemption rules, for the channels that have any.
+        self.protected = TTLSet()  # IDs of our own messages that must not be voided. See protect().
+        self.member_roles = MemberRoles(bot)  # For the role exemptions of history messages, which carry no member object.
+        self.purges: Dict[int, Purge] = {}  # channel_id -> the purge running in it
+        self.initialized = False
+        self.store = PendingDeletionStore(bot)
+        self.rest = RestClient(bot)  # Shared by all the shards so that they share the global rate limit.
+        self.deleters: Dict[int, DeletionEngine] = {}  # shard_id -> DeletionEngine
+        self.sweeper = CatchUpSweeper(bot, self.get_deleter, self.store, self.is_exempt_history)
+        config = bot.config or {}
+        self.periodic_sweeper = PeriodicSweeper(bot, self.get_deleter, lambda: self.void_channels.values(), self.is_exempt_payload,
+                                                interval=config.get('sweep_interval', 30), concurrency=config.get('sweep_concurrency', 4))
+        self.backpressure = SlowmodeGovernor(bot, lambda channel_id: self.void_channels.get(channel_id), self.get_deleter,
+                                             threshold=config.get('backpressure_threshold', 1000), horizon=config.get('backpressure_horizon', 30),
+                                             delay=config.get('backpressure_slowmode', 10), max_delay=config.get('backpressure_max_slowmode', 120),
+                                             hold=config.get('backpressure_hold', 30))
+        self._parse_message_create: Optional[Callable[[Dict[str, Any]], None]] = None  # discord.py's parser, while the fast path is installed.
+        self._prefixes: Tuple[str, ...] = ()
+        if config.get('raw_fast_path', False):
+            self.install_fast_path()
+        if bot.recorder is not None:
+            bot.recorder.void_lookup = lambda channel_id: self.void_channels.get(channel_id)
+        self.bot.loop.create_task(self.init_void_cache())
+        self._webhooks_loaded = self.bot.loop.create_task(self.bot.webhook_cache.load())  # is_exempt needs our webhook IDs.
+        self.bot.loop.create_task(self.restore_pending_deletions())
+        self.bot.loop.create_task(self.restore_purges())
+        self.periodic_sweeper.start()
+        self.backpressure.start()
+
+
+    def cog_unload(self):
+        self.uninstall_fast_path()
+        if self.bot.recorder is not None:
+            self.bot.recorder.void_lookup = None
+        for deleter in self.deleters.values():
+            deleter.stop()
+        for purge in self.purges.values():
+            purge.stop()  # They keep their checkpoints, and resume when the cog is loaded again.
+        self.periodic_sweeper.stop()
+        self.backpressure.stop()
+        self.bot.loop.create_task(self.store.stop())
+        self.bot.loop.create_task(self.rest.close())
+
+
+    def shard_id_for(self, guild_id: int) -> int:
+        return (guild_id >> 22) % (self.bot.shard_count or 1)
+
+
+    def get_deleter(self, guild_id: int) -> DeletionEngine:
+        """Gets the deletion engine for the shard that the guild is on."""
+        shard_id = self.shard_id_for(guild_id)
+        deleter = self.deleters.get(shard_id)
+        if deleter is None:
+            deleter = self.deleters[shard_id] = DeletionEngine(self.bot, store=self.store, rest=self.rest, shard_id=shard_id,
+                                                               protected=self.protected)
+        return deleter
+
+
+    def install_fast_path(self):
+        """
+        Hooks the raw MESSAGE_CREATE gateway parser. Plain messages in enabled void channels are scheduled for deletion straight
+        from the payload, without building a discord.Message or dispatching 'on_message'. Everything else is parsed as normal.
+        """
+        prefix = self.bot.command_prefix
+        if isinstance(prefix, str):
+            self._prefixes = (prefix,)
+        elif isinstance(prefix, (list, tuple)):
+            self._prefixes = tuple(prefix)
+        else:
+            log.warning("Not installing the raw MESSAGE_CREATE fast path: Command prefixes can not be checked from the raw payload.")
+            return
+
+        parsers = self.bot._connection.parsers  # Shared with the gateway websockets, so this also applies to connected shards.
+        if self._parse_message_create is None:
+            self._parse_message_create = parsers['MESSAGE_CREATE']
+        parsers['MESSAGE_CREATE'] = self.fast_message_create
+        log.info("Installed the raw MESSAGE_CREATE fast path.")
+
+
+    def uninstall_fast_path(self):
+        if self._parse_message_create is not None:
+            self.bot._connection.parsers['MESSAGE_CREATE'] = self._parse_message_create
+            self._parse_message_create = None
+
+
+    def fast_message_create(self, data: Dict[str, Any]):
+        """Replaces discord.py's MESSAGE_CREATE parser while the fast path is installed."""
+        void_ch = self.void_channels.get(int(data['channel_id'])) if self.initialized else None
+        if void_ch is None or not void_ch.enabled or self.needs_full_parse(data, void_ch):
+            self._parse_message_create(data)
+            return
+
+        metrics.messages_seen += 1
+        self.backpressure.record_arrival(void_ch.channel_id)
+        if void_ch.mode == db.MODE_SWEEP:
+            return  # The next sweep finds it in the history.
+        with tracer.trace("fast_message_create", channel_id=void_ch.channel_id, guild_id=void_ch.server_id) as span:
+            message_id = int(data['id'])
+            self.get_deleter(void_ch.server_id).schedule(void_ch.channel_id, message_id, void_ch.delete_after)
+            tracer.follow(message_id, span)
+
+
+    def needs_full_parse(self, data: Dict[str, Any], void_ch: db.VoidChannel) -> bool:
+        """
+        Checks if a void channel message payload has to go through the normal 'on_message' path:
+        Possible commands, our own messages and webhook messages and messages matching the channels exemption rules (which is_exempt checks),
+        and anything that a wait_for is listening for.
+        """
+        if data['content'].startswith(self._prefixes):
+            return True
+        if 'webhook_id' in data or int(data['author']['id']) == self.bot.user.id:
+            return True
+        matcher = self.exemptions.get(void_ch.channel_id)
+        if matcher is not None and matcher.matches_payload(data):
+            return True
+        return bool(self.bot._listeners.get('message'))
+
+
+    async def restore_pending_deletions(self):
+        """
+        Reschedules the deletions that were still pending when the bot last shut down.
+        Overdue deletions come due immediately and, being at the front of the heap, go out first in bulk.
+        """
+        await self.bot.wait_until_ready()
+        restored = 0
+        gone = []
+        for deletion in await self.store.load():
+            channel = self.bot.get_channel(deletion.channel_id)
+            if channel is None:
+                void_ch = self.void_channels.get(deletion.channel_id)
+                if void_ch is not None and self.bot.get_guild(void_ch.server_id) is not None:
+                    gone.append(deletion.message_id)  # The channel is gone.
+                continue  # Otherwise the guild is on another worker, which restores it.
+            self.get_deleter(channel.guild.id).scheduler.schedule(deletion.channel_id, deletion.message_id, deletion.due_at)
+            restored += 1
+        if gone:
+            self.store.confirm(gone)
+        log.info(f"Restored {restored} pending deletions.")
+
+
+    async def init_void_cache(self):
+        """Warm loads the void channel cache from the DB. Until this completes, lookups fall back to the DB."""
+        voids = await db.get_all_void_channel(self.bot.db_pool)
+        if voids is None:
+            log.error("Could not load the void channel cache! Falling back to DB lookups.")
+            return
+
+        for rules in await db.get_all_exemption_rules(self.bot.db_pool) or []:
+            try:
+                self.exemptions[rules.channel_id] = ExemptionMatcher(rules)
+            except re.error as e:
+                log.warning(f"Ignoring the content regex of channel {rules.channel_id}, which can not be used: {e}")
+                self.exemptions[rules.channel_id] = ExemptionMatcher(replace(rules, content_regex=None))
+
+        # Merge rather than replace, so that the commands that ran during the load are not undone by the older rows it read.
+        for void in voids:
+            if void.channel_id not in self._changed_before_init:
+                self.void_channels[void.channel_id] = void
+        self._changed_before_init.clear()
+        self.initialized = True
+        log.info(f"Loaded {len(self.void_channels)} void channels into the cache.")
+
+
+    async def get_void_channel(self, channel_id: int) -> Optional[db.VoidChannel]:
+        if self.initialized:
+            return self.void_channels.get(channel_id)
+        return await db.get_void_channel(self.bot.db_pool, channel_id)
+
+
+    def cache_void_channel(self, channel_id: int, void_ch: Optional[db.VoidChannel]):
+        """Updates the cache after the change was written to the DB. None removes the channel."""
+        if not self.initialized:
+            self._changed_before_init.add(channel_id)
+        if void_ch is None:
+            self.void_channels.pop(channel_id, None)
+        else:
+            self.void_channels[channel_id] = void_ch
+
+
+    def mark_void_channel(self, channel_id: int):
+        """
+        Marks the history of a channel as handled up to now, when it is added, enabled or disabled. Otherwise the next catch-up sweep
+        or periodic sweep would delete the messages posted before it became a void channel, or while it was disabled.
+        """
+        now = timestamp_snowflake(time.time())
+        self.store.advance_high_water(channel_id, now)
+        self.periodic_sweeper.swept_to[channel_id] = max(now, self.periodic_sweeper.swept_to.get(channel_id, 0))
+
+
+    def protect(self, message_id: int, ttl: Optional[float] = None):
+        """
+        Keeps one of our messages from being voided for 'ttl' seconds (10 minutes by default).
+        The message may already have been scheduled by the time its ID is known, so the deletion engines check again when it comes due.
+        """
+        self.protected.add(message_id, ttl)
+
 
     # region set void channels Command
 
@@ -40,7 +245,7 @@ class Void(commands.Cog):
     @commands.guild_only()
     @eCommands.group(name="void_ch", aliases=["void_channel", "vc"], brief="Add, Remove, List and Configure void channels",
                      #description="Sets/unsets/shows the default logging channel.",  # , usage='<command> [channel]'
-                     examples=['list', "add #void-channel", "add 123456789123456789", 'remove #void-channel', 'time #vent 2.5']
+                     examples=['list', "add #void-channel", "add 123456789123456789", 'remove #void-channel', 'time #vent 2.5', 'mode #vent sweep', 'stats']
                      )
     async def void_ch_conf(self, ctx: commands.Context):
         if ctx.invoked_subcommand is None:
@@ -50,8 +255,16 @@ class Void(commands.Cog):
                           examples=["#thevoid", "123456789123456789"])
     async def add_void_ch(self, ctx: commands.Context, channel: discord.TextChannel):
         ch_perm: discord.Permissions = channel.guild.me.permissions_in(channel)
-        if ch_perm.manage_messages and ch_perm.read_messages:
-            await db.add_void_ch(self.bot.db_pool, ctx.guild.id, channel.id, enabled=True, delete_after=5)
+        if await self.get_void_channel(channel.id) is not None:
+            embed = discord.Embed(color=0x000000,
+                                  description=f"\N{WARNING SIGN} <#{channel.id}> is already a void channel. Its settings were left as they are.\n")
+            await ctx.send(embed=embed)
+        elif ch_perm.manage_messages and ch_perm.read_messages:
+            if await db.add_void_ch(self.bot.db_pool, ctx.guild.id, channel.id, enabled=True, delete_after=5) is None:
+                await self.send_db_error(ctx)
+                return
+            self.cache_void_channel(channel.id, db.VoidChannel(server_id=ctx.guild.id, channel_id=channel.id, enabled=True, delete_after=5))
+            self.mark_void_channel(channel.id)
             embed = discord.Embed(color=0x000000,
                                   description=f"<#{channel.id}> is now a void channel and has been enabled.\n"
                                               f"All messages sent in that channel will now be deleted after 5 seconds.")
@@ -71,7 +284,13 @@ class Void(commands.Cog):
     @void_ch_conf.command(name="remove", brief="Removes a void channel",
                           examples=["#screammmm", "123456789123456789"])
     async def remove_void_ch(self, ctx: commands.Context, channel: discord.TextChannel):
-        await db.remove_void_ch(self.bot.db_pool, ctx.guild.id, channel.id)
+        if await db.remove_void_ch(self.bot.db_pool, ctx.guild.id, channel.id) is None:
+            await self.send_db_error(ctx)
+            return
+        self.cache_void_channel(channel.id, None)
+        self.periodic_sweeper.forget(channel.id)
+        if self.exemptions.pop(channel.id, None) is not None:
+            await db.remove_exemption_rules(self.bot.db_pool, channel.id)
         embed = discord.Embed(color=0x000000,
                               description=f"<#{channel.id}> is no longer configured as a void channel\n")
         await ctx.send(embed=embed)
@@ -85,7 +304,7 @@ class Void(commands.Cog):
             msg = ["The following channels are currently configured as void channels:"]
             for void_ch in void_channels:
                 enabled_txt = "Yes" if void_ch.enabled else "No"
-                msg.append(f"<#{void_ch.channel_id}>, Enabled: {enabled_txt}, Delete After {void_ch.delete_after} Seconds.")
+                msg.append(f"<#{void_ch.channel_id}>, Enabled: {enabled_txt}, Delete After {void_ch.delete_after} Seconds, Mode: {void_ch.mode}.")
         else:
             msg = ["There are currently no channels configured as void channels.\n"]
 
@@ -94,12 +313,50 @@ class Void(commands.Cog):
                               color=0x000000)
         await ctx.send(embed=embed)
 
+    @void_ch_conf.command(name="stats", brief="Shows the deletion backlog and rate of the void channels")
+    async def stats_void_ch(self, ctx: commands.Context):
+
+        void_channels = [void_ch for void_ch in self.void_channels.values() if void_ch.server_id == ctx.guild.id]
+        if len(void_channels) > 0:
+            msg = []
+            for void_ch in void_channels:
+                queue = self.get_deleter(ctx.guild.id).queues.get(void_ch.channel_id)
+                if queue is None:
+                    msg.append(f"<#{void_ch.channel_id}>, Mode: {void_ch.mode}, Nothing deleted yet.")
+                else:
+                    api_calls = queue.rest_calls + self.periodic_sweeper.history_calls[void_ch.channel_id]
+                    forecast = self.backpressure.forecast(void_ch)
+                    msg.append(f"<#{void_ch.channel_id}>, Mode: {void_ch.mode}, Backlog: {queue.backlog}, "
+                               f"Arriving: {forecast.arrival_rate:.2f} msgs/sec, Rate: {queue.deletion_rate.rate:.2f} msgs/sec, "
+                               f"Deleted: {queue.deleted} in {api_calls} API calls.")
+                pressure = self.backpressure.pressure.get(void_ch.channel_id)
+                if pressure is not None and pressure.intervention is not None:
+                    msg.append(f"\N{WARNING SIGN} Slowmode raised to {pressure.intervention.raised_delay}s until the backlog drains.")
+        else:
+            msg = ["There are currently no channels configured as void channels.\n"]
+
+        embed = discord.Embed(title="Void Channel Stats",
+                              description="\n".join(msg),
+                              color=0x000000)
+        if len(void_channels) > 0:
+            per_mode = []
+            for mode, (deleted, api_calls) in self.mode_stats(ctx.guild.id).items():
+                per_mode.append(f"{mode}: {api_calls / deleted:.3f}" if deleted else f"{mode}: -")
+            embed.add_field(name="API calls per deleted message", value=", ".join(per_mode))
+        deleter = self.get_deleter(ctx.guild.id)
+        embed.set_footer(text=f"Shard {deleter.shard_id} backlog: {deleter.backlog}, Scheduled: {deleter.scheduled}, Rate limited: {self.rest.ratelimited} times")
+        await ctx.send(embed=embed)
+
     @void_ch_conf.command(name="enable", brief="Enables a void channel",
                           examples=["#screammmm", "123456789123456789"])
     async def enable_void_ch(self, ctx: commands.Context, channel: discord.TextChannel):
-        existing_void_ch_settings = await db.get_void_channel(self.bot.db_pool, channel.id)
+        existing_void_ch_settings = await self.get_void_channel(channel.id)
         if existing_void_ch_settings is not None:
-            await db.toggle_void_ch(self.bot.db_pool, ctx.guild.id, channel.id, True)
+            if await db.toggle_void_ch(self.bot.db_pool, ctx.guild.id, channel.id, True) is None:
+                await self.send_db_error(ctx)
+                return
+            self.cache_void_channel(channel.id, replace(existing_void_ch_settings, enabled=True))
+            self.mark_void_channel(channel.id)
             embed = discord.Embed(color=0x000000,
                                   description=f"<#{channel.id}> is now enabled. All messages sent in that channel will now be deleted after {existing_void_ch_settings.delete_after} seconds..\n")
             await ctx.send(embed=embed)
@@ -111,10 +368,14 @@ class Void(commands.Cog):
     @void_ch_conf.command(name="disable", brief="Disables a void channel",
                           examples=["#screammmm", "123456789123456789"])
     async def disable_void_ch(self, ctx: commands.Context, channel: discord.TextChannel):
-        existing_void_ch_settings = await db.get_void_channel(self.bot.db_pool, channel.id)
+        existing_void_ch_settings = await self.get_void_channel(channel.id)
 
         if existing_void_ch_settings is not None:
-            await db.toggle_void_ch(self.bot.db_pool, ctx.guild.id, channel.id, False)
+            if await db.toggle_void_ch(self.bot.db_pool, ctx.guild.id, channel.id, False) is None:
+                await self.send_db_error(ctx)
+                return
+            self.cache_void_channel(channel.id, replace(existing_void_ch_settings, enabled=False))
+            self.mark_void_channel(channel.id)
             embed = discord.Embed(color=0x000000,
                                   description=f"<#{channel.id}> is now disabled. Messages will no longer be deleted.\n")
             await ctx.send(embed=embed)
@@ -126,10 +387,13 @@ class Void(commands.Cog):
     @void_ch_conf.command(name="time", brief="Sets how long until messages are deleted from a channel",
                           examples=["#screammmm 1.4", "123456789123456789 6"])
     async def time_void_ch(self, ctx: commands.Context, channel: discord.TextChannel, seconds: float):
-        existing_void_ch_settings = await db.get_void_channel(self.bot.db_pool, channel.id)
+        existing_void_ch_settings = await self.get_void_channel(channel.id)
         if existing_void_ch_settings is not None:
             if seconds >= 0:
-                await db.set_void_delete_time(self.bot.db_pool, ctx.guild.id, channel.id, delete_after=seconds)
+                if await db.set_void_delete_time(self.bot.db_pool, ctx.guild.id, channel.id, delete_after=seconds) is None:
+                    await self.send_db_error(ctx)
+                    return
+                self.cache_void_channel(channel.id, replace(existing_void_ch_settings, delete_after=seconds))
                 time_msg = "immediately" if seconds == 0 else f"after {seconds} seconds"
                 embed = discord.Embed(color=0x000000,
                                       description=f"Messages in <#{channel.id}> will now be deleted {time_msg}.\n")
@@ -143,6 +407,163 @@ class Void(commands.Cog):
                                   description=f"\N{WARNING SIGN} <#{channel.id}> has not yet been configured as a void channel!\n")
             await ctx.send(embed=embed)
 
+    # In the sweep mode messages can stay for up to one sweep interval longer, but very busy channels take far less work.
+    @void_ch_conf.command(name="mode", brief="Sets if messages are deleted one by one (message), or by sweeping the channel periodically (sweep)",
+                          examples=["#screammmm sweep", "123456789123456789 message"])
+    async def mode_void_ch(self, ctx: commands.Context, channel: discord.TextChannel, mode: str):
+        existing_void_ch_settings = await self.get_void_channel(channel.id)
+        mode = mode.lower()
+        if existing_void_ch_settings is None:
+            await self.send_not_void_ch(ctx, channel)
+        elif mode not in db.VOID_MODES:
+            embed = discord.Embed(color=0x000000,
+                                  description=f"\N{WARNING SIGN} The mode must be one of: {', '.join(f'`{m}`' for m in db.VOID_MODES)}.\n")
+            await ctx.send(embed=embed)
+        else:
+            if await db.set_void_mode(self.bot.db_pool, ctx.guild.id, channel.id, mode) is None:
+                await self.send_db_error(ctx)
+                return
+            void_ch = replace(existing_void_ch_settings, mode=mode)
+            self.cache_void_channel(channel.id, void_ch)
+            if mode == db.MODE_MESSAGE and existing_void_ch_settings.mode == db.MODE_SWEEP:
+                # The messages that the last sweep left behind have no timers yet. Schedule them, so none are missed.
+                self.bot.loop.create_task(self.periodic_sweeper.sweep_channel(void_ch, hand_over=True))
+            mode_msg = "each message is deleted when its time is up" if mode == db.MODE_MESSAGE else \
+                f"the channel is swept every {self.periodic_sweeper.interval} seconds and due messages are bulk deleted"
+            embed = discord.Embed(color=0x000000, description=f"<#{channel.id}> is now in the `{mode}` mode: {mode_msg}.\n")
+            await ctx.send(embed=embed)
+
+    @void_ch_conf.command(name="backlog", brief="Sets the predicted deletion backlog at which slowmode is raised. 0 never raises it, leave it out for the default",
+                          examples=["#screammmm 500", "#screammmm 0", "123456789123456789"])
+    async def backlog_void_ch(self, ctx: commands.Context, channel: discord.TextChannel, threshold: Optional[int] = None):
+        existing_void_ch_settings = await self.get_void_channel(channel.id)
+        if existing_void_ch_settings is None:
+            await self.send_not_void_ch(ctx, channel)
+        elif threshold is not None and threshold < 0:
+            embed = discord.Embed(color=0x000000, description=f"The threshold entered must be positive!\n")
+            await ctx.send(embed=embed)
+        else:
+            if await db.set_void_backlog_threshold(self.bot.db_pool, ctx.guild.id, channel.id, threshold) is None:
+                await self.send_db_error(ctx)
+                return
+            void_ch = replace(existing_void_ch_settings, backlog_threshold=threshold)
+            self.cache_void_channel(channel.id, void_ch)
+            if self.backpressure.threshold_for(void_ch) == 0:
+                msg = f"`void` will never raise the slowmode of <#{channel.id}>."
+            else:
+                msg = f"`void` will raise the slowmode of <#{channel.id}> when it predicts a deletion backlog of more than " \
+                      f"{self.backpressure.threshold_for(void_ch)} messages, and restore it once the backlog has drained."
+            await ctx.send(embed=discord.Embed(color=0x000000, description=msg))
+
+    # ----- Exemption rules Commands ----- #
+    @void_ch_conf.group(name="exempt", brief="Shows or sets which messages in a void channel are never deleted",
+                        invoke_without_command=True,
+                        examples=["#thevoid", "role #thevoid @Moderators", "user #thevoid @Someone", "bots #thevoid yes",
+                                  "webhooks #thevoid no", "pinned #thevoid yes", "regex #thevoid ^!keep", "clear #thevoid"])
+    async def exempt_void_ch(self, ctx: commands.Context, channel: discord.TextChannel):
+        if await self.get_void_channel(channel.id) is None:
+            await self.send_not_void_ch(ctx, channel)
+            return
+        await ctx.send(embed=self.exemptions_embed(channel))
+
+    @exempt_void_ch.command(name="role", brief="Toggles keeping the messages of a role", examples=["#thevoid @Moderators"])
+    async def exempt_role(self, ctx: commands.Context, channel: discord.TextChannel, role: discord.Role):
+        rules = self.get_exemption_rules(ctx.guild.id, channel.id)
+        role_ids = [r_id for r_id in rules.role_ids if r_id != role.id] if role.id in rules.role_ids else rules.role_ids + [role.id]
+        await self.set_exemption_rules(ctx, channel, replace(rules, role_ids=role_ids))
+
+    @exempt_void_ch.command(name="user", brief="Toggles keeping the messages of a user", examples=["#thevoid @Someone", "#thevoid 123456789123456789"])
+    async def exempt_user(self, ctx: commands.Context, channel: discord.TextChannel, user: discord.User):
+        rules = self.get_exemption_rules(ctx.guild.id, channel.id)
+        user_ids = [u_id for u_id in rules.user_ids if u_id != user.id] if user.id in rules.user_ids else rules.user_ids + [user.id]
+        await self.set_exemption_rules(ctx, channel, replace(rules, user_ids=user_ids))
+
+    @exempt_void_ch.command(name="bots", brief="Sets if messages from bots are kept", examples=["#thevoid yes", "#thevoid no"])
+    async def exempt_bots(self, ctx: commands.Context, channel: discord.TextChannel, keep: bool):
+        await self.set_exemption_rules(ctx, channel, replace(self.get_exemption_rules(ctx.guild.id, channel.id), bots=keep))
+
+    @exempt_void_ch.command(name="webhooks", brief="Sets if messages from webhooks are kept", examples=["#thevoid yes", "#thevoid no"])
+    async def exempt_webhooks(self, ctx: commands.Context, channel: discord.TextChannel, keep: bool):
+        await self.set_exemption_rules(ctx, channel, replace(self.get_exemption_rules(ctx.guild.id, channel.id), webhooks=keep))
+
+    @exempt_void_ch.command(name="pinned", brief="Sets if pinned messages are kept", examples=["#thevoid yes", "#thevoid no"])
+    async def exempt_pinned(self, ctx: commands.Context, channel: discord.TextChannel, keep: bool):
+        await self.set_exemption_rules(ctx, channel, replace(self.get_exemption_rules(ctx.guild.id, channel.id), pinned=keep))
+
+    @exempt_void_ch.command(name="regex", brief="Keeps messages matching a regular expression. Leave it out to remove it",
+                            examples=["#thevoid ^!keep", "#thevoid"])
+    async def exempt_regex(self, ctx: commands.Context, channel: discord.TextChannel, *, pattern: Optional[str] = None):
+        if pattern is not None:
+            try:
+                compile_pattern(pattern)  # It runs on every message, so patterns that could backtrack for long are refused too.
+            except re.error as e:
+                embed = discord.Embed(color=0x000000, description=f"\N{WARNING SIGN} That regular expression can not be used: {e}\n")
+                await ctx.send(embed=embed)
+                return
+        await self.set_exemption_rules(ctx, channel, replace(self.get_exemption_rules(ctx.guild.id, channel.id), content_regex=pattern))
+
+    @exempt_void_ch.command(name="clear", brief="Removes all of the exemption rules of a void channel", examples=["#thevoid"])
+    async def exempt_clear(self, ctx: commands.Context, channel: discord.TextChannel):
+        await self.set_exemption_rules(ctx, channel, db.ExemptionRules(server_id=ctx.guild.id, channel_id=channel.id))
+
+
+    def get_exemption_rules(self, guild_id: int, channel_id: int) -> db.ExemptionRules:
+        matcher = self.exemptions.get(channel_id)
+        return matcher.rules if matcher is not None else db.ExemptionRules(server_id=guild_id, channel_id=channel_id)
+
+
+    async def set_exemption_rules(self, ctx: commands.Context, channel: discord.TextChannel, rules: db.ExemptionRules):
+        if await self.get_void_channel(channel.id) is None:
+            await self.send_not_void_ch(ctx, channel)
+            return
+
+        matcher = ExemptionMatcher(rules)
+        if matcher.empty:
+            if await db.remove_exemption_rules(self.bot.db_pool, channel.id) is None:
+                await self.send_db_error(ctx)
+                return
+            self.exemptions.pop(channel.id, None)
+        else:
+            if await db.set_exemption_rules(self.bot.db_pool, rules) is None:
+                await self.send_db_error(ctx)
+                return
+            self.exemptions[channel.id] = matcher
+        await ctx.send(embed=self.exemptions_embed(channel))
+
+
+    def exemptions_embed(self, channel: discord.TextChannel) -> discord.Embed:
+        matcher = self.exemptions.get(channel.id)
+        if matcher is None:
+            msg = [f"Every message in <#{channel.id}> is deleted, other than those sent by `void` itself."]
+        else:
+            rules = matcher.rules
+            msg = [f"The following messages in <#{channel.id}> are never deleted:"]
+            if rules.role_ids:
+                msg.append("Messages from the roles: " + ", ".join(f"<@&{role_id}>" for role_id in rules.role_ids))
+            if rules.user_ids:
+                msg.append("Messages from the users: " + ", ".join(f"<@{user_id}>" for user_id in rules.user_ids))
+            if rules.bots:
+                msg.append("Messages from bots.")
+            if rules.webhooks:
+                msg.append("Messages from webhooks.")
+            if rules.pinned:
+                msg.append("Pinned messages, for as long as they are pinned.")
+            if rules.content_regex:
+                msg.append(f"Messages matching: `{rules.content_regex}`")
+        return discord.Embed(title="Void Channel Exemptions", description="\n".join(msg), color=0x000000)
+
+
+    async def send_not_void_ch(self, ctx: commands.Context, channel: discord.TextChannel):
+        embed = discord.Embed(color=0x000000,
+                              description=f"\N{WARNING SIGN} <#{channel.id}> has not yet been configured as a void channel!\n")
+        await ctx.send(embed=embed)
+
+
+    async def send_db_error(self, ctx: commands.Context):
+        embed = discord.Embed(color=0x000000,
+                              description=f"\N{WARNING SIGN} The change could not be saved, so nothing was changed. Please try again later.\n")
+        await ctx.send(embed=embed)
+
     # endregion
 
     @commands.has_permissions(manage_messages=True)
@@ -161,58 +582,217 @@ class Void(commands.Cog):
                                   title="`void` proxy",
                                   description=f"\N{WARNING SIGN} The proxy command requires that `void` has the **Manage Webhooks** permission.\n"
                                               f"\nThis message will be sucked into the void in 20 seconds.")
-            await ctx.send(embed=embed, delete_after=20)
+            msg = await ctx.send(embed=embed, delete_after=20)
+            self.protect(msg.id)
             return
 
         avatar = author.avatar_url_as(static_format="png")
         clean_content = discord.utils.escape_mentions(message)
-        await webhook.send(content=clean_content, username=author.display_name, avatar_url=avatar)
+        try:
+            await webhook.send(content=clean_content, username=author.display_name, avatar_url=avatar)
+        except discord.NotFound:
+            # The cached webhook was deleted while we were not watching (e.g. while the bot was down). Get a new one and retry once.
+            await self.bot.webhook_cache.invalidate(ch.id)
+            webhook = await get_webhook(self.bot, ch)
+            await webhook.send(content=clean_content, username=author.display_name, avatar_url=avatar)
 
     @commands.has_permissions(manage_messages=True)
     @commands.guild_only()
-    @eCommands.group(name="purge",
+    @eCommands.group(name="purge", invoke_without_command=True,
                      brief="Purges a channel of 'n' messages.",
-                     examples=['20'],
-                     usage="<Number Of Messages>"
+                     examples=['20', '500 from:@someone', '100 attachments', '1000 after:123456789123456789 regex:^!roll', 'cancel'],
+                     usage="<Number Of Messages> [from:<user>] [before:<message ID>] [after:<message ID>] [attachments] [regex:<pattern>]"
                      )
-    async def purge(self, ctx: commands.Context, num: int):
+    async def purge(self, ctx: commands.Context, num: int, *, filters: Optional[str] = None):
         ch: discord.TextChannel = ctx.channel
+        if num <= 0:
+            raise commands.BadArgument("The number of messages must be positive.")
+        if ch.id in self.purges:
+            embed = discord.Embed(color=0x000000,
+                                  description=f"\N{WARNING SIGN} A purge is already running in <#{ch.id}>. It can be stopped with the `purge cancel` command.\n")
+            await ctx.send(embed=embed)
+            return
+
+        fields = parse_filters(filters)
+        job = db.PurgeJob(server_id=ctx.guild.id, channel_id=ch.id, requested_by=ctx.author.id, status_message_id=None, remaining=num,
+                          before=fields.pop('before', ctx.message.id), started_at=time.time(), **fields)
 
-        embed = discord.Embed(title="`void` purge", description=f"Are you sure you want to delete the last {num} messages?")
-        confirmation= BoolPage(embed=embed)
+        embed = discord.Embed(title="`void` purge", description=f"Are you sure you want to delete the last {num} messages{describe_filters(job)}?")
+        confirmation = BoolPage(embed=embed, on_sent=lambda msg: self.protect(msg.id))
         yes = await confirmation.run(ctx)
-        if yes:
-            try:
-                await ch.purge(limit=num)
-            except discord.Forbidden:
-                embed = discord.Embed(color=0x000000,
-                                      description=f"\N{WARNING SIGN} Could not purge messages! The purge command requires that `void` has the **Manage Messages** and the **Read Message History** permissions.\n"
-                                                  f"\nThis message will be sucked into the void in 20 seconds.")
-                await ctx.send(embed=embed, delete_after=20)
-                return
+        if yes and ch.id not in self.purges:
+            purge = Purge(self.bot, self.rest, job, self.protected, self.purge_done)
+            status_message = await ctx.send(embed=purge.progress_embed())
+            job.status_message_id = status_message.id
+            await db.add_purge_job(self.bot.db_pool, job)
+            self.purges[ch.id] = purge
+            purge.start()
+
+
+    @purge.command(name="cancel", brief="Stops the purge that is running in this channel")
+    async def purge_cancel(self, ctx: commands.Context):
+        purge = self.purges.get(ctx.channel.id)
+        if purge is None:
+            embed = discord.Embed(color=0x000000, description=f"There is no purge running in <#{ctx.channel.id}>.\n")
+        else:
+            await purge.cancel()
+            embed = discord.Embed(color=0x000000,
+                                  description=f"The purge of <#{ctx.channel.id}> has been stopped after deleting {purge.job.deleted} messages.\n")
+        await ctx.send(embed=embed)
+
+
+    def purge_done(self, purge: Purge):
+        if self.purges.get(purge.job.channel_id) is purge:
+            del self.purges[purge.job.channel_id]
+
+
+    async def restore_purges(self):
+        """Resumes the purges that were still running when the bot last shut down."""
+        await self.bot.wait_until_ready()
+        for job in await db.get_purge_jobs(self.bot.db_pool) or []:
+            if self.bot.get_channel(job.channel_id) is None:
+                if self.bot.get_guild(job.server_id) is not None:
+                    await db.remove_purge_job(self.bot.db_pool, job.channel_id)  # The channel is gone.
+                continue  # Otherwise the guild is on another worker, which resumes it.
+            if job.channel_id not in self.purges:
+                try:
+                    purge = Purge(self.bot, self.rest, job, self.protected, self.purge_done)
+                except re.error as e:
+                    log.warning(f"Dropping the purge of channel {job.channel_id}, whose content regex can not be used: {e}")
+                    await db.remove_purge_job(self.bot.db_pool, job.channel_id)
+                    continue
+                self.purges[job.channel_id] = purge
+                purge.start()
+                log.info(f"Resumed the purge of channel {job.channel_id} with {job.remaining} messages left.")
 
 
     @commands.Cog.listener()
     async def on_message(self, message: discord.Message):
         """Handles the 'on_message' event."""
+        metrics.messages_seen += 1
+
+        with tracer.trace("on_message", channel_id=message.channel.id) as span:
+            # check if this is a void channel. Once the cache is loaded, non void channels cost no I/O at all.
+            if self.initialized:
+                void_ch = self.void_channels.get(message.channel.id)
+            else:
+                void_ch = await db.get_void_channel(self.bot.db_pool, message.channel.id)
+            span.tag('void_channel', void_ch is not None)
+
+            if void_ch is not None and void_ch.enabled:
+                self.backpressure.record_arrival(void_ch.channel_id)
+                if void_ch.mode == db.MODE_MESSAGE and not self.is_exempt(message):
+                    self.get_deleter(void_ch.server_id).schedule(message.channel.id, message.id, void_ch.delete_after)
+                    tracer.follow(message.id, span)
 
-        if self.bot.user.id == message.author.id:
-            if len(message.embeds) > 0 and message.embeds[0].title is not None:
-                if message.embeds[0].title == '`void` purge' or message.embeds[0].title == "`void` proxy":
-                    return  # Don't void some of our messages. We can handle that.
 
-        # check if this is a void channel
-        void_ch = await db.get_void_channel(self.bot.db_pool, message.channel.id)
-        if void_ch is not None and void_ch.enabled:
+    @commands.Cog.listener()
+    async def on_raw_message_edit(self, payload: discord.RawMessageUpdateEvent):
+        """Keeps messages that get pinned in channels that exempt pinned messages. Pins arrive as message updates."""
+        pinned = payload.data.get('pinned')
+        matcher = self.exemptions.get(payload.channel_id)
+        void_ch = self.void_channels.get(payload.channel_id)
+        if pinned is None or matcher is None or not matcher.pinned or void_ch is None:
+            return
+
+        due = snowflake_timestamp(payload.message_id) + void_ch.delete_after
+        if pinned:
+            self.protect(payload.message_id, ttl=max(0.0, due - time.time()) + 60)  # Until well after its deletion would have come due.
+        elif payload.message_id in self.protected:
+            self.protected.discard(payload.message_id)
+            if due <= time.time():  # Its deletion was skipped while it was pinned, so schedule it again. It is overdue, so it goes right away.
+                self.get_deleter(void_ch.server_id).schedule(void_ch.channel_id, payload.message_id, void_ch.delete_after)
+
+
+    @commands.Cog.listener()
+    async def on_webhooks_update(self, channel: discord.abc.GuildChannel):
+        if isinstance(channel, discord.TextChannel):
+            await self.bot.webhook_cache.verify(channel)
 
-            # check if it's a webhook msg from void
-            if message.webhook_id is not None:
-                log.info(f"{message.webhook_id}")
-                if message.channel.id in self.bot.webhook_cache.keys() and self.bot.webhook_cache[message.channel.id].id == message.webhook_id:
-                    return  # It's a proxy msg from void. Don't delete.
 
-            await message.delete(delay=void_ch.delete_after)
+    @commands.Cog.listener()
+    async def on_guild_channel_delete(self, channel: discord.abc.GuildChannel):
+        await self.bot.webhook_cache.invalidate(channel.id)
+
+
+    @commands.Cog.listener()
+    async def on_ready(self):
+        await self._webhooks_loaded
+        await self.sweeper.sweep()
+
 
+    @commands.Cog.listener()
+    async def on_resumed(self):
+        await self._webhooks_loaded
+        await self.sweeper.sweep()
+
+
+    def is_exempt(self, message: discord.Message) -> bool:
+        """Checks if a message in a void channel should not be deleted: One of our protected or proxy messages, or one matching the channels exemption rules."""
+        if message.id in self.protected:
+            return True  # Don't void some of our messages. We can handle that.
+
+        # check if it's a webhook msg from void
+        if message.webhook_id is not None and message.webhook_id in self.bot.webhook_cache.webhook_ids:
+            return True  # It's a proxy msg from void. Don't delete.
+
+        matcher = self.exemptions.get(message.channel.id)
+        return matcher is not None and matcher.matches(message)
+
+
+    async def is_exempt_history(self, message: discord.Message) -> bool:
+        """is_exempt() for a message from the channel history, as swept by the CatchUpSweeper."""
+        if self.is_exempt(message):
+            return True
+        matcher = self.exemptions.get(message.channel.id)
+        # History messages have no member object, so unless the member is cached, message.author is a User without roles.
+        if matcher is not None and matcher.role_ids and message.webhook_id is None and not isinstance(message.author, discord.Member):
+            return await self.has_exempt_role(matcher, message.guild, message.author.id)
+        return False
+
+
+    async def is_exempt_payload(self, data: Dict[str, Any]) -> bool:
+        """is_exempt() for a raw message payload from the channel history, as swept by the PeriodicSweeper."""
+        if 'webhook_id' in data and int(data['webhook_id']) in self.bot.webhook_cache.webhook_ids:
+            return True
+
+        matcher = self.exemptions.get(int(data['channel_id']))
+        if matcher is None:
+            return False
+        if matcher.matches_payload(data):
+            return True
+        # History payloads have no member object, so the roles are looked up.
+        if matcher.role_ids and 'member' not in data and 'webhook_id' not in data:
+            channel = self.bot.get_channel(int(data['channel_id']))
+            return channel is None or await self.has_exempt_role(matcher, channel.guild, int(data['author']['id']))
+        return False
+
+
+    async def has_exempt_role(self, matcher: ExemptionMatcher, guild: discord.Guild, user_id: int) -> bool:
+        roles = await self.member_roles.get(guild, user_id)
+        if roles is None:
+            return True  # The roles could not be fetched. Keep the message rather than delete one that may be exempt.
+        return not matcher.role_ids.isdisjoint(roles)
+
+
+    def mode_stats(self, guild_id: Optional[int] = None) -> Dict[str, Tuple[int, int]]:
+        """
+        Gets the messages deleted and the API calls made for them (deletes, plus the history requests of sweeps) for each deletion mode,
+        for the void channels of a guild, or all of them. Channels count towards the mode they are in now.
+        """
+        stats = {mode: (0, 0) for mode in db.VOID_MODES}
+        for void_ch in self.void_channels.values():
+            if guild_id is not None and void_ch.server_id != guild_id:
+                continue
+            deleter = self.deleters.get(self.shard_id_for(void_ch.server_id))  # None for the shards of other workers.
+            queue = deleter.queues.get(void_ch.channel_id) if deleter is not None else None
+            deleted, api_calls = stats[void_ch.mode]
+            if queue is not None:
+                deleted += queue.deleted
+                api_calls += queue.rest_calls
+            api_calls += self.periodic_sweeper.history_calls[void_ch.channel_id]
+            stats[void_ch.mode] = (deleted, api_calls)
+        return stats
 
 def setup(bot):
     bot.add_cog(Void(bot))
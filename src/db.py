@@ -5,11 +5,11 @@ For use with thevoid
 
 import math
 import time
+import asyncio
 import json
 import logging
 import functools
-import statistics as stats
-from typing import List, Optional
+from typing import List, Optional, Tuple, Dict
 from collections import defaultdict
 from dataclasses import dataclass, field
 from datetime import datetime, timedelta
@@ -17,54 +17,62 @@ from datetime import datetime, timedelta
 import asyncpg
 from discord import Invite, Message
 
+from utils.histogram import LatencyStats
+from utils.tracing import tracer
+
 
 class DBPerformance:
+    """Per query latency histograms, in ms. Constant memory and O(1) per recorded query."""
+
+    WINDOWS = ('1m', '1h', 'lifetime')
 
     def __init__(self):
-        self.time = defaultdict(list)
+        self.time: Dict[str, LatencyStats] = defaultdict(LatencyStats)
 
-    def avg(self, key: str):
-        return stats.mean(self.time[key])
+    def record(self, key: str, duration_ms: float):
+        self.time[key].record(duration_ms)
 
-    def all_avg(self):
-        avgs = {}
-        for key, value in self.time.items():
-            avgs[key] = stats.mean(value)
-        return avgs
+    def avg(self, key: str) -> float:
+        return self.time[key].lifetime.mean
 
-    def stats(self):
+    def all_avg(self) -> Dict[str, float]:
+        return {key: value.lifetime.mean for key, value in self.time.items()}
+
+    def stats(self, window: str = 'lifetime') -> Dict[str, Dict[str, float]]:
+        """Gets calls, avg, p50, p90, p99, p999 and max for each query over one of the WINDOWS."""
         statistics = {}
         for key, value in self.time.items():
-            loop_stats = {}
-            try:
-                loop_stats['avg'] = stats.mean(value)
-            except stats.StatisticsError:
-                loop_stats['avg'] = -1
+            histogram = value.histogram(window)
+            if histogram.count > 0:
+                statistics[key] = histogram.summary()
+        return statistics
 
-            try:
-                loop_stats['med'] = stats.median(value)
-            except stats.StatisticsError:
-                loop_stats['med'] = -1
 
-            try:
-                loop_stats['max'] = max(value)
-            except stats.StatisticsError:
-                loop_stats['max'] = -1
+db_perf = DBPerformance()
 
-            try:
-                loop_stats['min'] = min(value)
-            except stats.StatisticsError:
-                loop_stats['min'] = -1
+# The hot queries. These are prepared on every connection when it is opened, and stay prepared in its statement cache.
+PREPARED_QUERIES = {
+    'get_void_channel': "SELECT server_id, channel_id, enabled, delete_after, mode, backlog_threshold FROM void_channels WHERE channel_id = $1",
+    'get_void_channels_for_guild': "SELECT server_id, channel_id, enabled, delete_after, mode, backlog_threshold FROM void_channels WHERE server_id = $1",
+}
 
-            loop_stats['calls'] = len(value)
+# config.json key -> asyncpg.create_pool argument
+POOL_OPTIONS = {
+    'db_pool_min_size': 'min_size',
+    'db_pool_max_size': 'max_size',
+    'db_max_inactive_connection_lifetime': 'max_inactive_connection_lifetime',
+    'db_statement_cache_size': 'statement_cache_size',
+    'db_command_timeout': 'command_timeout',
+}
 
-            statistics[key] = loop_stats
-        return statistics
 
+def pool_options(config: Dict) -> Dict:
+    """Gets the asyncpg pool options that are set in config.json."""
+    return {option: config[key] for key, option in POOL_OPTIONS.items() if config.get(key) is not None}
 
-db_perf = DBPerformance()
 
-async def create_db_pool(uri: str) -> asyncpg.pool.Pool:
+async def create_db_pool(uri: str, **options) -> asyncpg.pool.Pool:
+    """'options' are passed on to asyncpg.create_pool. See pool_options()."""
 
     # FIXME: Error Handling
     async def init_connection(conn):
@@ -72,8 +80,15 @@ async def create_db_pool(uri: str) -> asyncpg.pool.Pool:
                                   encoder=json.dumps,
                                   decoder=json.loads,
                                   schema='pg_catalog')
+        # PreparedStatement objects can't outlive a pool acquisition, so the hot queries are prepared by running them once.
+        # That leaves them in the connections statement cache, which later calls with the same query text reuse.
+        for query in PREPARED_QUERIES.values():
+            try:
+                await conn.fetch(query, None)
+            except (asyncpg.exceptions.UndefinedTableError, asyncpg.exceptions.UndefinedColumnError):
+                pass  # The tables are not created or migrated yet on first start. They are prepared on first use instead.
 
-    pool: asyncpg.pool.Pool = await asyncpg.create_pool(uri, init=init_connection)
+    pool: asyncpg.pool.Pool = await asyncpg.create_pool(uri, init=init_connection, **options)
 
     return pool
 
@@ -81,31 +96,38 @@ async def create_db_pool(uri: str) -> asyncpg.pool.Pool:
 def db_deco(func):
     @functools.wraps(func)
     async def wrapper(*args, **kwargs):
-        start_time = time.perf_counter()
-        try:
-            response = await func(*args, **kwargs)
-            end_time = time.perf_counter()
-            db_perf.time[func.__name__].append((end_time - start_time) * 1000)
-
-            if len(args) > 1:
-                logging.info("DB Query {} from {} in {:.3f} ms.".format(func.__name__, args[1], (end_time - start_time) * 1000))
-            else:
-                logging.info("DB Query {} in {:.3f} ms.".format(func.__name__, (end_time - start_time) * 1000))
-            return response
-        except asyncpg.exceptions.PostgresError:
-            logging.exception("Error attempting database query: {} for server: {}".format(func.__name__, args[1]))
+        with tracer.span(f"db.{func.__name__}") as span:
+            if len(args) > 1 and not isinstance(args[1], (list, tuple)):
+                span.tag('arg', args[1])
+            start_time = time.perf_counter()
+            try:
+                response = await func(*args, **kwargs)
+                end_time = time.perf_counter()
+                db_perf.record(func.__name__, (end_time - start_time) * 1000)
+                return response
+            except (asyncpg.exceptions.PostgresError, asyncpg.exceptions.InterfaceError, asyncio.TimeoutError) as e:
+                # A dropped connection or an exhausted pool fails the query like any other database error, instead of escaping into the caller.
+                span.tag('error', e)
+                logging.exception("Error attempting database query: {} for server: {}".format(func.__name__, args[1]))
     return wrapper
 
 
 
 
 
+MODE_MESSAGE = 'message'  # Every message gets a deletion timer of its own.
+MODE_SWEEP = 'sweep'  # The history is swept periodically and everything that is due is bulk deleted.
+VOID_MODES = (MODE_MESSAGE, MODE_SWEEP)
+
+
 @dataclass
 class VoidChannel:
     server_id: int
     channel_id: int
     enabled: bool
     delete_after: float
+    mode: str = MODE_MESSAGE
+    backlog_threshold: Optional[int] = None  # Predicted backlog at which slowmode is raised. None for the default, 0 to never raise it.
 
 
 @db_deco
@@ -116,17 +138,17 @@ async def is_void_ch_in_db(pool, sid: int, channel_id: int):
 
 
 @db_deco
-async def add_void_ch(pool, sid: int, channel_id: int, enabled: bool, delete_after: float):
+async def add_void_ch(pool, sid: int, channel_id: int, enabled: bool, delete_after: float) -> Optional[str]:
     async with pool.acquire() as conn:
-        await conn.execute(
+        return await conn.execute(
             "INSERT INTO void_channels(server_id, channel_id, enabled, delete_after) VALUES($1, $2, $3, $4)",
             sid, channel_id, enabled, delete_after)
 
 
 @db_deco
-async def remove_void_ch(pool, sid: int, channel_id: int):
+async def remove_void_ch(pool, sid: int, channel_id: int) -> Optional[str]:
     async with pool.acquire() as conn:
-        await conn.execute("DELETE FROM void_channels WHERE server_id = $1 AND channel_id = $2", sid, channel_id)
+        return await conn.execute("DELETE FROM void_channels WHERE server_id = $1 AND channel_id = $2", sid, channel_id)
 
 
 @db_deco
@@ -139,30 +161,257 @@ async def get_all_void_channel(pool) -> List[VoidChannel]:
 @db_deco
 async def get_void_channels_for_guild(pool, sid: int) -> List[VoidChannel]:
     async with pool.acquire() as conn:
-        raw_rows = await conn.fetch('SELECT * FROM void_channels WHERE server_id = $1', sid)
+        raw_rows = await conn.fetch(PREPARED_QUERIES['get_void_channels_for_guild'], sid)
         return [VoidChannel(**row) for row in raw_rows]
 
 
 @db_deco
 async def get_void_channel(pool, channel_id: int) -> Optional[VoidChannel]:
     async with pool.acquire() as conn:
-        row = await conn.fetchrow('SELECT * FROM void_channels WHERE channel_id = $1', channel_id)
+        row = await conn.fetchrow(PREPARED_QUERIES['get_void_channel'], channel_id)
         return VoidChannel(**row) if row else None
 
 
 
 @db_deco
-async def toggle_void_ch(pool, sid: int, channel_id: int, enabled: bool):
+async def toggle_void_ch(pool, sid: int, channel_id: int, enabled: bool) -> Optional[str]:
+    async with pool.acquire() as conn:
+        return await conn.execute("UPDATE void_channels SET enabled = $1 WHERE server_id = $2 AND channel_id = $3", enabled, sid, channel_id)
+
+
+@db_deco
+async def set_void_delete_time(pool, sid: int, channel_id: int, delete_after: float) -> Optional[str]:
+    async with pool.acquire() as conn:
+        return await conn.execute("UPDATE void_channels SET delete_after = $1 WHERE server_id = $2 AND channel_id = $3", delete_after, sid, channel_id)
+
+
+@db_deco
+async def set_void_mode(pool, sid: int, channel_id: int, mode: str) -> Optional[str]:
+    async with pool.acquire() as conn:
+        return await conn.execute("UPDATE void_channels SET mode = $1 WHERE server_id = $2 AND channel_id = $3", mode, sid, channel_id)
+
+
+@db_deco
+async def set_void_backlog_threshold(pool, sid: int, channel_id: int, backlog_threshold: Optional[int]) -> Optional[str]:
+    async with pool.acquire() as conn:
+        return await conn.execute("UPDATE void_channels SET backlog_threshold = $1 WHERE server_id = $2 AND channel_id = $3",
+                                  backlog_threshold, sid, channel_id)
+
+
+@dataclass
+class SlowmodeIntervention:
+    """A slowmode that was raised because of a deletion backlog, and the delay to restore once it has drained."""
+    server_id: int
+    channel_id: int
+    original_delay: int
+    raised_delay: int
+
+
+@db_deco
+async def get_slowmode_interventions(pool) -> List[SlowmodeIntervention]:
+    async with pool.acquire() as conn:
+        raw_rows = await conn.fetch('SELECT * FROM slowmode_interventions')
+        return [SlowmodeIntervention(**row) for row in raw_rows]
+
+
+@db_deco
+async def set_slowmode_intervention(pool, intervention: SlowmodeIntervention):
+    async with pool.acquire() as conn:
+        await conn.execute('''
+                           INSERT INTO slowmode_interventions(server_id, channel_id, original_delay, raised_delay) VALUES($1, $2, $3, $4)
+                           ON CONFLICT (channel_id) DO UPDATE SET raised_delay = EXCLUDED.raised_delay
+                           ''', intervention.server_id, intervention.channel_id, intervention.original_delay, intervention.raised_delay)
+
+
+@db_deco
+async def remove_slowmode_intervention(pool, channel_id: int):
+    async with pool.acquire() as conn:
+        await conn.execute("DELETE FROM slowmode_interventions WHERE channel_id = $1", channel_id)
+
+
+@dataclass
+class PendingDeletion:
+    message_id: int
+    channel_id: int
+    due_at: float  # Unix timestamp
+
+
+@db_deco
+async def add_pending_deletions(pool, deletions: List[Tuple[int, int, float]]) -> Optional[str]:
+    """Inserts a batch of (message_id, channel_id, due_at) rows in a single round trip."""
+    message_ids, channel_ids, due_ats = zip(*deletions)
+    async with pool.acquire() as conn:
+        return await conn.execute('''
+                                  INSERT INTO pending_deletions(message_id, channel_id, due_at)
+                                  SELECT * FROM unnest($1::BIGINT[], $2::BIGINT[], $3::FLOAT8[])
+                                  ON CONFLICT (message_id) DO NOTHING
+                                  ''', message_ids, channel_ids, due_ats)
+
+
+@db_deco
+async def remove_pending_deletions(pool, message_ids: List[int]) -> Optional[str]:
+    async with pool.acquire() as conn:
+        return await conn.execute("DELETE FROM pending_deletions WHERE message_id = ANY($1::BIGINT[])", message_ids)
+
+
+@db_deco
+async def get_pending_deletions(pool) -> List[PendingDeletion]:
+    async with pool.acquire() as conn:
+        raw_rows = await conn.fetch('SELECT * FROM pending_deletions ORDER BY due_at')
+        return [PendingDeletion(**row) for row in raw_rows]
+
+
+@db_deco
+async def set_high_water_marks(pool, marks: List[Tuple[int, int]]) -> Optional[str]:
+    """Upserts a batch of (channel_id, message_id) high water marks. Marks only ever move forward."""
+    channel_ids, message_ids = zip(*marks)
+    async with pool.acquire() as conn:
+        return await conn.execute('''
+                                  INSERT INTO void_high_water(channel_id, message_id)
+                                  SELECT * FROM unnest($1::BIGINT[], $2::BIGINT[])
+                                  ON CONFLICT (channel_id) DO UPDATE SET message_id = GREATEST(void_high_water.message_id, EXCLUDED.message_id)
+                                  ''', channel_ids, message_ids)
+
+
+@db_deco
+async def get_high_water_marks(pool) -> Dict[int, int]:
+    async with pool.acquire() as conn:
+        raw_rows = await conn.fetch('SELECT * FROM void_high_water')
+        return {row['channel_id']: row['message_id'] for row in raw_rows}
+
+
+@dataclass
+class ProxyWebhook:
+    channel_id: int
+    webhook_id: int
+    token: str
+
+
+@db_deco
+async def get_all_webhooks(pool) -> List[ProxyWebhook]:
+    async with pool.acquire() as conn:
+        raw_rows = await conn.fetch('SELECT channel_id, webhook_id, token FROM void_webhooks')
+        return [ProxyWebhook(**row) for row in raw_rows]
+
+
+@db_deco
+async def get_webhook(pool, channel_id: int) -> Optional[ProxyWebhook]:
+    async with pool.acquire() as conn:
+        row = await conn.fetchrow("SELECT channel_id, webhook_id, token FROM void_webhooks WHERE channel_id = $1", channel_id)
+        return ProxyWebhook(**row) if row else None
+
+
+@db_deco
+async def set_webhook(pool, channel_id: int, webhook_id: int, token: str):
+    async with pool.acquire() as conn:
+        await conn.execute('''
+                           INSERT INTO void_webhooks(channel_id, webhook_id, token) VALUES($1, $2, $3)
+                           ON CONFLICT (channel_id) DO UPDATE SET webhook_id = EXCLUDED.webhook_id, token = EXCLUDED.token
+                           ''', channel_id, webhook_id, token)
+
+
+@db_deco
+async def remove_webhook(pool, channel_id: int):
+    async with pool.acquire() as conn:
+        await conn.execute("DELETE FROM void_webhooks WHERE channel_id = $1", channel_id)
+
+
+@dataclass
+class ExemptionRules:
+    server_id: int
+    channel_id: int
+    role_ids: List[int] = field(default_factory=list)
+    user_ids: List[int] = field(default_factory=list)
+    bots: bool = False
+    webhooks: bool = False
+    pinned: bool = False
+    content_regex: Optional[str] = None
+
+
+@db_deco
+async def get_all_exemption_rules(pool) -> List[ExemptionRules]:
+    async with pool.acquire() as conn:
+        raw_rows = await conn.fetch('SELECT * FROM void_exemptions')
+        return [ExemptionRules(**row) for row in raw_rows]
+
+
+@db_deco
+async def set_exemption_rules(pool, rules: ExemptionRules) -> Optional[str]:
+    async with pool.acquire() as conn:
+        return await conn.execute('''
+                                  INSERT INTO void_exemptions(server_id, channel_id, role_ids, user_ids, bots, webhooks, pinned, content_regex)
+                                  VALUES($1, $2, $3, $4, $5, $6, $7, $8)
+                                  ON CONFLICT (channel_id) DO UPDATE SET role_ids = EXCLUDED.role_ids, user_ids = EXCLUDED.user_ids,
+                                      bots = EXCLUDED.bots, webhooks = EXCLUDED.webhooks, pinned = EXCLUDED.pinned, content_regex = EXCLUDED.content_regex
+                                  ''', rules.server_id, rules.channel_id, rules.role_ids, rules.user_ids, rules.bots, rules.webhooks,
+                                  rules.pinned, rules.content_regex)
+
+
+@db_deco
+async def remove_exemption_rules(pool, channel_id: int) -> Optional[str]:
+    async with pool.acquire() as conn:
+        return await conn.execute("DELETE FROM void_exemptions WHERE channel_id = $1", channel_id)
+
+
+@dataclass
+class PurgeJob:
+    server_id: int
+    channel_id: int
+    requested_by: int
+    status_message_id: Optional[int]
+    remaining: int  # How many more messages to delete.
+    before: int  # The checkpoint. Everything newer than this message ID has been dealt with.
+    after: Optional[int] = None
+    author_ids: List[int] = field(default_factory=list)
+    attachments_only: bool = False
+    content_regex: Optional[str] = None
+    scanned: int = 0
+    deleted: int = 0
+    started_at: float = 0.0  # Unix timestamp
+
+
+@db_deco
+async def add_purge_job(pool, job: PurgeJob):
+    """Stores a new purge, replacing any earlier one in the channel."""
     async with pool.acquire() as conn:
-        await conn.execute("UPDATE void_channels SET enabled = $1 WHERE server_id = $2 AND channel_id = $3", enabled, sid, channel_id)
+        await conn.execute('''
+                           INSERT INTO purge_jobs(server_id, channel_id, requested_by, status_message_id, remaining, before, after,
+                                                  author_ids, attachments_only, content_regex, scanned, deleted, started_at)
+                           VALUES($1, $2, $3, $4, $5, $6, $7, $8, $9, $10, $11, $12, $13)
+                           ON CONFLICT (channel_id) DO UPDATE SET server_id = EXCLUDED.server_id, requested_by = EXCLUDED.requested_by,
+                               status_message_id = EXCLUDED.status_message_id, remaining = EXCLUDED.remaining, before = EXCLUDED.before,
+                               after = EXCLUDED.after, author_ids = EXCLUDED.author_ids, attachments_only = EXCLUDED.attachments_only,
+                               content_regex = EXCLUDED.content_regex, scanned = EXCLUDED.scanned, deleted = EXCLUDED.deleted,
+                               started_at = EXCLUDED.started_at
+                           ''', job.server_id, job.channel_id, job.requested_by, job.status_message_id, job.remaining, job.before, job.after,
+                           job.author_ids, job.attachments_only, job.content_regex, job.scanned, job.deleted, job.started_at)
 
 
 @db_deco
-async def set_void_delete_time(pool, sid: int, channel_id: int, delete_after: float):
+async def checkpoint_purge_job(pool, job: PurgeJob):
+    """
+    Saves the progress of a purge. Only updates the row of this very purge (by started_at), so a checkpoint that is still
+    in flight when the purge is cancelled can't bring it back, or overwrite a newer purge in the channel.
+    """
     async with pool.acquire() as conn:
-        await conn.execute("UPDATE void_channels SET delete_after = $1 WHERE server_id = $2 AND channel_id = $3", delete_after, sid, channel_id)
+        await conn.execute('''
+                           UPDATE purge_jobs SET status_message_id = $3, remaining = $4, before = $5, scanned = $6, deleted = $7
+                           WHERE channel_id = $1 AND started_at = $2
+                           ''', job.channel_id, job.started_at, job.status_message_id, job.remaining, job.before, job.scanned, job.deleted)
 
 
+@db_deco
+async def get_purge_jobs(pool) -> List[PurgeJob]:
+    async with pool.acquire() as conn:
+        raw_rows = await conn.fetch('SELECT * FROM purge_jobs')
+        return [PurgeJob(**row) for row in raw_rows]
+
+
+@db_deco
+async def remove_purge_job(pool, channel_id: int):
+    async with pool.acquire() as conn:
+        await conn.execute("DELETE FROM purge_jobs WHERE channel_id = $1", channel_id)
+
 
 async def create_tables(pool):
     # Create servers table
@@ -177,4 +426,124 @@ async def create_tables(pool):
                            )
                        ''')
 
+        # Create pending deletions table
+        await conn.execute('''
+                           CREATE TABLE if not exists pending_deletions(
+                               message_id      BIGINT PRIMARY KEY,
+                               channel_id      BIGINT NOT NULL,
+                               due_at          FLOAT8 NOT NULL
+                           )
+                       ''')
+
+        # Create high water mark table. Holds the newest message that has been scheduled for deletion in each void channel.
+        await conn.execute('''
+                           CREATE TABLE if not exists void_high_water(
+                               channel_id      BIGINT PRIMARY KEY,
+                               message_id      BIGINT NOT NULL
+                           )
+                       ''')
+
 
+
+
+@dataclass
+class Migration:
+    version: int
+    description: str
+    statements: List[str]
+
+
+# Applied in order by migrate_to_latest(). Never edit a migration that has shipped, add a new one instead.
+MIGRATIONS: List[Migration] = [
+    Migration(1, "Index void_channels by channel_id for get_void_channel", [
+        # The primary key leads with server_id, so it can't serve lookups by channel_id alone.
+        "CREATE INDEX IF NOT EXISTS void_channels_channel_id_idx ON void_channels (channel_id)",
+    ]),
+    Migration(2, "Add void_webhooks to persist the proxy webhooks", [
+        '''
+        CREATE TABLE IF NOT EXISTS void_webhooks(
+            channel_id      BIGINT PRIMARY KEY,
+            webhook_id      BIGINT NOT NULL,
+            token           TEXT NOT NULL
+        )
+        ''',
+    ]),
+    Migration(3, "Add void_exemptions for the per channel exemption rules", [
+        '''
+        CREATE TABLE IF NOT EXISTS void_exemptions(
+            server_id       BIGINT NOT NULL,
+            channel_id      BIGINT PRIMARY KEY,
+            role_ids        BIGINT[] NOT NULL DEFAULT '{}',
+            user_ids        BIGINT[] NOT NULL DEFAULT '{}',
+            bots            BOOLEAN NOT NULL DEFAULT FALSE,
+            webhooks        BOOLEAN NOT NULL DEFAULT FALSE,
+            pinned          BOOLEAN NOT NULL DEFAULT FALSE,
+            content_regex   TEXT
+        )
+        ''',
+    ]),
+    Migration(4, "Add purge_jobs to checkpoint purges so they resume after a restart", [
+        '''
+        CREATE TABLE IF NOT EXISTS purge_jobs(
+            server_id           BIGINT NOT NULL,
+            channel_id          BIGINT PRIMARY KEY,
+            requested_by        BIGINT NOT NULL,
+            status_message_id   BIGINT,
+            remaining           INT NOT NULL,
+            before              BIGINT NOT NULL,
+            after               BIGINT,
+            author_ids          BIGINT[] NOT NULL DEFAULT '{}',
+            attachments_only    BOOLEAN NOT NULL DEFAULT FALSE,
+            content_regex       TEXT,
+            scanned             INT NOT NULL DEFAULT 0,
+            deleted             INT NOT NULL DEFAULT 0,
+            started_at          FLOAT8 NOT NULL
+        )
+        ''',
+    ]),
+    Migration(5, "Add the deletion mode of the void channels", [
+        "ALTER TABLE void_channels ADD COLUMN IF NOT EXISTS mode TEXT NOT NULL DEFAULT 'message'",
+    ]),
+    Migration(6, "Add the per channel backlog thresholds and the slowmode interventions", [
+        "ALTER TABLE void_channels ADD COLUMN IF NOT EXISTS backlog_threshold INT",
+        '''
+        CREATE TABLE IF NOT EXISTS slowmode_interventions(
+            server_id       BIGINT NOT NULL,
+            channel_id      BIGINT PRIMARY KEY,
+            original_delay  INT NOT NULL,
+            raised_delay    INT NOT NULL
+        )
+        ''',
+    ]),
+]
+
+MIGRATION_LOCK_ID = 0x766F6964  # Advisory lock held while migrating, in case several processes start at once.
+
+
+async def migrate_to_latest(pool):
+    """Applies any MIGRATIONS newer than the version recorded in schema_version. Each migration runs in its own transaction."""
+    async with pool.acquire() as conn:
+        await conn.execute('''
+                           CREATE TABLE if not exists schema_version(
+                               version         INT PRIMARY KEY,
+                               description     TEXT NOT NULL,
+                               applied_at      TIMESTAMPTZ NOT NULL DEFAULT now()
+                           )
+                       ''')
+
+        await conn.execute("SELECT pg_advisory_lock($1)", MIGRATION_LOCK_ID)
+        try:
+            current = await conn.fetchval("SELECT COALESCE(MAX(version), 0) FROM schema_version")
+            for migration in MIGRATIONS:
+                if migration.version <= current:
+                    continue
+                start_time = time.perf_counter()
+                async with conn.transaction():
+                    for statement in migration.statements:
+                        await conn.execute(statement)
+                    await conn.execute("INSERT INTO schema_version(version, description) VALUES($1, $2)",
+                                       migration.version, migration.description)
+                logging.info("Applied DB migration {}: {} in {:.3f} ms.".format(migration.version, migration.description,
+                                                                                (time.perf_counter() - start_time) * 1000))
+        finally:
+            await conn.execute("SELECT pg_advisory_unlock($1)", MIGRATION_LOCK_ID)
@@ -3,6 +3,7 @@ entry point for `the void`
 
 """
 
+import os
 import json
 import logging
 import asyncio
@@ -16,23 +17,32 @@ from discord.ext import commands
 import db
 
 from bot import VBot
+from cluster import ClusterSupervisor, ClusterClient, DEFAULT_IPC_PATH
+from utils.metrics import MetricsServer
+from utils.tracing import tracer
+from utils.recorder import GatewayRecorder
+from utils.watchdog import StallWatchdog
 
 
 logging.basicConfig(level=logging.INFO, format="[%(asctime)s] [%(name)s] [%(levelname)s] %(message)s")
 
 log = logging.getLogger(__name__)
 
+with open('config.json') as json_data_file:
+    config = json.load(json_data_file)
+
 bot = VBot(command_prefix=["v;", "V;"],
            description="A bot that consumes all messages.",
            owner_id=389590659335716867,
-           case_insensitive=True)
+           case_insensitive=True,
+           **(VBot.lean_options() if config.get('lean', False) else {}))
 
 
 @bot.event
 async def on_ready():
     log.info('Connected using discord.py version {}!'.format(discord.__version__))
     log.info('Username: {0.name}, ID: {0.id}'.format(bot.user))
-    log.info("Connected to {} servers.".format(len(bot.guilds)))
+    log.info("Connected to {} servers on {} shards.".format(len(bot.guilds), len(bot.shards)))
     log.info('------')
 
     log.warning("thevoid is fully loaded.")
@@ -62,6 +72,8 @@ async def on_command_error(ctx, error):
         await ctx.send("⚠ {}".format(error))
     elif isinstance(error, commands.CommandOnCooldown):
         await ctx.send("⚠ {}".format(error))
+    elif isinstance(error, (commands.MaxConcurrencyReached, commands.NotOwner)):
+        await ctx.send("⚠ {}".format(error))
     else:
         await ctx.send("⚠ {}".format(error))
         raise error
@@ -71,9 +83,9 @@ async def on_command_error(ctx, error):
 async def on_error(event_name, *args):
     log.exception("Exception from event {}".format(event_name))
 
-    if 'error_log_channel' not in config:
+    if 'error_log_channel' not in bot.config:
         return
-    error_log_channel = bot.get_channel(config['error_log_channel'])
+    error_log_channel = bot.get_channel(bot.config['error_log_channel'])
 
     embed = None
     # Determine if we can get more info, otherwise post without embed
@@ -93,19 +105,64 @@ async def on_error(event_name, *args):
 
 
 
-if __name__ == '__main__':
-
-    with open('config.json') as json_data_file:
-        config = json.load(json_data_file)
+def run_bot(config: Dict, shard_count: Optional[int], shard_ids: Optional[List[int]], create_tables: bool = True):
     log.info(f"Connecting to DB @: {config['db_uri']}")
-    db_pool: asyncpg.pool.Pool = asyncio.get_event_loop().run_until_complete(db.create_db_pool(config['db_uri']))
-    asyncio.get_event_loop().run_until_complete(db.create_tables(db_pool))
+    db_pool: asyncpg.pool.Pool = asyncio.get_event_loop().run_until_complete(db.create_db_pool(config['db_uri'], **db.pool_options(config)))
+    if create_tables:
+        asyncio.get_event_loop().run_until_complete(db.create_tables(db_pool))
+        asyncio.get_event_loop().run_until_complete(db.migrate_to_latest(db_pool))
 
     bot.config = config
     bot.db_pool = db_pool
+    if config.get('api_base') is not None:
+        VBot.set_api_base(config['api_base'])
+    bot.set_shards(shard_count, shard_ids)
+
+    if config.get('metrics_port') is not None:
+        bot.metrics_server = MetricsServer(bot, config.get('metrics_host', "127.0.0.1"), config['metrics_port'])
+        asyncio.get_event_loop().run_until_complete(bot.metrics_server.start())
+
+    if config.get('trace_sample_ratio', 0) > 0:
+        tracer.configure(asyncio.get_event_loop(), config['trace_sample_ratio'], config.get('trace_file', "traces.jsonl"),
+                         config.get('trace_max_bytes', 10 * 1024 * 1024), config.get('trace_backups', 3))
+
+    if config.get('webhook_cache_size') is not None:
+        bot.webhook_cache.max_size = config['webhook_cache_size']
+
+    if config.get('stall_threshold') is not None:
+        bot.watchdog = StallWatchdog(bot, bot.lag_monitor, config['stall_threshold'], config.get('stall_report_interval', 300))
+
+    if config.get('record_file') is not None:
+        bot.recorder = GatewayRecorder(config['record_file'], config.get('record_max_bytes', 100 * 1024 * 1024), config.get('record_salt'))
 
     bot.load_cogs()
     bot.run(config['token'])
+    if bot.recorder is not None:
+        bot.recorder.close()
+
+
+def run_worker(config: Dict, shard_count: int, shard_ids: List[int], worker_id: int, ipc_path: str):
+    """Entry point for the worker processes in cluster mode. The supervisor has already set up the DB."""
+    for handler in logging.getLogger().handlers:
+        handler.setFormatter(logging.Formatter(f"[%(asctime)s] [worker {worker_id}] [%(name)s] [%(levelname)s] %(message)s"))
+    bot.cluster = ClusterClient(bot, worker_id, ipc_path)
+    if config.get('metrics_port') is not None:
+        config = {**config, 'metrics_port': config['metrics_port'] + worker_id}  # One endpoint per worker.
+    if config.get('trace_sample_ratio', 0) > 0:
+        root, extension = os.path.splitext(config.get('trace_file', "traces.jsonl"))
+        config = {**config, 'trace_file': f"{root}.{worker_id}{extension}"}  # Rotating file handlers can't be shared between processes.
+    if config.get('record_file') is not None:
+        root, extension = os.path.splitext(config['record_file'])
+        config = {**config, 'record_file': f"{root}.{worker_id}{extension}"}
+    run_bot(config, shard_count, shard_ids, create_tables=False)
 
-    log.info("cleaning Up and shutting down")
 
+if __name__ == '__main__':
+
+    if config.get('cluster_workers', 1) > 1:
+        supervisor = ClusterSupervisor(config, run_worker, config['cluster_workers'], config.get('cluster_ipc_path', DEFAULT_IPC_PATH))
+        supervisor.run()
+    else:
+        run_bot(config, config.get('shard_count'), config.get('shard_ids'))
+
+    log.info("cleaning Up and shutting down")
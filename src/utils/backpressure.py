@@ -0,0 +1,233 @@
+"""
+Slowmode backpressure for void channels that get flooded faster than their messages can be deleted.
+The arrival rate of each void channel is tracked from the gateway and compared with the deletion throughput that its
+ChannelDeletionQueue achieves. While a channel is backlogged, its backlog 'horizon' seconds from now is predicted as the current
+backlog plus the excess of arrivals over deletions for that long. When the prediction passes the threshold of the channel, its
+slowmode is raised. It is doubled, up to 'max_delay', for as long as the prediction keeps passing the threshold while arrivals
+still outpace deletions. Once the backlog has drained, the original slowmode is restored, unless someone else changed it in the meantime.
+
+Interventions are kept in the slowmode_interventions table, so that a slowmode raised before a restart is still restored after it.
+Each one is reported to the error log channel.
+
+Part of the void.
+"""
+
+import time
+import asyncio
+import logging
+from typing import TYPE_CHECKING, Optional, Dict, Callable, NamedTuple
+
+import discord
+
+import db
+from utils.misc import log_error_msg
+from utils.deletionEngine import DeletionEngine, BULK_DELETE_LIMIT
+from utils.rateLimits import DecayingRate
+
+if TYPE_CHECKING:
+    from bot import VBot
+
+log = logging.getLogger(__name__)
+
+MAX_SLOWMODE = 21600  # The longest slowmode Discord allows, in seconds.
+FORBIDDEN_RETRY = 600  # How long to leave a channel alone after we were not allowed to change its slowmode.
+
+
+class BacklogForecast(NamedTuple):
+    backlog: int
+    predicted: float
+    arrival_rate: float
+    deletion_rate: float
+
+
+class ChannelPressure:
+    """The arrival rate of a void channel, and the slowmode intervention running in it."""
+
+    __slots__ = ('arrivals', 'intervention', 'changed_at', 'retry_at')
+
+    def __init__(self):
+        self.arrivals = DecayingRate(tau=10)
+        self.intervention: Optional[db.SlowmodeIntervention] = None
+        self.changed_at = 0.0  # time.monotonic() of our last slowmode change
+        self.retry_at = 0.0  # time.monotonic() before which no slowmode change is attempted, after one failed
+
+
+class SlowmodeGovernor:
+
+    def __init__(self, bot: 'VBot', get_void_channel: Callable[[int], Optional[db.VoidChannel]], get_deleter: Callable[[int], DeletionEngine],
+                 threshold: int = 1000, horizon: float = 30, delay: int = 10, max_delay: int = 120, hold: float = 30,
+                 check_interval: float = 5):
+        """
+        'get_void_channel' looks up a cached void channel. 'get_deleter' returns the DeletionEngine responsible for a guild ID.
+        'threshold' is the predicted backlog at which slowmode is raised, in channels that do not set their own.
+        'delay' is the slowmode that is set first, and 'max_delay' the most that it is raised to.
+        'hold' is the minimum time between two changes to the slowmode of a channel.
+        """
+        self.bot = bot
+        self.get_void_channel = get_void_channel
+        self.get_deleter = get_deleter
+        self.threshold = threshold
+        self.horizon = horizon
+        self.delay = delay
+        self.max_delay = min(max_delay, MAX_SLOWMODE)
+        self.hold = hold
+        self.check_interval = check_interval
+        self.pressure: Dict[int, ChannelPressure] = {}  # channel_id -> pressure, for the void channels that recently got messages
+        self.interventions = 0
+        self.task: Optional[asyncio.Task] = None
+
+
+    def record_arrival(self, channel_id: int):
+        pressure = self.pressure.get(channel_id)
+        if pressure is None:
+            pressure = self.pressure[channel_id] = ChannelPressure()
+        pressure.arrivals.record()
+
+
+    def threshold_for(self, void_ch: db.VoidChannel) -> int:
+        return void_ch.backlog_threshold if void_ch.backlog_threshold is not None else self.threshold
+
+
+    def forecast(self, void_ch: db.VoidChannel) -> BacklogForecast:
+        pressure = self.pressure.get(void_ch.channel_id)
+        arrival_rate = pressure.arrivals.rate if pressure is not None else 0.0
+        queue = self.get_deleter(void_ch.server_id).queues.get(void_ch.channel_id)
+        if queue is None:
+            return BacklogForecast(0, 0.0, arrival_rate, 0.0)
+        deletion_rate = queue.deletion_rate.rate
+        # The deletion rate only shows what the rate limits allow while there is a backlog. Without one, we are keeping up.
+        predicted = queue.backlog + max(0.0, arrival_rate - deletion_rate) * self.horizon if queue.backlog > 0 else 0.0
+        return BacklogForecast(queue.backlog, predicted, arrival_rate, deletion_rate)
+
+
+    def start(self):
+        if self.task is None:
+            self.task = self.bot.loop.create_task(self._run())
+
+
+    def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+
+    async def _run(self):
+        await self.bot.wait_until_ready()
+        await self.load()
+        while True:
+            await asyncio.sleep(self.check_interval)
+            try:
+                await self.check()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log.exception(f"Error checking the void channel backlogs: {e}")
+
+
+    async def load(self):
+        """Picks up the interventions that were still running when the bot last shut down."""
+        for intervention in await db.get_slowmode_interventions(self.bot.db_pool) or []:
+            if self.bot.get_channel(intervention.channel_id) is None:
+                if self.bot.get_guild(intervention.server_id) is not None:
+                    await db.remove_slowmode_intervention(self.bot.db_pool, intervention.channel_id)  # The channel is gone.
+                continue  # Otherwise the guild is on another worker, which restores it.
+            self.pressure.setdefault(intervention.channel_id, ChannelPressure()).intervention = intervention
+
+
+    async def check(self):
+        now = time.monotonic()
+        for channel_id, pressure in list(self.pressure.items()):
+            if now < pressure.retry_at:
+                continue
+            void_ch = self.get_void_channel(channel_id)
+            threshold = self.threshold_for(void_ch) if void_ch is not None and void_ch.enabled else 0
+            forecast = self.forecast(void_ch) if threshold > 0 else BacklogForecast(0, 0.0, 0.0, 0.0)
+
+            if threshold > 0 and forecast.predicted > threshold:
+                if pressure.intervention is None:
+                    await self._raise(channel_id, pressure, forecast, threshold)
+                elif now - pressure.changed_at >= self.hold and forecast.arrival_rate > forecast.deletion_rate:
+                    await self._raise(channel_id, pressure, forecast, threshold)  # Still growing. Slow it down more.
+            elif pressure.intervention is not None:
+                if forecast.backlog < BULK_DELETE_LIMIT and now - pressure.changed_at >= self.hold:
+                    await self._restore(channel_id, pressure, forecast)
+            elif pressure.arrivals.rate < 0.01:
+                del self.pressure[channel_id]  # Quiet again. Don't keep state for every void channel that ever got a message.
+
+
+    async def _raise(self, channel_id: int, pressure: ChannelPressure, forecast: BacklogForecast, threshold: int):
+        channel: Optional[discord.TextChannel] = self.bot.get_channel(channel_id)
+        if channel is None:
+            await self._forget(channel_id, pressure)
+            return
+
+        intervention = pressure.intervention
+        if intervention is not None and channel.slowmode_delay != intervention.raised_delay:
+            self._report(f"The slowmode of <#{channel_id}> was changed to {channel.slowmode_delay}s by someone else. "
+                         f"`void` will no longer change it back.")
+            await self._forget(channel_id, pressure)
+            return
+
+        current = channel.slowmode_delay
+        new_delay = min(self.max_delay, max(self.delay, current * 2))
+        if new_delay <= current:
+            pressure.retry_at = time.monotonic() + self.hold  # It is as slow as we are willing to go.
+            return
+
+        try:
+            await channel.edit(slowmode_delay=new_delay, reason=f"Void channel deletion backlog of {forecast.backlog} messages")
+        except discord.Forbidden:
+            pressure.retry_at = time.monotonic() + FORBIDDEN_RETRY
+            self._report(f"Could not raise the slowmode of <#{channel_id}> against a backlog of {forecast.backlog} messages. "
+                         f"`void` needs the **Manage Channel** permission for that.")
+            return
+        except discord.HTTPException as e:
+            pressure.retry_at = time.monotonic() + self.hold
+            log.warning(f"Could not raise the slowmode of channel {channel_id}: {e}")
+            return
+
+        original = intervention.original_delay if intervention is not None else current
+        pressure.intervention = db.SlowmodeIntervention(server_id=channel.guild.id, channel_id=channel_id, original_delay=original,
+                                                        raised_delay=new_delay)
+        pressure.changed_at = time.monotonic()
+        self.interventions += 1
+        await db.set_slowmode_intervention(self.bot.db_pool, pressure.intervention)
+        self._report(f"Raised the slowmode of <#{channel_id}> in {channel.guild.name} from {current}s to {new_delay}s. "
+                     f"Backlog: {forecast.backlog} messages, predicted {forecast.predicted:.0f} in {self.horizon:g}s (threshold {threshold}). "
+                     f"Arriving at {forecast.arrival_rate:.1f} msgs/sec, deleted at {forecast.deletion_rate:.1f} msgs/sec.")
+
+
+    async def _restore(self, channel_id: int, pressure: ChannelPressure, forecast: BacklogForecast):
+        channel: Optional[discord.TextChannel] = self.bot.get_channel(channel_id)
+        intervention = pressure.intervention
+        if channel is None:
+            await self._forget(channel_id, pressure)
+            return
+        if channel.slowmode_delay != intervention.raised_delay:
+            self._report(f"The backlog of <#{channel_id}> has drained, but its slowmode was changed to {channel.slowmode_delay}s "
+                         f"by someone else in the meantime, so it was left alone.")
+            await self._forget(channel_id, pressure)
+            return
+
+        try:
+            await channel.edit(slowmode_delay=intervention.original_delay, reason="Void channel deletion backlog drained")
+        except discord.HTTPException as e:
+            pressure.retry_at = time.monotonic() + (FORBIDDEN_RETRY if isinstance(e, discord.Forbidden) else self.hold)
+            log.warning(f"Could not restore the slowmode of channel {channel_id}: {e}")
+            return
+
+        self.interventions += 1
+        await self._forget(channel_id, pressure)
+        self._report(f"Restored the slowmode of <#{channel_id}> in {channel.guild.name} to {intervention.original_delay}s. "
+                     f"Backlog: {forecast.backlog} messages, arriving at {forecast.arrival_rate:.1f} msgs/sec.")
+
+
+    async def _forget(self, channel_id: int, pressure: ChannelPressure):
+        pressure.intervention = None
+        pressure.changed_at = time.monotonic()
+        await db.remove_slowmode_intervention(self.bot.db_pool, channel_id)
+
+
+    def _report(self, msg: str):
+        log.warning(msg)
+        self.bot.loop.create_task(log_error_msg(self.bot, msg, header="**Void channel backpressure**"))
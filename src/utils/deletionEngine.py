@@ -0,0 +1,255 @@
+"""
+Batched message deletion engine for the void channels.
+Messages that come due for deletion within a short coalescing window are deleted together using the bulk delete endpoint.
+Messages that are too old to be bulk deleted, or that are alone in their batch, fall back to single deletes.
+Pending deletions are held by a single DeletionScheduler and come due relative to the message snowflake timestamp.
+When a PendingDeletionStore is given, pending deletions are also persisted so they can be restored after a restart.
+Messages that were protected after they were scheduled (see Void.protect) are dropped when they come due.
+Requests go through a rate limit aware RestClient. Under backlog, the oldest overdue messages are deleted first.
+
+Part of the void.
+"""
+
+import time
+import asyncio
+import logging
+from typing import TYPE_CHECKING, Optional, Dict, List, Set, Tuple
+
+import discord
+
+from utils.scheduler import DeletionScheduler
+from utils.pendingStore import PendingDeletionStore
+from utils.exemptions import TTLSet
+from utils.rateLimits import RestClient, DecayingRate, TransportError
+from utils.metrics import metrics
+from utils.tracing import tracer
+
+if TYPE_CHECKING:
+    from bot import VBot
+
+log = logging.getLogger(__name__)
+
+BULK_DELETE_LIMIT = 100  # Max number of messages the bulk delete endpoint accepts in one call.
+BULK_DELETE_MAX_AGE = 14 * 24 * 60 * 60 - 60  # Discord refuses to bulk delete messages older than 14 days. Keep a minute of slack.
+DISCORD_EPOCH = 1420070400000
+
+
+def snowflake_timestamp(snowflake: int) -> float:
+    """Returns the unix timestamp (in seconds) encoded in a discord snowflake."""
+    return ((snowflake >> 22) + DISCORD_EPOCH) / 1000
+
+
+def timestamp_snowflake(timestamp: float) -> int:
+    """Returns the lowest snowflake with the unix timestamp (in seconds), for paging through the history by time."""
+    return (int(timestamp * 1000) - DISCORD_EPOCH) << 22
+
+
+class ChannelDeletionQueue:
+    """The messages in a single channel that are due for deletion, along with the deletion stats for that channel."""
+
+    __slots__ = ('channel_id', 'pending', 'queued', 'in_flight', 'worker', 'deleted', 'rest_calls', 'deletion_rate')
+
+    def __init__(self, channel_id: int):
+        self.channel_id = channel_id
+        self.pending: List[Tuple[float, int]] = []  # (due, message_id)
+        self.queued: Set[int] = set()  # The message IDs that are pending or in flight, so that no batch lists a message twice.
+        self.in_flight = 0
+        self.worker: Optional[asyncio.Task] = None
+        self.deleted = 0
+        self.rest_calls = 0
+        self.deletion_rate = DecayingRate()
+
+    @property
+    def backlog(self) -> int:
+        """The number of messages that are due but not deleted yet."""
+        return len(self.pending) + self.in_flight
+
+    @property
+    def oldest_due(self) -> Optional[float]:
+        return min(self.pending)[0] if self.pending else None
+
+
+class DeletionEngine:
+
+    def __init__(self, bot: 'VBot', coalesce_window: float = 0.5, store: Optional[PendingDeletionStore] = None,
+                 rest: Optional[RestClient] = None, shard_id: Optional[int] = None, protected: Optional[TTLSet] = None):
+        """
+        The store, rest client and protected message IDs are owned by the caller and may be shared between the engines of several shards.
+        """
+        self.bot = bot
+        self.shard_id = shard_id
+        self.coalesce_window = coalesce_window
+        self.store = store
+        self.rest = rest if rest is not None else RestClient(bot)
+        self.protected = protected
+        self.queues: Dict[int, ChannelDeletionQueue] = {}
+        self.scheduler = DeletionScheduler(bot.loop, self.enqueue)
+
+
+    def schedule(self, channel_id: int, message_id: int, delete_after: float):
+        """
+        Queues a message to be deleted 'delete_after' seconds after it was sent.
+        The send time comes from the message snowflake so that gateway lag does not extend the life of the message.
+        """
+        due = snowflake_timestamp(message_id) + delete_after
+        self.scheduler.schedule(channel_id, message_id, due)
+        metrics.messages_voided += 1
+        if self.store is not None:
+            self.store.add(channel_id, message_id, due)
+
+
+    def enqueue(self, channel_id: int, message_id: int, due: Optional[float] = None):
+        """
+        Queues a message that is now due for deletion.
+        A message that is already queued is ignored. Catch-up sweeps and hand overs can find messages that on_message also scheduled.
+        """
+        if self.protected is not None and message_id in self.protected:
+            if self.store is not None:
+                self.store.confirm((message_id,))
+            return
+
+        queue = self.queues.get(channel_id)
+        if queue is None:
+            queue = self.queues[channel_id] = ChannelDeletionQueue(channel_id)
+        elif message_id in queue.queued:
+            return
+
+        queue.queued.add(message_id)
+        queue.pending.append((due if due is not None else time.time(), message_id))
+        if queue.worker is None:
+            queue.worker = self.bot.loop.create_task(self._drain(queue))
+
+
+    def stop(self):
+        """Stops the scheduler and cancels all of the running channel workers."""
+        self.scheduler.stop()
+        for queue in self.queues.values():
+            if queue.worker is not None:
+                queue.worker.cancel()
+
+
+    @property
+    def scheduled(self) -> int:
+        """The number of deletions that are not yet due."""
+        return len(self.scheduler)
+
+
+    @property
+    def deleted(self) -> int:
+        return sum(queue.deleted for queue in self.queues.values())
+
+
+    @property
+    def rest_calls(self) -> int:
+        return sum(queue.rest_calls for queue in self.queues.values())
+
+
+    @property
+    def backlog(self) -> int:
+        return sum(queue.backlog for queue in self.queues.values())
+
+
+    async def _drain(self, queue: ChannelDeletionQueue):
+        """Deletes everything in the channels queue, one batch at a time, then exits."""
+        try:
+            while queue.pending:
+                if len(queue.pending) < BULK_DELETE_LIMIT:
+                    # Give any messages that come due shortly after this one a chance to join the batch.
+                    await asyncio.sleep(self.coalesce_window)
+                else:
+                    # Backlogged. Restored and swept messages can arrive out of order, so make sure the oldest overdue go first.
+                    queue.pending.sort()
+
+                batch = queue.pending[:BULK_DELETE_LIMIT]
+                del queue.pending[:BULK_DELETE_LIMIT]
+                queue.in_flight = len(batch)
+                parents = tracer.pop_followed(batch) if tracer.followed else []
+                message_ids = [message_id for _, message_id in batch]
+                retry = False
+                try:
+                    with tracer.span("delete_batch", parents=parents, channel_id=queue.channel_id, size=len(batch)):
+                        await self.delete_batch(queue, message_ids, priority=min(due for due, _ in batch))
+                except asyncio.CancelledError:
+                    raise
+                except TransportError as e:
+                    # Discord could not be reached, even after the retries of the RestClient. Put the batch back and try again.
+                    log.warning(f"Could not delete {len(batch)} messages in channel {queue.channel_id}: {e}. Retrying.")
+                    queue.pending.extend(batch)
+                    retry = True
+                    continue
+                except Exception as e:
+                    # Don't let one bad batch strand the rest of the queue. Its messages are given up on, like any other failed deletion.
+                    log.exception(f"Error deleting a batch of {len(batch)} messages in channel {queue.channel_id}: {e}")
+                    if self.store is not None:
+                        self.store.confirm(message_ids)
+                    continue
+                finally:
+                    queue.in_flight = 0
+                    if not retry:
+                        queue.queued.difference_update(message_ids)
+
+                done = time.time()
+                for due, _ in batch:
+                    metrics.deletion_lag.record(done - due)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            log.exception(f"Error deleting messages in channel {queue.channel_id}: {e}")
+        finally:
+            queue.worker = None
+
+
+    async def delete_batch(self, queue: ChannelDeletionQueue, message_ids: List[int], priority: float = 0):
+        """
+        Deletes up to BULK_DELETE_LIMIT messages from a channel using as few API calls as possible.
+        'priority' is the due time of the oldest message in the batch. Batches that have been due the longest get the global rate limit first.
+        """
+        now = time.time()
+        bulk = [m_id for m_id in message_ids if now - snowflake_timestamp(m_id) < BULK_DELETE_MAX_AGE]
+
+        if len(bulk) > 1:
+            singles = [m_id for m_id in message_ids if now - snowflake_timestamp(m_id) >= BULK_DELETE_MAX_AGE]
+            await self._bulk_delete(queue, bulk, priority)
+        else:
+            singles = message_ids
+
+        for message_id in singles:
+            await self._single_delete(queue, message_id, priority)
+
+        if self.store is not None:  # Every outcome above is final, so none of these need to be retried after a restart.
+            self.store.confirm(message_ids)
+
+
+    async def _bulk_delete(self, queue: ChannelDeletionQueue, message_ids: List[int], priority: float):
+        queue.rest_calls += 1
+        try:
+            await self.rest.delete_messages(queue.channel_id, message_ids, priority=priority, backlogged=len(queue.pending) > 0)
+            queue.deleted += len(message_ids)
+            queue.deletion_rate.record(len(message_ids))
+        except discord.Forbidden:
+            log.warning(f"Missing permissions to bulk delete messages in channel {queue.channel_id}.")
+        except discord.NotFound:
+            pass  # The channel is gone.
+        except TransportError:
+            raise  # Single deletes would not get through either.
+        except discord.HTTPException as e:
+            # Most likely a message was already deleted or aged out. Fall back to deleting them one at a time.
+            log.info(f"Bulk delete failed in channel {queue.channel_id} ({e}). Falling back to single deletes.")
+            for message_id in message_ids:
+                await self._single_delete(queue, message_id, priority)
+
+
+    async def _single_delete(self, queue: ChannelDeletionQueue, message_id: int, priority: float):
+        queue.rest_calls += 1
+        try:
+            await self.rest.delete_message(queue.channel_id, message_id, priority=priority, backlogged=len(queue.pending) > 0)
+            queue.deleted += 1
+            queue.deletion_rate.record()
+        except discord.NotFound:
+            pass  # Already deleted.
+        except discord.Forbidden:
+            log.warning(f"Missing permissions to delete message {message_id} in channel {queue.channel_id}.")
+        except TransportError:
+            raise
+        except discord.HTTPException as e:
+            log.warning(f"Could not delete message {message_id} in channel {queue.channel_id}: {e}")
@@ -0,0 +1,208 @@
+"""
+Per channel exemption rules for the void channels, and the set of our own messages that must not be voided.
+The rules stored in the DB are compiled once into an ExemptionMatcher: The role and user IDs become frozensets (of ints for
+discord.py objects, and of strings for raw gateway payloads, so those need no int conversion) and the content regex is
+precompiled. A message is checked with a few set lookups and at most one regex search, without any API calls.
+The regex runs on the event loop, so compile_pattern refuses patterns that could backtrack for long (see pattern_cost).
+Messages read from the history carry no member object, so MemberRoles fetches the roles of their authors for the role exemptions.
+
+Part of the void.
+"""
+
+import re
+import time
+import heapq
+from typing import TYPE_CHECKING, Optional, Dict, List, Tuple, FrozenSet, Any
+
+import discord
+
+try:
+    from re import _parser as sre_parse
+except ImportError:  # Python < 3.11
+    import sre_parse
+
+import db
+
+if TYPE_CHECKING:
+    from bot import VBot
+
+MAX_PATTERN_LENGTH = 200  # The content regex runs on every message in the channel, so keep it to something reasonable.
+MAX_MESSAGE_LENGTH = 4000  # The longest message content Discord allows.
+MAX_PATTERN_COST = MAX_MESSAGE_LENGTH  # One unbounded quantifier, or a few small bounded ones. A 4000 character message then takes ~0.1s at worst.
+
+
+def pattern_cost(pattern: str) -> int:
+    """
+    Estimates how many ways a regex can try to match from a single position, as the product of the number of counts that each
+    quantifier can take. Unbounded quantifiers can take up to MAX_MESSAGE_LENGTH counts.
+    Raises re.error for the constructs that backtrack exponentially: Backreferences, and quantifiers that repeat something that can
+    itself match in more than one way, like (a+)+ or (a|b)*.
+    """
+    def cost(items) -> int:
+        total = 1
+        for op, av in items:
+            name = str(op)
+            if name in ('GROUPREF', 'GROUPREF_EXISTS', 'GROUPREF_IGNORE'):
+                raise re.error("backreferences are not allowed")
+            if name in ('MAX_REPEAT', 'MIN_REPEAT', 'POSSESSIVE_REPEAT'):
+                low, high, inner = av
+                inner_cost = cost(inner)
+                if high > 1 and (inner_cost > 1 or any(str(inner_op) == 'BRANCH' for inner_op, _ in inner)):
+                    raise re.error("quantifiers can not be nested, or repeat an alternation")
+                total *= (MAX_MESSAGE_LENGTH if high == sre_parse.MAXREPEAT else high - low + 1) * inner_cost
+            elif name == 'BRANCH':
+                total *= sum(cost(branch) for branch in av[1])
+            elif name == 'SUBPATTERN':
+                total *= cost(av[-1])
+            elif name in ('ASSERT', 'ASSERT_NOT'):
+                total *= cost(av[1])
+            elif name == 'ATOMIC_GROUP':
+                total *= cost(av)
+        return total
+
+    return cost(sre_parse.parse(pattern))
+
+
+def compile_pattern(pattern: str) -> 're.Pattern':
+    """Compiles a content regex given by a moderator. Raises re.error if it does not compile, or could stall the event loop."""
+    if len(pattern) > MAX_PATTERN_LENGTH:
+        raise re.error(f"it can be at most {MAX_PATTERN_LENGTH} characters long")
+    compiled = re.compile(pattern)
+    if pattern_cost(pattern) > MAX_PATTERN_COST:
+        raise re.error("it could take too long to run on long messages. Use at most one of *, + or {n,}, and keep {m,n} ranges small")
+    return compiled
+
+
+class TTLSet:
+    """A set of IDs that each expire after their own TTL. Expired entries are pruned as new ones are added."""
+
+    def __init__(self, default_ttl: float = 600):
+        self.default_ttl = default_ttl
+        self._expiry: Dict[int, float] = {}
+        self._heap: List[Tuple[float, int]] = []
+
+
+    def __len__(self) -> int:
+        return len(self._expiry)
+
+
+    def __contains__(self, key: int) -> bool:
+        expiry = self._expiry.get(key)
+        return expiry is not None and expiry > time.monotonic()
+
+
+    def add(self, key: int, ttl: Optional[float] = None):
+        now = time.monotonic()
+        self._prune(now)
+        expiry = now + (ttl if ttl is not None else self.default_ttl)
+        self._expiry[key] = expiry
+        heapq.heappush(self._heap, (expiry, key))
+
+
+    def discard(self, key: int):
+        self._expiry.pop(key, None)  # Its heap entry is dropped when it expires.
+
+
+    def _prune(self, now: float):
+        heap = self._heap
+        while heap and heap[0][0] <= now:
+            expiry, key = heapq.heappop(heap)
+            if self._expiry.get(key) == expiry:  # Not re-added with a later expiry since.
+                del self._expiry[key]
+
+
+class MemberRoles:
+    """
+    The role IDs of guild members that are not in discord.py's member cache, fetched when needed and kept for 'ttl' seconds.
+    With the lean client options no members are cached, so this is where the roles of history message authors come from.
+    """
+
+    def __init__(self, bot: 'VBot', ttl: float = 600, max_size: int = 10000):
+        self.bot = bot
+        self.ttl = ttl
+        self.max_size = max_size
+        self._roles: Dict[Tuple[int, int], Tuple[float, FrozenSet[int]]] = {}  # (guild_id, user_id) -> (expiry, role IDs)
+        self.fetches = 0
+
+
+    async def get(self, guild: discord.Guild, user_id: int) -> Optional[FrozenSet[int]]:
+        """Returns the role IDs of a member, an empty set for users that are no longer members, or None if they could not be fetched."""
+        member = guild.get_member(user_id)
+        if member is not None:
+            return frozenset(member._roles)
+
+        now = time.monotonic()
+        cached = self._roles.get((guild.id, user_id))
+        if cached is not None and cached[0] > now:
+            return cached[1]
+
+        self.fetches += 1
+        try:
+            data = await self.bot.http.get_member(guild.id, user_id)
+            roles = frozenset(int(role_id) for role_id in data['roles'])
+        except discord.NotFound:
+            roles = frozenset()  # They left the guild, so none of its roles apply.
+        except discord.HTTPException:
+            return None
+
+        if len(self._roles) >= self.max_size:
+            self._roles = {key: entry for key, entry in self._roles.items() if entry[0] > now}
+            if len(self._roles) >= self.max_size:
+                self._roles.clear()
+        self._roles[(guild.id, user_id)] = (now + self.ttl, roles)
+        return roles
+
+
+class ExemptionMatcher:
+    """The compiled exemption rules of one channel."""
+
+    __slots__ = ('rules', 'role_ids', 'user_ids', 'bots', 'webhooks', 'pinned', 'pattern', '_role_strs', '_user_strs')
+
+    def __init__(self, rules: db.ExemptionRules):
+        """Raises re.error if the content regex does not compile, or is too slow to run on every message."""
+        self.rules = rules
+        self.role_ids = frozenset(rules.role_ids)
+        self.user_ids = frozenset(rules.user_ids)
+        self._role_strs = frozenset(str(role_id) for role_id in rules.role_ids)
+        self._user_strs = frozenset(str(user_id) for user_id in rules.user_ids)
+        self.bots = rules.bots
+        self.webhooks = rules.webhooks
+        self.pinned = rules.pinned
+        self.pattern = compile_pattern(rules.content_regex) if rules.content_regex else None
+
+
+    @property
+    def empty(self) -> bool:
+        return not (self.role_ids or self.user_ids or self.bots or self.webhooks or self.pinned or self.pattern)
+
+
+    def matches(self, message: discord.Message) -> bool:
+        if message.webhook_id is not None:
+            if self.webhooks:
+                return True
+        elif self.bots and message.author.bot:
+            return True
+        if self.pinned and message.pinned:
+            return True
+        if message.author.id in self.user_ids:
+            return True
+        # Member._roles is the SnowflakeList of role IDs that discord.py keeps. Going through Member.roles would build Role lists.
+        if self.role_ids and not self.role_ids.isdisjoint(getattr(message.author, '_roles', ())):
+            return True
+        return self.pattern is not None and self.pattern.search(message.content) is not None
+
+
+    def matches_payload(self, data: Dict[str, Any]) -> bool:
+        """The same checks as matches(), on a raw MESSAGE_CREATE payload."""
+        if 'webhook_id' in data:
+            if self.webhooks:
+                return True
+        elif self.bots and data['author'].get('bot', False):
+            return True
+        if self.pinned and data.get('pinned', False):
+            return True
+        if data['author']['id'] in self._user_strs:
+            return True
+        if self._role_strs and 'member' in data and not self._role_strs.isdisjoint(data['member'].get('roles', ())):
+            return True
+        return self.pattern is not None and self.pattern.search(data['content']) is not None
@@ -0,0 +1,161 @@
+"""
+Constant memory streaming latency histograms.
+Samples are counted in log spaced buckets, 16 per power of two, so every reported quantile is within ~2.2% of the true value.
+The number of buckets is capped, so a histogram never grows past a fixed size no matter how many samples it sees.
+Recording a sample is O(1).
+
+Part of the void.
+"""
+
+import math
+import time
+from typing import Optional, Dict, List, Sequence
+
+SUB_BUCKETS = 16  # Buckets per power of two.
+MIN_INDEX = -20 * SUB_BUCKETS  # ~1e-6. Smaller samples are counted in the lowest bucket.
+MAX_INDEX = 30 * SUB_BUCKETS  # ~1e9. Larger samples are counted in the highest bucket.
+
+QUANTILES = (('p50', 0.5), ('p90', 0.9), ('p99', 0.99), ('p999', 0.999))
+
+
+def bucket_index(value: float) -> int:
+    if value <= 0:
+        return MIN_INDEX
+    return min(max(math.floor(math.log2(value) * SUB_BUCKETS), MIN_INDEX), MAX_INDEX)
+
+
+def bucket_value(index: int) -> float:
+    """The geometric midpoint of a bucket."""
+    return 2 ** ((index + 0.5) / SUB_BUCKETS)
+
+
+class LogHistogram:
+
+    __slots__ = ('buckets', 'count', 'total', 'max')
+
+    def __init__(self):
+        self.buckets: Dict[int, int] = {}  # Sparse. Only buckets that have seen a sample are stored.
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+
+    def record(self, value: float):
+        index = bucket_index(value)
+        self.buckets[index] = self.buckets.get(index, 0) + 1
+        self.count += 1
+        self.total += value
+        if value > self.max:
+            self.max = value
+
+
+    def clear(self):
+        self.buckets.clear()
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+
+    def merge(self, other: 'LogHistogram'):
+        for index, count in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + count
+        self.count += other.count
+        self.total += other.total
+        self.max = max(self.max, other.max)
+
+
+    def quantile(self, q: float) -> float:
+        if self.count == 0:
+            return 0.0
+        rank = max(1, math.ceil(q * self.count))
+        seen = 0
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if seen >= rank:
+                return min(bucket_value(index), self.max)
+        return self.max
+
+
+    def cumulative(self, bounds: Sequence[float]) -> List[int]:
+        """The number of samples at or below each of the ascending 'bounds', as used for Prometheus histogram buckets."""
+        indexes = sorted(self.buckets)
+        counts = []
+        seen = 0
+        i = 0
+        for bound in bounds:
+            while i < len(indexes) and bucket_value(indexes[i]) <= bound:
+                seen += self.buckets[indexes[i]]
+                i += 1
+            counts.append(seen)
+        return counts
+
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+
+    def summary(self) -> Dict[str, float]:
+        summary = {'calls': self.count, 'avg': self.mean}
+        for name, q in QUANTILES:
+            summary[name] = self.quantile(q)
+        summary['max'] = self.max
+        return summary
+
+
+class WindowedHistogram:
+    """
+    A histogram over a sliding window of 'span' seconds, kept as a ring of 'slots' sub histograms.
+    The window moves in steps of span/slots seconds, so it covers between span - span/slots and span seconds of samples.
+    """
+
+    __slots__ = ('slot_length', 'slots', 'epochs')
+
+    def __init__(self, span: float, slots: int):
+        self.slot_length = span / slots
+        self.slots: List[LogHistogram] = [LogHistogram() for _ in range(slots)]
+        self.epochs: List[int] = [-1] * slots  # The slot_length period that each slot holds.
+
+
+    def record(self, value: float, now: float):
+        epoch = int(now // self.slot_length)
+        i = epoch % len(self.slots)
+        if self.epochs[i] != epoch:
+            self.slots[i].clear()
+            self.epochs[i] = epoch
+        self.slots[i].record(value)
+
+
+    def snapshot(self, now: float) -> LogHistogram:
+        epoch = int(now // self.slot_length)
+        merged = LogHistogram()
+        for slot_epoch, slot in zip(self.epochs, self.slots):
+            if 0 <= epoch - slot_epoch < len(self.slots):
+                merged.merge(slot)
+        return merged
+
+
+class LatencyStats:
+    """Lifetime and windowed latency histograms for one source of samples."""
+
+    WINDOWS = {'1m': (60, 6), '1h': (3600, 60)}  # name -> (span in seconds, slots)
+
+    __slots__ = ('lifetime', 'windows')
+
+    def __init__(self):
+        self.lifetime = LogHistogram()
+        self.windows: Dict[str, WindowedHistogram] = {name: WindowedHistogram(span, slots) for name, (span, slots) in self.WINDOWS.items()}
+
+
+    def record(self, value: float, now: Optional[float] = None):
+        now = time.monotonic() if now is None else now
+        self.lifetime.record(value)
+        for window in self.windows.values():
+            window.record(value, now)
+
+
+    def histogram(self, window: str = 'lifetime') -> LogHistogram:
+        """Gets the histogram for a window. Either 'lifetime' or one of the WINDOWS."""
+        if window == 'lifetime':
+            return self.lifetime
+        return self.windows[window].snapshot(time.monotonic())
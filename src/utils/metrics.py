@@ -0,0 +1,203 @@
+"""
+Prometheus text format metrics for the void.
+The hot paths only bump plain counters and histograms on the `metrics` singleton. Everything else is read from the bot
+and rendered when the endpoint is scraped.
+
+Part of the void.
+"""
+
+import time
+import asyncio
+import logging
+from typing import TYPE_CHECKING, Optional, Dict, List, Sequence
+
+import psutil
+from aiohttp import web
+
+import db
+from utils.histogram import LogHistogram, LatencyStats
+
+if TYPE_CHECKING:
+    from bot import VBot
+
+log = logging.getLogger(__name__)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+LAG_BOUNDS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)  # seconds
+DB_BOUNDS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)  # seconds
+
+
+class Metrics:
+    """Counters and histograms updated on the hot paths. Only ever touched from the event loop, so no locking is needed."""
+
+    __slots__ = ('messages_seen', 'messages_voided', 'deletion_lag', 'loop_lag')
+
+    def __init__(self):
+        self.messages_seen = 0  # Every MESSAGE_CREATE, void channel or not.
+        self.messages_voided = 0  # Messages scheduled for deletion.
+        self.deletion_lag = LogHistogram()  # Seconds from a message coming due to its deletion request finishing.
+        self.loop_lag = LatencyStats()  # Seconds that the event loop was late in running a timer.
+
+
+metrics = Metrics()
+
+
+class LoopLagMonitor:
+    """Measures how late the event loop runs a timer that is re-armed every 'interval' seconds."""
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, interval: float = 0.5):
+        self.loop = loop
+        self.interval = interval
+        self.last_lag = 0.0
+        self._expected = 0.0
+        self._handle: Optional[asyncio.TimerHandle] = None
+
+
+    def start(self):
+        if self._handle is None:
+            self._arm()
+
+
+    def stop(self):
+        if self._handle is not None:
+            self._handle.cancel()
+            self._handle = None
+
+
+    @property
+    def expected(self) -> Optional[float]:
+        """The loop.time() at which the timer should next run, while the monitor is running. Safe to read from other threads."""
+        return self._expected if self._handle is not None else None
+
+
+    def _arm(self):
+        self._expected = self.loop.time() + self.interval
+        self._handle = self.loop.call_at(self._expected, self._tick)
+
+
+    def _tick(self):
+        self.last_lag = max(0.0, self.loop.time() - self._expected)
+        metrics.loop_lag.record(self.last_lag)
+        self._arm()
+
+
+def format_lag_histogram(histogram: LogHistogram, bounds: Sequence[float] = (0.001, 0.005, 0.025, 0.1, 0.5, 2.5)) -> str:
+    """A small text bar chart of a histogram of seconds, for embeds."""
+    counts = histogram.cumulative(bounds) + [histogram.count]
+    per_bucket = [count - previous for count, previous in zip(counts, [0] + counts[:-1])]
+    labels = [f"≤{bound * 1000:g} ms" for bound in bounds] + [f">{bounds[-1] * 1000:g} ms"]
+    widest = max(per_bucket) or 1
+    return "\n".join(f"{label:>9} {'█' * round(12 * count / widest):<12} {count}" for label, count in zip(labels, per_bucket))
+
+
+def _labels(labels: Optional[Dict[str, str]]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels.items()) + "}"
+
+
+def _header(lines: List[str], name: str, metric_type: str, help_text: str):
+    lines.append(f"# HELP {name} {help_text}")
+    lines.append(f"# TYPE {name} {metric_type}")
+
+
+def _histogram(lines: List[str], name: str, histogram: LogHistogram, bounds: Sequence[float], scale: float = 1.0,
+               labels: Optional[Dict[str, str]] = None):
+    """Renders the samples of a histogram. 'scale' converts the recorded values into the base unit of the metric."""
+    labels = labels or {}
+    for bound, count in zip(bounds, histogram.cumulative([bound / scale for bound in bounds])):
+        lines.append(f"{name}_bucket{_labels({**labels, 'le': repr(float(bound))})} {count}")
+    lines.append(f"{name}_bucket{_labels({**labels, 'le': '+Inf'})} {histogram.count}")
+    lines.append(f"{name}_sum{_labels(labels)} {histogram.total * scale}")
+    lines.append(f"{name}_count{_labels(labels)} {histogram.count}")
+
+
+def render(bot: 'VBot') -> str:
+    lines = []
+
+    _header(lines, "void_messages_seen_total", "counter", "Messages received from the gateway.")
+    lines.append(f"void_messages_seen_total {metrics.messages_seen}")
+    _header(lines, "void_messages_voided_total", "counter", "Messages scheduled for deletion.")
+    lines.append(f"void_messages_voided_total {metrics.messages_voided}")
+
+    void_cog = bot.get_cog('Void')
+    deleters = void_cog.deleters if void_cog is not None else {}
+    for name, attr, metric_type, help_text in (
+            ("void_messages_deleted_total", 'deleted', "counter", "Messages deleted."),
+            ("void_rest_calls_total", 'rest_calls', "counter", "Delete REST calls made."),
+            ("void_deletion_backlog", 'backlog', "gauge", "Deletions that are due but not done yet."),
+            ("void_deletions_scheduled", 'scheduled', "gauge", "Deletions that are not due yet.")):
+        _header(lines, name, metric_type, help_text)
+        for shard_id, deleter in deleters.items():
+            lines.append(f"{name}{_labels({'shard': str(shard_id)})} {getattr(deleter, attr)}")
+
+    mode_stats = void_cog.mode_stats() if void_cog is not None else {}
+    _header(lines, "void_mode_messages_deleted_total", "counter", "Messages deleted, by the deletion mode of the channel.")
+    for mode, (deleted, _) in mode_stats.items():
+        lines.append(f"void_mode_messages_deleted_total{_labels({'mode': mode})} {deleted}")
+    _header(lines, "void_mode_api_calls_total", "counter", "Delete and sweep history REST calls, by the deletion mode of the channel.")
+    for mode, (_, api_calls) in mode_stats.items():
+        lines.append(f"void_mode_api_calls_total{_labels({'mode': mode})} {api_calls}")
+
+    backpressure = void_cog.backpressure.pressure.values() if void_cog is not None else ()
+    _header(lines, "void_slowmode_interventions", "gauge", "Void channels whose slowmode is raised because of a deletion backlog.")
+    lines.append(f"void_slowmode_interventions {sum(1 for pressure in backpressure if pressure.intervention is not None)}")
+
+    _header(lines, "void_deletion_lag_seconds", "histogram", "Time from a message coming due to its deletion.")
+    _histogram(lines, "void_deletion_lag_seconds", metrics.deletion_lag, LAG_BOUNDS)
+
+    _header(lines, "void_db_query_duration_seconds", "histogram", "Database query latency.")
+    for query, latency in db.db_perf.time.items():
+        _histogram(lines, "void_db_query_duration_seconds", latency.lifetime, DB_BOUNDS, scale=0.001, labels={'query': query})
+
+    _header(lines, "void_gateway_latency_seconds", "gauge", "Gateway heartbeat latency.")
+    for shard_id, latency in bot.latencies:
+        lines.append(f"void_gateway_latency_seconds{_labels({'shard': str(shard_id)})} {latency}")
+
+    _header(lines, "void_event_loop_lag_seconds", "histogram", "How late the event loop ran a periodic timer.")
+    _histogram(lines, "void_event_loop_lag_seconds", metrics.loop_lag.lifetime, LAG_BOUNDS)
+
+    _header(lines, "void_webhook_cache_size", "gauge", "Webhooks in the proxy webhook cache.")
+    lines.append(f"void_webhook_cache_size {len(bot.webhook_cache)}")
+    _header(lines, "void_webhook_cache_hits_total", "counter", "Proxy webhook lookups served from the cache.")
+    lines.append(f"void_webhook_cache_hits_total {bot.webhook_cache.hits}")
+    _header(lines, "void_webhook_cache_misses_total", "counter", "Proxy webhook lookups that went to the DB or Discord.")
+    lines.append(f"void_webhook_cache_misses_total {bot.webhook_cache.misses}")
+    _header(lines, "void_guilds", "gauge", "Guilds on this process.")
+    lines.append(f"void_guilds {len(bot.guilds)}")
+    _header(lines, "void_process_resident_memory_bytes", "gauge", "Resident memory of this process.")
+    lines.append(f"void_process_resident_memory_bytes {psutil.Process().memory_info().rss}")
+
+    return "\n".join(lines) + "\n"
+
+
+class MetricsServer:
+    """Serves the metrics at http://host:port/metrics."""
+
+    def __init__(self, bot: 'VBot', host: str = "127.0.0.1", port: int = 9100):
+        self.bot = bot
+        self.host = host
+        self.port = port
+        self._runner: Optional[web.AppRunner] = None
+
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get("/metrics", self.handle_metrics)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self.host, self.port).start()
+        log.info(f"Serving metrics on http://{self.host}:{self.port}/metrics")
+
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+
+    async def handle_metrics(self, request: web.Request) -> web.Response:
+        start = time.perf_counter()
+        body = render(self.bot)
+        log.debug(f"Rendered metrics in {(time.perf_counter() - start) * 1000:.2f} ms")
+        return web.Response(body=body.encode(), headers={"Content-Type": CONTENT_TYPE})
@@ -26,18 +26,7 @@ async def get_webhook(bot: 'VBot', channel: discord.TextChannel) -> discord.Webh
     """
     Gets the existing webhook from the guild and channel specified. Creates one if it does not exist.
     """
-    if channel.id in bot.webhook_cache.keys():
-        return bot.webhook_cache[channel.id]
-
-    existing_webhooks = await channel.webhooks()
-    webhook = discord.utils.get(existing_webhooks, user=bot.user)
-
-    if webhook is None:
-        log.warning("Webhook did not exist in channel {}! Creating new webhook!".format(channel.name))
-        webhook = await channel.create_webhook(name="void", reason="Creating webhook for void")
-
-    bot.webhook_cache[channel.id] = webhook
-    return webhook
+    return await bot.webhook_cache.get(channel)
 
 
 async def send_long_msg(channel: [discord.TextChannel, commands.Context], message: str, code_block: bool = False, code_block_lang: str = "python"):
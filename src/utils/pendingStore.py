@@ -0,0 +1,115 @@
+"""
+Write-behind persistence for the pending message deletions so that they survive a restart.
+New deletions and confirmed deletions are buffered in memory and written to the DB in batches,
+so the message hot path never waits on the DB. Deletions that are confirmed before they are flushed are never written at all.
+The store also keeps the per channel high water mark (the newest message scheduled for deletion) used by the catch-up sweeper.
+
+Part of the void.
+"""
+
+import asyncio
+import logging
+from typing import TYPE_CHECKING, Dict, List, Set, Tuple, Iterable
+
+import db
+
+if TYPE_CHECKING:
+    from bot import VBot
+
+log = logging.getLogger(__name__)
+
+
+class PendingDeletionStore:
+
+    def __init__(self, bot: 'VBot', flush_interval: float = 2.0, max_batch: int = 5000):
+        self.bot = bot
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self._to_add: Dict[int, Tuple[int, int, float]] = {}  # message_id -> (message_id, channel_id, due_at)
+        self._to_remove: Set[int] = set()
+        self.high_water: Dict[int, int] = {}  # channel_id -> newest message_id scheduled this session
+        self._marks_dirty = False
+        self._wakeup = asyncio.Event()
+        self._stopping = False
+        self._flush_task = bot.loop.create_task(self._run())
+
+
+    def add(self, channel_id: int, message_id: int, due_at: float):
+        self._to_add[message_id] = (message_id, channel_id, due_at)
+        self.advance_high_water(channel_id, message_id)
+        if len(self._to_add) >= self.max_batch:
+            self._wakeup.set()
+
+
+    def advance_high_water(self, channel_id: int, message_id: int):
+        """Moves the high water mark of a channel forward, so that the catch-up sweeper leaves everything up to 'message_id' alone."""
+        if message_id > self.high_water.get(channel_id, 0):
+            self.high_water[channel_id] = message_id
+            self._marks_dirty = True
+
+
+    def confirm(self, message_ids: Iterable[int]):
+        """Marks deletions as done so that their rows get removed."""
+        for message_id in message_ids:
+            if self._to_add.pop(message_id, None) is None:  # Only rows that may have been written need removing.
+                self._to_remove.add(message_id)
+
+        if len(self._to_remove) >= self.max_batch:
+            self._wakeup.set()
+
+
+    async def load(self) -> List[db.PendingDeletion]:
+        """Gets all the outstanding deletions, ordered by due time."""
+        pending = await db.get_pending_deletions(self.bot.db_pool)
+        return pending or []
+
+
+    async def load_high_water(self) -> Dict[int, int]:
+        """Gets the high water marks, including any that have not been flushed yet."""
+        marks = await db.get_high_water_marks(self.bot.db_pool) or {}
+        for channel_id, message_id in self.high_water.items():
+            marks[channel_id] = max(marks.get(channel_id, 0), message_id)
+        return marks
+
+
+    async def flush(self):
+        to_add, self._to_add = self._to_add, {}
+        to_remove, self._to_remove = self._to_remove, set()
+
+        if to_add:
+            if await db.add_pending_deletions(self.bot.db_pool, list(to_add.values())) is None:
+                # Try again next flush. Anything confirmed in the meantime is queued for removal, which runs after the insert.
+                for message_id, row in to_add.items():
+                    self._to_add.setdefault(message_id, row)
+        if to_remove:
+            if await db.remove_pending_deletions(self.bot.db_pool, list(to_remove)) is None:
+                self._to_remove.update(to_remove)
+        if self._marks_dirty:
+            self._marks_dirty = False
+            if await db.set_high_water_marks(self.bot.db_pool, list(self.high_water.items())) is None:
+                self._marks_dirty = True
+
+
+    async def stop(self):
+        """Stops the periodic flushes and writes out whatever is still buffered."""
+        # Let a flush that is under way finish instead of cancelling it, as its batch has already been taken out of the buffers.
+        self._stopping = True
+        self._wakeup.set()
+        await asyncio.wait({self._flush_task})
+        await self.flush()
+
+
+    async def _run(self):
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+            try:
+                await self.flush()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log.exception(f"Error flushing the pending deletions: {e}")
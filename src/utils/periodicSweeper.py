@@ -0,0 +1,155 @@
+"""
+Sweep mode for void channels that are too busy to give every message a deletion timer of its own.
+Every sweep interval, the history of each enabled sweep mode channel is listed from its delete_after cutoff backwards, one page of
+100 raw message payloads at a time, down to where the previous sweep of the channel stopped. Everything found is due, and goes
+straight into the channels ChannelDeletionQueue, so sweeps share the bulk deletes, pacing and stats of the per message mode.
+Nothing is tracked per message in between sweeps: No timers, no pending_deletions rows and no work on MESSAGE_CREATE.
+The cost is that messages live for up to one sweep interval longer than their delete_after.
+
+The history requests are counted per channel, so that Void.mode_stats can compare the API calls per deleted message of the two modes.
+
+Part of the void.
+"""
+
+import time
+import asyncio
+import logging
+from collections import Counter
+from typing import TYPE_CHECKING, Optional, Dict, Any, Callable, Iterable, Awaitable
+
+import discord
+
+import db
+from utils.deletionEngine import DeletionEngine, snowflake_timestamp, timestamp_snowflake
+from utils.metrics import metrics
+
+if TYPE_CHECKING:
+    from bot import VBot
+
+log = logging.getLogger(__name__)
+
+PAGE_SIZE = 100  # The most messages Discord returns per history request.
+
+
+class PeriodicSweeper:
+
+    def __init__(self, bot: 'VBot', get_deleter: Callable[[int], DeletionEngine], get_void_channels: Callable[[], Iterable[db.VoidChannel]],
+                 is_exempt: Callable[[Dict[str, Any]], Awaitable[bool]], interval: float = 30, concurrency: int = 4, unmarked_pages: int = 10):
+        """
+        'get_deleter' returns the DeletionEngine responsible for a guild ID.
+        'get_void_channels' returns the configured void channels. Only the enabled sweep mode ones in local guilds are swept.
+        'is_exempt' decides if a raw message payload found in the history should be left alone.
+        'concurrency' is the max number of channels that are swept at the same time.
+        'unmarked_pages' is how many pages back to look in channels that have not been swept since the start.
+        """
+        self.bot = bot
+        self.get_deleter = get_deleter
+        self.get_void_channels = get_void_channels
+        self.is_exempt = is_exempt
+        self.interval = interval
+        self.concurrency = concurrency
+        self.semaphore = asyncio.Semaphore(concurrency)  # Shared by the sweeps and the hand overs, so that together they stay within 'concurrency'.
+        self.unmarked_pages = unmarked_pages
+        self.swept_to: Dict[int, int] = {}  # channel_id -> the newest message that the last sweep went through
+        self.history_calls: Counter = Counter()  # channel_id -> history requests made
+        self.sweeps = 0
+        self.last_duration = 0.0
+        self.task: Optional[asyncio.Task] = None
+
+
+    def start(self):
+        if self.task is None:
+            self.task = self.bot.loop.create_task(self._run())
+
+
+    def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+
+    def forget(self, channel_id: int):
+        """Drops the position of a channel that is no longer swept."""
+        self.swept_to.pop(channel_id, None)
+
+
+    async def _run(self):
+        await self.bot.wait_until_ready()
+        while True:
+            start = time.monotonic()
+            try:
+                await self.sweep()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log.exception(f"Error during a periodic sweep: {e}")
+            await asyncio.sleep(max(0.0, self.interval - (time.monotonic() - start)))
+
+
+    async def sweep(self):
+        # The cache holds the void channels of the whole cluster. The other workers sweep the guilds that they run.
+        void_channels = [void_ch for void_ch in self.get_void_channels()
+                         if void_ch.enabled and void_ch.mode == db.MODE_SWEEP and self.bot.get_guild(void_ch.server_id) is not None]
+        if not void_channels:
+            return
+
+        start = time.perf_counter()
+        found = await asyncio.gather(*[self.sweep_channel(void_ch) for void_ch in void_channels])
+        self.sweeps += 1
+        self.last_duration = time.perf_counter() - start
+        log.debug(f"Swept {len(void_channels)} void channels in {self.last_duration:.2f}s and queued {sum(found)} messages for deletion.")
+
+
+    async def sweep_channel(self, void_ch: db.VoidChannel, hand_over: bool = False) -> int:
+        """
+        Queues the due messages of the channel for deletion. Returns the number of messages that were queued.
+        With 'hand_over' every message since the last sweep is scheduled instead, due or not, for a channel switching to the per message mode.
+        """
+        channel_id = void_ch.channel_id
+        deleter = self.get_deleter(void_ch.server_id)
+        swept_to = self.swept_to.get(channel_id)
+        # Messages newer than the cutoff are not due yet. They are left for a later sweep.
+        cursor = None if hand_over else timestamp_snowflake(time.time() - void_ch.delete_after)
+        newest = None
+        found = 0
+        pages = 0
+        async with self.semaphore:
+            try:
+                done = False
+                while not done and (swept_to is not None or pages < self.unmarked_pages):
+                    page = await self.bot.http.logs_from(channel_id, PAGE_SIZE, before=cursor)
+                    self.history_calls[channel_id] += 1
+                    pages += 1
+                    done = len(page) < PAGE_SIZE
+                    for data in page:
+                        message_id = int(data['id'])
+                        if swept_to is not None and message_id <= swept_to:
+                            done = True
+                            break
+                        cursor = message_id
+                        if newest is None:
+                            newest = message_id
+                        if await self.is_exempt(data):
+                            continue
+                        found += 1
+                        if hand_over:
+                            deleter.schedule(channel_id, message_id, void_ch.delete_after)
+                        else:
+                            deleter.enqueue(channel_id, message_id, snowflake_timestamp(message_id) + void_ch.delete_after)
+                            metrics.messages_voided += 1
+            except discord.Forbidden:
+                log.warning(f"Missing permissions to read the history of void channel {channel_id}.")
+                return found
+            except discord.NotFound:
+                self.forget(channel_id)  # The channel is gone.
+                return found
+            except discord.HTTPException as e:
+                # Keep the old position, so that the next sweep covers the part of the history that this one missed.
+                log.warning(f"Could not sweep void channel {channel_id}: {e}")
+                return found
+
+        if hand_over:
+            self.forget(channel_id)
+        elif newest is not None:
+            self.swept_to[channel_id] = newest
+        return found
@@ -0,0 +1,296 @@
+"""
+Streaming, resumable purges of a channels history.
+The history is read one page of 100 messages at a time, newest first, as raw payloads (no discord.Message objects are built)
+and filtered by author, age, attachments and a content regex. Matching messages are bulk deleted 100 at a time. Once the purge
+reaches messages that are too old to bulk delete, it switches to single deletes, paced by the per channel rate limit.
+Deletes go through the RestClient of the Void cog at a lower priority than the void channel deletions.
+
+After every page (and regularly during single deletes) the position in the history is checkpointed to the purge_jobs table,
+so a purge that was interrupted by a restart picks up where it left off. A progress embed is edited as the purge goes.
+
+Part of the void.
+"""
+
+import re
+import time
+import asyncio
+import logging
+from typing import TYPE_CHECKING, Optional, Dict, List, Any, Callable
+
+import discord
+from discord.ext import commands
+
+import db
+from utils.deletionEngine import BULK_DELETE_LIMIT, BULK_DELETE_MAX_AGE, snowflake_timestamp
+from utils.exemptions import TTLSet, compile_pattern
+from utils.rateLimits import RestClient, DecayingRate, TransportError
+
+if TYPE_CHECKING:
+    from bot import VBot
+
+log = logging.getLogger(__name__)
+
+PAGE_SIZE = 100  # The most messages Discord returns per history request.
+PRIORITY_DELAY = 60  # Void deletions that come due up to this many seconds after a purge started go first under the global rate limit.
+STATUS_TTL = 600  # How long after its last update the progress embed stays protected from the void.
+
+
+class PurgeFilter:
+    """Decides which messages in the history a purge deletes, from the raw message payloads."""
+
+    __slots__ = ('author_ids', 'attachments_only', 'pattern')
+
+    def __init__(self, job: db.PurgeJob):
+        """Raises re.error if the content regex does not compile, or could stall the event loop."""
+        self.author_ids = frozenset(str(author_id) for author_id in job.author_ids)
+        self.attachments_only = job.attachments_only
+        self.pattern = compile_pattern(job.content_regex) if job.content_regex else None
+
+    def matches(self, data: Dict[str, Any]) -> bool:
+        if self.author_ids and data['author']['id'] not in self.author_ids:
+            return False
+        if self.attachments_only and not data.get('attachments'):
+            return False
+        return self.pattern is None or self.pattern.search(data['content']) is not None
+
+
+class Purge:
+
+    def __init__(self, bot: 'VBot', rest: RestClient, job: db.PurgeJob, protected: TTLSet, on_done: Callable[['Purge'], None],
+                 progress_interval: float = 5.0):
+        """
+        'protected' message IDs are never deleted, and the progress embed is added to it.
+        'on_done' is called once the purge has finished, failed or been cancelled.
+        """
+        self.bot = bot
+        self.rest = rest
+        self.job = job
+        self.filter = PurgeFilter(job)
+        self.protected = protected
+        self.on_done = on_done
+        self.progress_interval = progress_interval
+        self.status = "Running"
+        self.error: Optional[str] = None
+        self.singles = False  # Reached the messages that are too old to bulk delete.
+        self.rest_calls = 0
+        self.deletion_rate = DecayingRate(tau=10)
+        self.priority = job.started_at + PRIORITY_DELAY
+        self.task: Optional[asyncio.Task] = None
+        self._last_update = 0.0
+
+
+    def start(self):
+        if self.job.status_message_id is not None:
+            self.protected.add(self.job.status_message_id, STATUS_TTL)
+        self.task = self.bot.loop.create_task(self._run())
+
+
+    def stop(self):
+        """Stops the purge but keeps its checkpoint, so that it resumes on the next start."""
+        if self.task is not None:
+            self.task.cancel()
+
+
+    async def cancel(self):
+        """Stops the purge for good."""
+        if self.task is not None and self.task.done():
+            return  # It already finished on its own, and _run has cleaned up.
+        self.stop()
+        self.status = "Cancelled"
+        await self._finish()
+
+
+    async def _run(self):
+        try:
+            await self._purge()
+            self.status = "Finished"
+        except asyncio.CancelledError:
+            raise  # Stopped or cancelled. The checkpoint stays for stop(), and cancel() cleans up itself.
+        except discord.Forbidden:
+            self.status = "Failed"
+            self.error = "`void` needs the **Manage Messages** and the **Read Message History** permissions."
+        except discord.HTTPException as e:
+            self.status = "Failed"
+            self.error = str(e)
+        except Exception as e:
+            log.exception(f"Error purging channel {self.job.channel_id}: {e}")
+            self.status = "Failed"
+            self.error = "An unexpected error occurred."
+        await self._finish()  # Only once _purge has ended on its own.
+
+
+    async def _finish(self):
+        await db.remove_purge_job(self.bot.db_pool, self.job.channel_id)
+        await self.update_progress(force=True)
+        self.on_done(self)
+
+
+    async def _purge(self):
+        job = self.job
+        young: List[int] = []  # Matching messages that can still be bulk deleted, newest first.
+        cursor = job.before  # The oldest message scanned so far.
+        done = job.remaining <= 0
+        while not done:
+            page = await self.bot.http.logs_from(job.channel_id, PAGE_SIZE, before=cursor)
+            done = len(page) < PAGE_SIZE
+            old: List[int] = []
+            now = time.time()
+            for data in page:
+                message_id = int(data['id'])
+                if job.after is not None and message_id <= job.after:
+                    done = True
+                    break
+                job.scanned += 1
+                cursor = message_id
+                if message_id in self.protected or not self.filter.matches(data):
+                    continue
+                if now - snowflake_timestamp(message_id) < BULK_DELETE_MAX_AGE:
+                    young.append(message_id)
+                else:
+                    old.append(message_id)
+                if len(young) + len(old) >= job.remaining:
+                    done = True
+                    break
+
+            while len(young) >= BULK_DELETE_LIMIT or (young and (done or old)):
+                batch = young[:BULK_DELETE_LIMIT]
+                del young[:BULK_DELETE_LIMIT]
+                await self._delete(batch)
+
+            # Any matches that are left have to be scanned again after a restart, so the checkpoint can't move past them.
+            job.before = young[0] + 1 if young else cursor
+            await self.checkpoint()
+            await self.update_progress()
+
+            if old:
+                self.singles = True
+                for message_id in old:
+                    await self._delete([message_id])
+                    job.before = message_id
+                    if time.monotonic() - self._last_update >= self.progress_interval:
+                        await self.checkpoint()
+                        await self.update_progress()
+                job.before = cursor
+                await self.checkpoint()
+
+
+    async def _delete(self, message_ids: List[int]):
+        self.rest_calls += 1
+        try:
+            if len(message_ids) > 1:
+                await self.rest.delete_messages(self.job.channel_id, message_ids, priority=self.priority, backlogged=True)
+            else:
+                await self.rest.delete_message(self.job.channel_id, message_ids[0], priority=self.priority, backlogged=True)
+        except discord.NotFound:
+            if len(message_ids) > 1:
+                raise  # The channel is gone.
+            return  # Already deleted.
+        except (discord.Forbidden, TransportError):
+            raise  # Single deletes would not get through a TransportError either.
+        except discord.HTTPException as e:
+            if len(message_ids) == 1:
+                log.warning(f"Could not delete message {message_ids[0]} while purging channel {self.job.channel_id}: {e}")
+                return
+            # Most likely a message was deleted in the meantime. Fall back to deleting them one at a time.
+            log.info(f"Bulk delete failed while purging channel {self.job.channel_id} ({e}). Falling back to single deletes.")
+            for message_id in message_ids:
+                await self._delete([message_id])
+            return
+        self.job.deleted += len(message_ids)
+        self.job.remaining -= len(message_ids)
+        self.deletion_rate.record(len(message_ids))
+
+
+    async def checkpoint(self):
+        await db.checkpoint_purge_job(self.bot.db_pool, self.job)
+
+
+    async def update_progress(self, force: bool = False):
+        if self.job.status_message_id is None or (not force and time.monotonic() - self._last_update < self.progress_interval):
+            return
+        self._last_update = time.monotonic()
+        self.protected.add(self.job.status_message_id, STATUS_TTL)
+        try:
+            await self.bot.http.edit_message(self.job.channel_id, self.job.status_message_id, embed=self.progress_embed().to_dict())
+        except discord.NotFound:
+            self.job.status_message_id = None  # Someone deleted it. Carry on without.
+        except discord.HTTPException as e:
+            log.warning(f"Could not update the progress of the purge of channel {self.job.channel_id}: {e}")
+
+
+    def progress_embed(self) -> discord.Embed:
+        job = self.job
+        embed = discord.Embed(title="`void` purge", color=0x000000,
+                              description=f"Purging up to {job.deleted + job.remaining} messages from <#{job.channel_id}>{describe_filters(job)}.")
+        embed.add_field(name="Status", value=self.status if self.error is None else f"{self.status}: {self.error}", inline=False)
+        embed.add_field(name="Deleted", value=f"{job.deleted}")
+        embed.add_field(name="Scanned", value=f"{job.scanned}")
+        if self.status == "Running":
+            phase = "Deleting messages older than 14 days one at a time" if self.singles else "Bulk deleting"
+            embed.add_field(name="Rate", value=f"{self.deletion_rate.rate:.1f} msgs/sec")
+            embed.add_field(name="Phase", value=phase, inline=False)
+            embed.set_footer(text="Stop it with the purge cancel command.")
+        else:
+            embed.set_footer(text=f"Took {format_duration(time.time() - job.started_at)}")
+        return embed
+
+
+def parse_filters(text: Optional[str]) -> Dict[str, Any]:
+    """
+    Parses the filters of the purge command into PurgeJob fields:
+        from:<user>         Only messages by this user. Can be given more than once.
+        before:<message ID> Only messages older than this one.
+        after:<message ID>  Only messages newer than this one.
+        attachments         Only messages with attachments.
+        regex:<pattern>     Only messages matching the regular expression. Must come last, the rest of the text is the pattern.
+    """
+    fields: Dict[str, Any] = {'author_ids': []}
+    text = (text or "").strip()
+    while text:
+        token, _, rest = text.partition(" ")
+        name, _, value = token.partition(":")
+        name = name.lower()
+        if name == "regex":
+            pattern = text.partition(":")[2].strip()
+            if not pattern:
+                raise commands.BadArgument("The regular expression can not be empty.")
+            try:
+                compile_pattern(pattern)  # It runs on every message in the history, so patterns that could backtrack for long are refused too.
+            except re.error as e:
+                raise commands.BadArgument(f"That regular expression can not be used: {e}")
+            fields['content_regex'] = pattern
+            break
+        elif name == "attachments" and not value:
+            fields['attachments_only'] = True
+        elif name in ("from", "before", "after") and value:
+            match = re.fullmatch(r"<@!?(\d+)>|(\d+)", value)
+            if match is None:
+                raise commands.BadArgument(f"`{value}` is not a user mention or ID." if name == "from" else f"`{value}` is not a message ID.")
+            snowflake = int(match.group(1) or match.group(2))
+            if name == "from":
+                fields['author_ids'].append(snowflake)
+            else:
+                fields[name] = snowflake
+        else:
+            raise commands.BadArgument(f"Unknown purge filter `{token}`. Use from:, before:, after:, attachments or regex:.")
+        text = rest.strip()
+    return fields
+
+
+def describe_filters(job: db.PurgeJob) -> str:
+    parts = []
+    if job.author_ids:
+        parts.append("sent by " + ", ".join(f"<@{author_id}>" for author_id in job.author_ids))
+    if job.attachments_only:
+        parts.append("with attachments")
+    if job.content_regex:
+        parts.append(f"matching `{job.content_regex}`")
+    if job.after is not None:
+        parts.append(f"sent after message {job.after}")
+    return f" ({', '.join(parts)})" if parts else ""
+
+
+def format_duration(seconds: float) -> str:
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f"{hours}h {minutes}m {seconds}s" if hours else f"{minutes}m {seconds}s"
@@ -0,0 +1,260 @@
+"""
+Rate limit aware REST client used for deleting messages.
+Tracks the per route, per channel bucket state from the X-RateLimit response headers and paces requests to stay just under the limits,
+instead of bursting into 429s and relying on discord.py's internal retry.
+Requests waiting on the global limit are let through oldest-overdue first.
+
+Part of the void.
+"""
+
+import time
+import math
+import heapq
+import random
+import asyncio
+import logging
+import itertools
+from typing import TYPE_CHECKING, Optional, Dict, List, Tuple, Any
+
+import aiohttp
+import discord
+from discord.http import Route
+
+from utils.tracing import tracer
+
+if TYPE_CHECKING:
+    from bot import VBot
+
+log = logging.getLogger(__name__)
+
+
+class DecayingRate:
+    """An exponentially decaying estimate of an event rate (events/sec), updated in O(1) per event."""
+
+    __slots__ = ('tau', '_rate', '_last')
+
+    def __init__(self, tau: float = 30.0):
+        self.tau = tau
+        self._rate = 0.0
+        self._last = time.monotonic()
+
+    def record(self, count: int = 1):
+        now = time.monotonic()
+        self._rate = self._rate * math.exp((self._last - now) / self.tau) + count / self.tau
+        self._last = now
+
+    @property
+    def rate(self) -> float:
+        return self._rate * math.exp((self._last - time.monotonic()) / self.tau)
+
+
+class Bucket:
+    """The last known rate limit state of one route in one channel."""
+
+    __slots__ = ('limit', 'remaining', 'reset_at', 'lock')
+
+    def __init__(self):
+        self.limit: Optional[int] = None
+        self.remaining: Optional[int] = None
+        self.reset_at = 0.0  # time.monotonic() at which the bucket refills
+        self.lock = asyncio.Lock()
+
+    def update(self, headers):
+        if 'X-RateLimit-Remaining' in headers:
+            self.limit = int(headers.get('X-RateLimit-Limit', 1))
+            self.remaining = int(headers['X-RateLimit-Remaining'])
+            self.reset_at = time.monotonic() + float(headers.get('X-RateLimit-Reset-After', 0))
+
+    def delay(self, backlogged: bool) -> float:
+        """How long to wait before the next request so that we stay under the limit."""
+        now = time.monotonic()
+        if self.remaining is None or now >= self.reset_at:
+            return 0.0
+        window = self.reset_at - now
+        if self.remaining <= 0:
+            return window + random.uniform(0, 0.05)
+        if backlogged:
+            # Spread what is left of the bucket across the rest of the window rather than bursting through it.
+            interval = window / (self.remaining + 1)
+            return interval + random.uniform(0, interval * 0.2)
+        return 0.0
+
+
+class GlobalLimiter:
+    """Token bucket for the global rate limit. When requests are waiting, the one with the lowest priority value goes first."""
+
+    def __init__(self, rate: float = 45):
+        self.rate = rate
+        self.tokens = rate
+        self._last = time.monotonic()
+        self._waiters: List[Tuple[float, int, asyncio.Future]] = []
+        self._counter = itertools.count()
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self.blocked_until = 0.0
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.rate, self.tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    async def acquire(self, priority: float):
+        self._refill()
+        if not self._waiters and self.tokens >= 1 and time.monotonic() >= self.blocked_until:
+            self.tokens -= 1
+            return
+
+        future = asyncio.get_event_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(self._counter), future))
+        self._schedule_wakeup()
+        await future
+
+    def _schedule_wakeup(self):
+        if self._timer is None and self._waiters:
+            delay = max((1 - self.tokens) / self.rate, self.blocked_until - time.monotonic(), 0)
+            self._timer = asyncio.get_event_loop().call_later(delay, self._wakeup)
+
+    def _wakeup(self):
+        self._timer = None
+        self._refill()
+        while self._waiters and self.tokens >= 1 and time.monotonic() >= self.blocked_until:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                self.tokens -= 1
+                future.set_result(None)
+        self._schedule_wakeup()
+
+    def block(self, retry_after: float):
+        """Called when the global rate limit has been hit anyway."""
+        self.blocked_until = time.monotonic() + retry_after
+        self.tokens = 0
+
+
+class TransportError(discord.HTTPException):
+    """
+    A request that never got a response from Discord, because of a connection error or a timeout, on every attempt.
+    It is an HTTPException, so that existing handlers keep working, with a status of 0.
+    """
+
+    def __init__(self, error: Exception):
+        self.response = None
+        self.status = 0
+        self.code = 0
+        self.text = str(error) or type(error).__name__
+        self.original = error
+        Exception.__init__(self, f"Could not reach Discord ({type(error).__name__}): {self.text}")
+
+
+class RestClient:
+    """Issues the message delete requests for the DeletionEngine."""
+
+    MAX_RETRIES = 5
+
+    def __init__(self, bot: 'VBot', global_rate: float = 45):
+        self.bot = bot
+        self.buckets: Dict[Tuple[str, int], Bucket] = {}
+        self.global_limiter = GlobalLimiter(global_rate)
+        self.ratelimited = 0  # Number of 429s received.
+        self._session: Optional[aiohttp.ClientSession] = None
+
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession()
+        return self._session
+
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+
+
+    async def delete_message(self, channel_id: int, message_id: int, *, priority: float = 0, backlogged: bool = False):
+        route = Route('DELETE', '/channels/{channel_id}/messages/{message_id}', channel_id=channel_id, message_id=message_id)
+        await self.request(route, 'delete_message', channel_id, priority=priority, backlogged=backlogged)
+
+
+    async def delete_messages(self, channel_id: int, message_ids: List[int], *, priority: float = 0, backlogged: bool = False):
+        route = Route('POST', '/channels/{channel_id}/messages/bulk-delete', channel_id=channel_id)
+        await self.request(route, 'delete_messages', channel_id, json={'messages': message_ids}, priority=priority, backlogged=backlogged)
+
+
+    async def request(self, route: Route, route_name: str, channel_id: int, *, json: Optional[Dict] = None,
+                      priority: float = 0, backlogged: bool = False) -> Any:
+        """
+        Makes a request in the bucket for (route_name, channel_id).
+        'priority' orders requests waiting on the global limit (lower goes first). We use the due time of the oldest message.
+        """
+        bucket = self.buckets.get((route_name, channel_id))
+        if bucket is None:
+            bucket = self.buckets[(route_name, channel_id)] = Bucket()
+
+        headers = {
+            'User-Agent': self.bot.http.user_agent,
+            'Authorization': f"Bot {self.bot.http.token}",
+            'X-Ratelimit-Precision': 'millisecond',
+        }
+
+        with tracer.span(f"rest.{route_name}", channel_id=channel_id) as span:
+            return await self._request(route, route_name, channel_id, bucket, headers, json, priority, backlogged, span)
+
+
+    async def _request(self, route: Route, route_name: str, channel_id: int, bucket: Bucket, headers: Dict[str, str],
+                       json: Optional[Dict], priority: float, backlogged: bool, span) -> Any:
+        lock_wait = tracer.span("ratelimit.bucket_lock")
+        async with bucket.lock:
+            lock_wait.finish()
+            error: Optional[Exception] = None
+            for attempt in range(self.MAX_RETRIES):
+                span.tag('attempts', attempt + 1)
+                with tracer.span("ratelimit.wait"):
+                    delay = bucket.delay(backlogged)
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                    await self.global_limiter.acquire(priority)
+
+                with tracer.span("http", method=route.method) as http_span:
+                    try:
+                        async with self.session.request(route.method, route.url, headers=headers, json=json) as response:
+                            bucket.update(response.headers)
+                            data = await discord.http.json_or_text(response)
+                    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                        # Connection resets, DNS failures and timeouts. Back off and retry, like a 5xx.
+                        error = e
+                        http_span.tag('error', type(e).__name__)
+                        log.warning(f"Request {route_name} in channel {channel_id} failed ({type(e).__name__}: {e}). "
+                                    f"Retrying in {1 + attempt * 2}s.")
+                        await asyncio.sleep(1 + attempt * 2)
+                        continue
+                    error = None
+                    http_span.tag('status', response.status)
+
+                    if 200 <= response.status < 300:
+                        return data
+
+                    if response.status == 429:
+                        self.ratelimited += 1
+                        retry_after = float(response.headers.get('X-RateLimit-Reset-After') or response.headers.get('Retry-After') or 0)
+                        if not retry_after and isinstance(data, dict):
+                            retry_after = data.get('retry_after', 1000) / 1000  # v7 reports this in ms.
+                        log.warning(f"Rate limited on {route_name} in channel {channel_id}. Retrying in {retry_after:.2f}s.")
+                        if response.headers.get('X-RateLimit-Global') or (isinstance(data, dict) and data.get('global')):
+                            self.global_limiter.block(retry_after)
+                        else:
+                            bucket.remaining = 0
+                            bucket.reset_at = time.monotonic() + retry_after
+                        continue
+
+                    if response.status in {500, 502, 503, 504}:
+                        await asyncio.sleep(1 + attempt * 2)
+                        continue
+
+                    if response.status == 403:
+                        raise discord.Forbidden(response, data)
+                    if response.status == 404:
+                        raise discord.NotFound(response, data)
+                    raise discord.HTTPException(response, data)
+
+            if error is not None:
+                raise TransportError(error) from error
+            raise discord.HTTPException(response, data)
@@ -0,0 +1,113 @@
+"""
+Opt-in recorder of gateway traffic timing, so that real traffic can be replayed offline with benchmarks.replay.
+Only metadata is kept, one JSON object per line:
+    t: seconds since the recording started
+    e: the event type
+    g, c: salted hashes of the guild and channel IDs
+    w: 1 if the message was sent by a webhook
+    d: the delete_after of the channel, for messages in enabled void channels
+    n: the number of messages in a MESSAGE_DELETE_BULK
+No content, user or message IDs are recorded, and the salt is never written, so the IDs can not be recovered from a recording.
+The first line is a header with the format version and the wall clock start time.
+
+Part of the void.
+"""
+
+import os
+import json
+import time
+import hashlib
+import logging
+from typing import TYPE_CHECKING, Optional, Callable, Dict, Any, FrozenSet, IO
+
+if TYPE_CHECKING:
+    import db
+
+log = logging.getLogger(__name__)
+
+FORMAT = "void-gateway-recording"
+VERSION = 1
+
+RECORDED_EVENTS = frozenset({
+    'MESSAGE_CREATE', 'MESSAGE_UPDATE', 'MESSAGE_DELETE', 'MESSAGE_DELETE_BULK', 'MESSAGE_REACTION_ADD',
+    'CHANNEL_CREATE', 'CHANNEL_DELETE', 'WEBHOOKS_UPDATE',
+})
+
+
+class GatewayRecorder:
+
+    def __init__(self, path: str, max_bytes: int = 100 * 1024 * 1024, salt: Optional[str] = None,
+                 events: FrozenSet[str] = RECORDED_EVENTS):
+        """
+        Recording stops once 'max_bytes' have been written.
+        Give a 'salt' to get the same hashes across restarts and cluster workers, otherwise a random one is used.
+        """
+        self.path = path
+        self.max_bytes = max_bytes
+        self.events = events
+        self._salt = salt.encode() if salt is not None else os.urandom(16)
+        self._hashes: Dict[int, int] = {}
+        self.void_lookup: Optional[Callable[[int], Optional['db.VoidChannel']]] = None  # Set by the Void cog while it is loaded.
+        self.recorded = 0
+        self.written = 0
+        self._start = time.monotonic()
+        self._file: Optional[IO[str]] = open(path, 'a', buffering=64 * 1024)  # Writes only hit the disk once 64KB have been buffered.
+        self._write(json.dumps({'format': FORMAT, 'version': VERSION, 'started_at': time.time()}) + "\n")
+        log.info(f"Recording gateway traffic to {path}.")
+
+
+    @property
+    def active(self) -> bool:
+        return self._file is not None
+
+
+    def _hash(self, snowflake: int) -> int:
+        hashed = self._hashes.get(snowflake)
+        if hashed is None:
+            if len(self._hashes) > 100000:
+                self._hashes.clear()
+            digest = hashlib.blake2b(snowflake.to_bytes(8, 'little'), digest_size=6, key=self._salt).digest()
+            hashed = self._hashes[snowflake] = int.from_bytes(digest, 'little')
+        return hashed
+
+
+    def _write(self, line: str):
+        self._file.write(line)
+        self.written += len(line)
+        if self.written >= self.max_bytes:
+            log.warning(f"Stopped recording gateway traffic to {self.path}: The {self.max_bytes} byte limit has been reached.")
+            self.close()
+
+
+    def record(self, msg: Dict[str, Any]):
+        """Records a raw gateway message if it is a dispatch of one of the recorded events. Called for every gateway message."""
+        event = msg.get('t')
+        if event not in self.events or self._file is None:
+            return
+
+        data = msg.get('d') or {}
+        guild_id = data.get('guild_id')
+        channel_id = data.get('id') if event.startswith('CHANNEL_') else data.get('channel_id')
+        line = f'{{"t":{time.monotonic() - self._start:.4f},"e":"{event}"'
+        if guild_id is not None:
+            line += f',"g":{self._hash(int(guild_id))}'
+        if channel_id is not None:
+            line += f',"c":{self._hash(int(channel_id))}'
+
+        if event == 'MESSAGE_CREATE':
+            line += f',"w":{1 if data.get("webhook_id") else 0}'
+            void_ch = self.void_lookup(int(channel_id)) if self.void_lookup is not None else None
+            if void_ch is not None and void_ch.enabled:
+                line += f',"d":{void_ch.delete_after}'
+        elif event == 'MESSAGE_DELETE_BULK':
+            line += f',"n":{len(data.get("ids", ()))}'
+
+        self.recorded += 1
+        self._write(line + "}\n")
+
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+            log.info(f"Recorded {self.recorded} gateway events to {self.path}.")
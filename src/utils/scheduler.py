@@ -0,0 +1,71 @@
+"""
+A single heap based scheduler for the pending message deletions.
+Each pending deletion is stored as a compact (due_time, channel_id, message_id) tuple and they are fired in due order
+from one timer handle, instead of keeping a sleeping task (and the Message object it references) alive per message.
+
+Part of the void.
+"""
+
+import time
+import heapq
+import asyncio
+import logging
+import contextvars
+from typing import Optional, List, Tuple, Callable
+
+log = logging.getLogger(__name__)
+
+
+class DeletionScheduler:
+
+    def __init__(self, loop: asyncio.AbstractEventLoop, fire: Callable[[int, int, float], None]):
+        """
+        'fire' is called with (channel_id, message_id, due) once an entry comes due.
+        Due times are unix timestamps so they can be derived directly from the message snowflakes.
+        """
+        self.loop = loop
+        self.fire = fire
+        self._heap: List[Tuple[float, int, int]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._timer_due: float = 0
+
+
+    def __len__(self):
+        return len(self._heap)
+
+
+    def schedule(self, channel_id: int, message_id: int, due: float):
+        """Schedules a message to be fired at the unix timestamp 'due'."""
+        heapq.heappush(self._heap, (due, channel_id, message_id))
+        if self._timer is None or due < self._timer_due:
+            self._arm(due)
+
+
+    def stop(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+
+    def _arm(self, due: float):
+        if self._timer is not None:
+            self._timer.cancel()
+        # Fire in a fresh context, not in the context of whatever call happened to arm the timer (e.g. a traced on_message).
+        self._timer = self.loop.call_later(max(0.0, due - time.time()), self._run, context=contextvars.Context())
+        self._timer_due = due
+
+
+    def _run(self):
+        """Fires everything that is due, then re-arms the timer for the next entry."""
+        self._timer = None
+        heap = self._heap
+        now = time.time()
+        while heap and heap[0][0] <= now:
+            due, channel_id, message_id = heapq.heappop(heap)
+            try:
+                self.fire(channel_id, message_id, due)
+            except Exception as e:
+                log.exception(f"Error firing deletion of {message_id} in channel {channel_id}: {e}")
+
+        if heap:
+            self._arm(heap[0][0])
@@ -0,0 +1,98 @@
+"""
+Catch-up sweeper for messages that were posted into void channels while the bot was down or disconnected from the gateway.
+Pages through the history of each enabled void channel newer than its stored high water mark
+and schedules everything it finds for deletion. Anything already past its delete_after comes due immediately and is bulk deleted.
+
+Part of the void.
+"""
+
+import time
+import asyncio
+import logging
+from typing import TYPE_CHECKING, Optional, Dict, List, Tuple, Callable, Awaitable
+
+import discord
+
+import db
+from utils.deletionEngine import DeletionEngine, snowflake_timestamp
+from utils.pendingStore import PendingDeletionStore
+
+if TYPE_CHECKING:
+    from bot import VBot
+
+log = logging.getLogger(__name__)
+
+
+class CatchUpSweeper:
+
+    def __init__(self, bot: 'VBot', get_deleter: Callable[[int], DeletionEngine], store: Optional[PendingDeletionStore],
+                 is_exempt: Callable[[discord.Message], Awaitable[bool]], concurrency: int = 4, unmarked_limit: int = 500):
+        """
+        'get_deleter' returns the DeletionEngine responsible for a guild ID.
+        'is_exempt' decides if a message found in the history should be left alone.
+        'concurrency' is the max number of channels that are swept at the same time.
+        'unmarked_limit' is how far back to look in channels that do not have a high water mark yet.
+        """
+        self.bot = bot
+        self.get_deleter = get_deleter
+        self.store = store
+        self.is_exempt = is_exempt
+        self.concurrency = concurrency
+        self.unmarked_limit = unmarked_limit
+        self.running = False
+
+
+    async def sweep(self):
+        if self.running:
+            log.info("A catch-up sweep is already running. Skipping.")
+            return
+
+        self.running = True
+        try:
+            start = time.perf_counter()
+            void_channels = await db.get_all_void_channel(self.bot.db_pool) or []
+            void_channels = [void_ch for void_ch in void_channels if void_ch.enabled and void_ch.mode == db.MODE_MESSAGE]  # The PeriodicSweeper has the rest.
+            marks = await self.store.load_high_water() if self.store is not None else {}
+
+            semaphore = asyncio.Semaphore(self.concurrency)
+            results = await asyncio.gather(*[self._sweep_channel(semaphore, void_ch, marks.get(void_ch.channel_id))
+                                             for void_ch in void_channels])
+
+            scanned = sum(result[0] for result in results)
+            overdue = sum(result[1] for result in results)
+            log.info(f"Catch-up sweep of {len(void_channels)} void channels finished in {time.perf_counter() - start:.2f}s. "
+                     f"Scanned {scanned} messages, {overdue} were overdue and {scanned - overdue} were scheduled.")
+        finally:
+            self.running = False
+
+
+    async def _sweep_channel(self, semaphore: asyncio.Semaphore, void_ch: db.VoidChannel, high_water: Optional[int]) -> Tuple[int, int]:
+        """Returns the number of messages that were scanned and how many of those were overdue."""
+        channel: Optional[discord.TextChannel] = self.bot.get_channel(void_ch.channel_id)
+        if channel is None:
+            return 0, 0
+
+        deleter = self.get_deleter(void_ch.server_id)
+        scanned = 0
+        overdue = 0
+        async with semaphore:
+            if high_water is not None:
+                history = channel.history(limit=None, after=discord.Object(id=high_water), oldest_first=True)
+            else:
+                history = channel.history(limit=self.unmarked_limit)
+
+            now = time.time()
+            try:
+                async for message in history:
+                    if await self.is_exempt(message):
+                        continue
+                    scanned += 1
+                    if snowflake_timestamp(message.id) + void_ch.delete_after <= now:
+                        overdue += 1
+                    deleter.schedule(channel.id, message.id, void_ch.delete_after)
+            except discord.Forbidden:
+                log.warning(f"Missing permissions to read the history of void channel {channel.id}.")
+            except discord.HTTPException as e:
+                log.warning(f"Could not sweep void channel {channel.id}: {e}")
+
+        return scanned, overdue
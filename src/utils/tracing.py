@@ -0,0 +1,236 @@
+"""
+Sampled span tracing of the message to deletion pipeline.
+A sampled message starts a trace in on_message. The DB queries, the wait until the message is due, the wait in the deletion
+queue, the deletion batch, and the REST calls and rate limit waits within it are recorded as spans of that trace.
+Finished spans are exported from a background task to a rotating JSONL file, one Zipkin v2 span per line.
+
+When a message is not sampled, tracer.span() returns NULL_SPAN after a single context variable lookup, so the cost is near zero.
+
+Part of the void.
+"""
+
+import json
+import time
+import random
+import asyncio
+import logging
+import contextvars
+from collections import deque
+from logging.handlers import RotatingFileHandler
+from typing import Optional, Dict, List, Tuple, Deque, Any
+
+log = logging.getLogger(__name__)
+
+SERVICE_NAME = "void"
+MAX_FOLLOWED = 10000  # Cap on the sampled messages waiting to be deleted.
+MAX_QUEUED = 50000  # Cap on the finished spans waiting to be exported. Spans are dropped beyond this.
+
+Parent = Tuple[str, Optional[str]]  # (trace_id, parent span_id)
+
+_current: 'contextvars.ContextVar[Optional[Span]]' = contextvars.ContextVar('current_span', default=None)
+
+
+def _span_id() -> str:
+    return f"{random.getrandbits(64):016x}"
+
+
+class Span:
+    """
+    A span that belongs to one or more traces. A deletion batch can hold several sampled messages, so its span
+    (and all of its children) is recorded once in each of their traces.
+    """
+
+    __slots__ = ('tracer', 'name', 'parents', 'span_id', 'start', 'end', 'tags', '_token')
+
+    sampled = True
+
+    def __init__(self, tracer: 'Tracer', name: str, parents: List[Parent], start: Optional[float] = None, **tags):
+        self.tracer = tracer
+        self.name = name
+        self.parents = parents
+        self.span_id = _span_id()
+        self.start = time.time() if start is None else start
+        self.end: Optional[float] = None
+        self.tags: Dict[str, str] = {key: str(value) for key, value in tags.items()}
+        self._token: Optional[contextvars.Token] = None
+
+
+    def tag(self, key: str, value: Any):
+        self.tags[key] = str(value)
+
+
+    def context(self) -> List[Parent]:
+        """The parents for the children of this span."""
+        return [(trace_id, self.span_id) for trace_id, _ in self.parents]
+
+
+    def finish(self, end: Optional[float] = None):
+        if self.end is None:
+            self.end = time.time() if end is None else end
+            self.tracer.export(self)
+
+
+    def __enter__(self) -> 'Span':
+        self._token = _current.set(self)
+        return self
+
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None and exc_type is not asyncio.CancelledError:
+            self.tag('error', f"{exc_type.__name__}: {exc}")
+        _current.reset(self._token)
+        self.finish()
+
+
+class _NullSpan:
+    """Stands in for a span when nothing is being traced."""
+
+    __slots__ = ()
+
+    sampled = False
+
+    def tag(self, key: str, value: Any):
+        pass
+
+    def context(self) -> List[Parent]:
+        return []
+
+    def finish(self, end: Optional[float] = None):
+        pass
+
+    def __enter__(self) -> '_NullSpan':
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        pass
+
+
+NULL_SPAN = _NullSpan()
+
+
+class Tracer:
+
+    def __init__(self):
+        self.sample_ratio = 0.0
+        self.followed: Dict[int, Tuple[List[Parent], float]] = {}  # message_id -> (parents, time it was scheduled)
+        self.dropped = 0
+        self._queue: Deque[Dict[str, Any]] = deque()
+        self._file_log: Optional[logging.Logger] = None
+        self._task: Optional[asyncio.Task] = None
+
+
+    def configure(self, loop: asyncio.AbstractEventLoop, sample_ratio: float, path: str = "traces.jsonl",
+                  max_bytes: int = 10 * 1024 * 1024, backups: int = 3, interval: float = 1.0):
+        """Starts sampling 'sample_ratio' of the messages and exporting their traces to 'path'."""
+        self.sample_ratio = sample_ratio
+        if sample_ratio <= 0 or self._task is not None:
+            return
+
+        handler = RotatingFileHandler(path, maxBytes=max_bytes, backupCount=backups)
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        self._file_log = logging.getLogger(f"{__name__}.export")
+        self._file_log.propagate = False
+        self._file_log.setLevel(logging.INFO)
+        self._file_log.addHandler(handler)
+        self._task = loop.create_task(self._run(interval))
+        log.info(f"Tracing {sample_ratio:.2%} of messages to {path}")
+
+
+    def trace(self, name: str, **tags) -> Any:
+        """Starts a new trace for 'sample_ratio' of the calls. Otherwise returns NULL_SPAN."""
+        if self.sample_ratio and random.random() < self.sample_ratio:
+            return Span(self, name, [(f"{random.getrandbits(128):032x}", None)], **tags)
+        return NULL_SPAN
+
+
+    def span(self, name: str, parents: Optional[List[Parent]] = None, start: Optional[float] = None, **tags) -> Any:
+        """
+        Starts a child span of the current span, or of 'parents' when given.
+        Returns NULL_SPAN when there is nothing to attach it to.
+        """
+        if parents is None:
+            current = _current.get()
+            if current is None:
+                return NULL_SPAN
+            parents = current.context()
+        if not parents:
+            return NULL_SPAN
+        return Span(self, name, parents, start=start, **tags)
+
+
+    def follow(self, message_id: int, span: Any):
+        """Carries the trace of a sampled message over to its deletion."""
+        if span.sampled and len(self.followed) < MAX_FOLLOWED:
+            self.followed[message_id] = (span.context(), time.time())
+
+
+    def pop_followed(self, batch: List[Tuple[float, int]]) -> List[Parent]:
+        """
+        Takes the traces of any sampled messages in a deletion batch of (due, message_id).
+        Records how long each one waited to come due and then waited in the queue, and returns the parents for the batch span.
+        """
+        parents = []
+        now = time.time()
+        for due, message_id in batch:
+            followed = self.followed.pop(message_id, None)
+            if followed is None:
+                continue
+            message_parents, scheduled_at = followed
+            Span(self, "scheduled", message_parents, start=scheduled_at, message_id=message_id).finish(max(due, scheduled_at))
+            Span(self, "queued", message_parents, start=min(due, now), message_id=message_id).finish(now)
+            parents.extend(message_parents)
+        return parents
+
+
+    def export(self, span: Span):
+        if len(self._queue) >= MAX_QUEUED:
+            self.dropped += 1
+            return
+        for trace_id, parent_id in span.parents:
+            record = {
+                'traceId': trace_id,
+                'id': span.span_id,
+                'name': span.name,
+                'timestamp': int(span.start * 1_000_000),
+                'duration': max(1, int((span.end - span.start) * 1_000_000)),
+                'localEndpoint': {'serviceName': SERVICE_NAME},
+                'tags': span.tags,
+            }
+            if parent_id is not None:
+                record['parentId'] = parent_id
+            self._queue.append(record)
+
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await self.flush()
+
+
+    async def flush(self):
+        if not self._queue or self._file_log is None:
+            return
+        records = list(self._queue)
+        self._queue.clear()
+        await asyncio.get_event_loop().run_in_executor(None, self._write, records)
+
+
+    def _write(self, records: List[Dict[str, Any]]):
+        """Runs in the executor so that serializing and writing never block the event loop."""
+        for record in records:
+            self._file_log.info(json.dumps(record, separators=(',', ':')))
+
+
+    async def _run(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.flush()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log.exception(f"Error exporting traces: {e}")
+
+
+tracer = Tracer()
@@ -133,11 +133,14 @@ class Page:
 class BoolPage(Page):
 
     def __init__(self, name: Optional[str] = None, body: Optional[str] = None,
-                 callback: Callable = do_nothing, additional: str = None, embed: Optional[discord.Embed] = None, previous_msg: Optional[Union[discord.Message, PageResponse]] = None, timeout: int = 120.0):
+                 callback: Callable = do_nothing, additional: str = None, embed: Optional[discord.Embed] = None, previous_msg: Optional[Union[discord.Message, PageResponse]] = None, timeout: int = 120.0,
+                 on_sent: Optional[Callable[[discord.Message], None]] = None):
         """
         Callback signature: page: reactMenu.Page, _client: commands.Bot, ctx: commands.Context, response: bool
+        'on_sent' is called with the page message as soon as it has been sent, before waiting on the reactions.
         """
         self.ctx = None
+        self.on_sent = on_sent
         self.match = None
         self.canceled = False
 
@@ -156,6 +159,8 @@ class BoolPage(Page):
             self.page_message = await channel.send(self.construct_std_page_msg())
         else:
             self.page_message = await channel.send(self.construct_std_page_msg(), embed=self.embed)
+        if self.on_sent is not None:
+            self.on_sent(self.page_message)
 
         try:
             await self.page_message.add_reaction("✅")
@@ -166,21 +171,20 @@ class BoolPage(Page):
             raise e
 
 
-        def react_check(_reaction: discord.Reaction, _user):
-            self.LOG.info("Checking Reaction: Reacted Message: {}, orig message: {}".format(_reaction.message.id,
-                                                                                            self.page_message.id))
-
-            return _user == ctx.author and (str(_reaction.emoji) == '✅' or str(_reaction.emoji) == '❌')
+        def react_check(payload: discord.RawReactionActionEvent):
+            # Uses the raw event so that this still works when the message cache is disabled.
+            return payload.message_id == self.page_message.id and payload.user_id == ctx.author.id and \
+                   (str(payload.emoji) == '✅' or str(payload.emoji) == '❌')
 
 
         try:
-            reaction, react_user = await self.ctx.bot.wait_for('reaction_add', timeout=self.timeout, check=react_check)
-            if str(reaction.emoji) == '✅':
+            payload = await self.ctx.bot.wait_for('raw_reaction_add', timeout=self.timeout, check=react_check)
+            if str(payload.emoji) == '✅':
                 self.response = True
                 await self.remove()
                 await self.callback(self, self.ctx.bot, ctx, True)
                 return True
-            elif str(reaction.emoji) == '❌':
+            elif str(payload.emoji) == '❌':
                 self.response = False
                 await self.remove()
                 await self.callback(self, self.ctx.bot, ctx, False)
@@ -0,0 +1,90 @@
+"""
+Watchdog for event loop stalls.
+A background thread checks how overdue the timer of the LoopLagMonitor is. When the loop has been stuck for longer than the
+threshold, the stack of the event loop thread is captured while it is still stuck, which shows the blocking call.
+Once the loop runs again the stall is logged, and reported to the error log channel at most once per report interval.
+Stalls in between are counted and mentioned in the next report.
+
+Part of the void.
+"""
+
+import sys
+import time
+import logging
+import threading
+import traceback
+from typing import TYPE_CHECKING, Optional
+
+from utils.misc import log_error_msg
+from utils.metrics import LoopLagMonitor
+
+if TYPE_CHECKING:
+    from bot import VBot
+
+log = logging.getLogger(__name__)
+
+
+class StallWatchdog:
+
+    def __init__(self, bot: 'VBot', monitor: LoopLagMonitor, threshold: float = 0.5, report_interval: float = 300,
+                 check_interval: float = 0.1):
+        self.bot = bot
+        self.monitor = monitor
+        self.threshold = threshold
+        self.report_interval = report_interval
+        self.check_interval = check_interval
+        self.stalls = 0
+        self.suppressed = 0  # Stalls since the last report that was sent.
+        self._last_report = 0.0
+        self._loop_thread_id: Optional[int] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+
+    def start(self):
+        """Must be called from the event loop thread."""
+        if self._thread is not None:
+            return
+        self._loop_thread_id = threading.get_ident()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="void-stall-watchdog", daemon=True)
+        self._thread.start()
+
+
+    def stop(self):
+        self._stop.set()
+        self._thread = None
+
+
+    def _run(self):
+        loop = self.bot.loop
+        while not self._stop.wait(self.check_interval):
+            expected = self.monitor.expected
+            if not loop.is_running() or expected is None or loop.time() - expected < self.threshold:
+                continue
+
+            # The loop is stuck. Capture what it is doing, then wait for the monitor to re-arm its timer.
+            frame = sys._current_frames().get(self._loop_thread_id)
+            stack = "".join(traceback.format_stack(frame)) if frame is not None else "The event loop thread is gone."
+            del frame
+            while self.monitor.expected == expected and not self._stop.wait(self.check_interval):
+                pass
+            if not self._stop.is_set():
+                loop.call_soon_threadsafe(self._stalled, self.monitor.last_lag, stack)
+
+
+    def _stalled(self, duration: float, stack: str):
+        """Called in the event loop once a stall is over."""
+        self.stalls += 1
+        log.warning(f"The event loop was stalled for {duration:.2f}s. It was stuck in:\n{stack}")
+
+        now = time.monotonic()
+        if now - self._last_report < self.report_interval:
+            self.suppressed += 1
+            return
+        self._last_report = now
+        header = f"⚠ The event loop was stalled for **{duration:.2f}s** (threshold {self.threshold:.2f}s)."
+        if self.suppressed:
+            header += f" {self.suppressed} more stalls were not reported since the last report."
+        self.suppressed = 0
+        self.bot.loop.create_task(log_error_msg(self.bot, stack[-1900:], header=header, code_block=True))
@@ -0,0 +1,129 @@
+"""
+Cache of the webhooks that the proxy command sends through, one per channel.
+The webhook IDs and tokens are kept in the DB, so they survive a restart, and are preloaded into a bounded LRU at startup.
+Channels that fell out of the LRU are looked up in the DB before falling back to fetching or creating the webhook from Discord.
+Entries are invalidated when the channel is deleted, and when Discord reports that the webhooks of the channel changed and ours is gone.
+
+The IDs of all our webhooks are kept in a set of their own, which is not bounded, so that Void.is_exempt can recognise
+proxy messages without a lookup, even for channels that are not in the LRU.
+
+Webhooks are built on the HTTP session of discord.py, like the ones that channel.webhooks() returns, so no session of our own
+is opened for the sends.
+
+Part of the void.
+"""
+
+import logging
+from collections import OrderedDict
+from typing import TYPE_CHECKING, Optional, Set
+
+import discord
+
+import db
+
+if TYPE_CHECKING:
+    from bot import VBot
+
+log = logging.getLogger(__name__)
+
+
+class WebhookCache:
+
+    def __init__(self, bot: 'VBot', max_size: int = 1000):
+        self.bot = bot
+        self.max_size = max_size
+        self._entries: 'OrderedDict[int, db.ProxyWebhook]' = OrderedDict()  # channel_id -> webhook, least recently used first
+        self.webhook_ids: Set[int] = set()  # Every webhook of ours that we know of. Never evicted.
+        self.hits = 0
+        self.misses = 0
+
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+    async def load(self):
+        """Preloads the webhooks stored in the DB."""
+        webhooks = await db.get_all_webhooks(self.bot.db_pool)
+        if webhooks is None:
+            log.error("Could not load the webhook cache! Webhooks will be fetched from Discord as they are needed.")
+            return
+        for webhook in webhooks:
+            self.webhook_ids.add(webhook.webhook_id)
+            if len(self._entries) < self.max_size:
+                self._entries[webhook.channel_id] = webhook
+        log.info(f"Loaded {len(self._entries)} of {len(webhooks)} proxy webhooks into the cache.")
+
+
+    def _put(self, webhook: db.ProxyWebhook):
+        self.webhook_ids.add(webhook.webhook_id)
+        self._entries[webhook.channel_id] = webhook
+        self._entries.move_to_end(webhook.channel_id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+
+    def _build(self, webhook: db.ProxyWebhook, channel: discord.TextChannel) -> discord.Webhook:
+        data = {'id': webhook.webhook_id, 'token': webhook.token, 'type': discord.WebhookType.incoming.value,
+                'channel_id': channel.id, 'guild_id': channel.guild.id}
+        return discord.Webhook.from_state(data, self.bot._connection)
+
+
+    async def get(self, channel: discord.TextChannel) -> discord.Webhook:
+        """
+        Gets our webhook for the channel. Creates one if it does not exist.
+        Raises discord.Forbidden if we are missing the Manage Webhooks permission and have to fetch or create it.
+        """
+        webhook = self._entries.get(channel.id)
+        if webhook is not None:
+            self._entries.move_to_end(channel.id)
+            self.hits += 1
+            return self._build(webhook, channel)
+
+        self.misses += 1
+        webhook = await db.get_webhook(self.bot.db_pool, channel.id)
+        if webhook is None:
+            existing_webhooks = await channel.webhooks()
+            discord_webhook = discord.utils.get(existing_webhooks, user=self.bot.user)
+
+            if discord_webhook is None:
+                log.warning("Webhook did not exist in channel {}! Creating new webhook!".format(channel.name))
+                discord_webhook = await channel.create_webhook(name="void", reason="Creating webhook for void")
+
+            webhook = db.ProxyWebhook(channel_id=channel.id, webhook_id=discord_webhook.id, token=discord_webhook.token)
+            await db.set_webhook(self.bot.db_pool, webhook.channel_id, webhook.webhook_id, webhook.token)
+
+        self._put(webhook)
+        return self._build(webhook, channel)
+
+
+    async def invalidate(self, channel_id: int):
+        """
+        Forgets the webhook of a channel, in memory and in the DB. The next get() fetches it from Discord again.
+        Its ID stays in webhook_ids: Webhook IDs are never reused, so a message from it is still one of ours.
+        """
+        if self._entries.pop(channel_id, None) is not None:
+            log.debug(f"Invalidated the cached webhook of channel {channel_id}.")
+        await db.remove_webhook(self.bot.db_pool, channel_id)
+
+
+    async def verify(self, channel: discord.TextChannel):
+        """
+        Invalidates the webhook of a channel if it no longer exists on Discord.
+        Discord doesn't say which webhook changed, and creating our own webhook fires the same event, so the webhooks of the channel are checked first.
+        """
+        webhook = self._entries.get(channel.id)
+        if webhook is None:
+            webhook = await db.get_webhook(self.bot.db_pool, channel.id)
+            if webhook is None:
+                return  # Nothing is stored for the channel, so there is nothing to invalidate.
+
+        try:
+            existing_webhooks = await channel.webhooks()
+        except discord.HTTPException as e:
+            # Keep it. If it is gone after all, the proxy command invalidates it when the send fails.
+            log.debug(f"Could not check the webhooks of channel {channel.id}: {e}")
+            return
+
+        if discord.utils.get(existing_webhooks, id=webhook.webhook_id) is None:
+            await self.invalidate(channel.id)